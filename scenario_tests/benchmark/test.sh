@@ -0,0 +1,58 @@
+#!/usr/bin/env bash
+
+# exit immediately if test fails
+set -e
+
+source ../test-env.sh
+
+# Determine docker compose version to use
+if [[ $(dpkg -l | grep "docker-compose") > /dev/null ]];then
+    VERSION='docker-compose'
+  else
+    VERSION='docker compose'
+fi
+
+# Cases to run, all when empty (see tests/bench.py)
+BENCH_CASES="${BENCH_CASES:-}"
+
+run_benchmarks() {
+  local docker_cmd="$1"
+  local compose_file="$2"
+
+  local compose_args=()
+
+  # Only add -f if NOT default compose file
+  if [[ "${compose_file}" != "docker-compose.yml" ]]; then
+    compose_args=(-f "${compose_file}")
+  fi
+
+  echo "Starting services using ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" up -d
+
+  echo "Generating ${BENCH_SHAPE:-mixed} dataset for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/bench.sh generate
+
+  echo "Running benchmarks for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/bench.sh run ${BENCH_CASES}
+
+  echo "Bringing down services for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" down -v
+}
+
+mkdir -p results
+: > results/results.jsonl
+
+compose_names=("docker-compose.yml" "docker-compose-s3.yml")
+for compose_file in "${compose_names[@]}"; do
+
+  run_benchmarks "${VERSION}" "${compose_file}"
+done
+
+if [[ "${BENCH_UPDATE_BASELINE:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+  python3 tests/bench.py compare results/results.jsonl results/baseline.json --update
+elif [[ -f results/baseline.json ]]; then
+  python3 tests/bench.py compare results/results.jsonl results/baseline.json \
+    --tolerance "${BENCH_TOLERANCE:-0.2}"
+else
+  echo "No results/baseline.json, run with BENCH_UPDATE_BASELINE=true to record one"
+fi
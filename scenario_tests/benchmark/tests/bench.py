@@ -0,0 +1,343 @@
+"""Backup and restore benchmarks.
+
+Usage:
+    bench.py generate
+    bench.py run [case ...]
+    bench.py compare <results.jsonl> <baseline.json> [--tolerance 0.2] [--update]
+
+generate fills the database with a synthetic dataset. BENCH_SHAPE picks
+its shape (small_tables, huge_tables, postgis, large_objects or mixed)
+and BENCH_SIZE_MB its approximate size. The data is seeded, so every
+run generates the same dataset.
+
+run backs up and restores the database once per case (all cases by
+default). Each measurement is appended to /results/results.jsonl as
+one JSON line: wall time, MB/s, peak RSS, peak disk use and the phase
+timings from the metrics report.
+
+compare checks results against a stored baseline. It exits 1 when a
+throughput drops, or peak memory or disk grows, by more than the
+tolerance. --update writes the results as the new baseline instead.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+PGENV = "/backup-scripts/pgenv.sh"
+RESULTS = "/results/results.jsonl"
+RESTORE_DB = "bench_restore"
+MB = 1000 * 1000
+
+CASES = {
+    "custom": {"DUMP_ARGS": "-Fc"},
+    "custom-checksum": {"DUMP_ARGS": "-Fc", "CHECKSUM_VALIDATION": "true"},
+    "custom-encrypted": {"DUMP_ARGS": "-Fc", "DB_DUMP_ENCRYPTION": "true"},
+    "directory": {"DUMP_ARGS": "-Fd"},
+    "directory-checksum": {"DUMP_ARGS": "-Fd", "CHECKSUM_VALIDATION": "true"},
+    "directory-encrypted": {"DUMP_ARGS": "-Fd", "DB_DUMP_ENCRYPTION": "true"},
+}
+
+# Settings every case starts from, so only the case overrides differ
+BASE_SETTINGS = {
+    "DBLIST": "gis",
+    "ARCHIVE_FILENAME": "latest",
+    "TARGET_DB": RESTORE_DB,
+    "CHECKSUM_VALIDATION": "false",
+    "DB_DUMP_ENCRYPTION": "false",
+    "CHANGE_DETECTION": "false",
+    "REMOVE_BEFORE": "0",
+    "METRICS_ENABLED": "true",
+}
+
+
+############################################
+# Dataset
+############################################
+def connect():
+    from utils.utils import DBConnection
+
+    db = DBConnection()
+    db.conn.autocommit = True
+    return db
+
+
+def generate_tables(cursor, prefix, count, total_bytes):
+    # Rows carry roughly 100 bytes of half-compressible text
+    rows = max(total_bytes // 100 // count, 1)
+    for index in range(count):
+        table = f"{prefix}_{index:04d}"
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"""
+            CREATE TABLE {table} AS
+            SELECT i AS id,
+                   md5(i::text) AS name,
+                   random() AS value,
+                   repeat(md5((i * {index + 1})::text), 2) AS payload
+            FROM generate_series(1, {rows}) AS i
+        """)
+
+
+def generate_postgis(cursor, total_bytes):
+    rows = max(total_bytes // 600, 1)
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+    cursor.execute("DROP TABLE IF EXISTS bench_geometry")
+    cursor.execute(f"""
+        CREATE TABLE bench_geometry AS
+        SELECT i AS id,
+               ST_Buffer(ST_SetSRID(ST_MakePoint(random() * 360 - 180, random() * 170 - 85), 4326),
+                         random(), 8)::geometry(Polygon, 4326) AS geom
+        FROM generate_series(1, {rows}) AS i
+    """)
+    cursor.execute("CREATE INDEX ON bench_geometry USING gist (geom)")
+
+
+def generate_large_objects(cursor, total_bytes):
+    # Random bytes do not compress, unlike the table payloads
+    size = 4 * 1024 * 1024
+    cursor.execute("SELECT lo_unlink(oid) FROM pg_largeobject_metadata")
+    for _ in range(max(total_bytes // size, 1)):
+        cursor.execute(f"""
+            SELECT lo_from_bytea(0, decode(string_agg(md5(random()::text), ''), 'hex'))
+            FROM generate_series(1, {size // 16})
+        """)
+
+
+def generate(shape, size_mb):
+    total = size_mb * 1024 * 1024
+    db = connect()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT setseed(0.42)")
+        if shape in ("small_tables", "mixed"):
+            generate_tables(cursor, "bench_small", 500 if shape == "small_tables" else 200,
+                            total if shape == "small_tables" else total // 4)
+        if shape in ("huge_tables", "mixed"):
+            generate_tables(cursor, "bench_huge", 3 if shape == "huge_tables" else 1,
+                            total if shape == "huge_tables" else total // 4)
+        if shape in ("postgis", "mixed"):
+            generate_postgis(cursor, total if shape == "postgis" else total // 4)
+        if shape in ("large_objects", "mixed"):
+            generate_large_objects(cursor, total if shape == "large_objects" else total // 4)
+        cursor.execute("VACUUM ANALYZE")
+        cursor.execute("SELECT pg_database_size(current_database())")
+        print(f"Generated {shape} dataset of {cursor.fetchone()[0] / MB:.1f} MB")
+
+
+############################################
+# Measurements
+############################################
+def disk_usage(paths):
+    used = 0
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    used += os.lstat(os.path.join(root, name)).st_blocks * 512
+                except OSError:
+                    pass
+    return used
+
+
+def measure(command, watch):
+    """Run a command and report its wall time, peak RSS and peak disk use."""
+    start_disk = disk_usage(watch)
+    peak = [start_disk]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.5):
+            peak[0] = max(peak[0], disk_usage(watch))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    started = time.monotonic()
+    process = subprocess.Popen(command)
+    # wait4 reports the largest RSS among the command and its children
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.monotonic() - started
+
+    done.set()
+    sampler.join()
+    peak[0] = max(peak[0], disk_usage(watch))
+
+    return {
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "seconds": round(seconds, 3),
+        "peak_rss_kb": usage.ru_maxrss,
+        "peak_disk_bytes": peak[0] - start_disk,
+    }
+
+
+def phase_seconds(metrics_dir, job):
+    reports = sorted(glob.glob(os.path.join(metrics_dir, f"{job}.*.json")), key=os.path.getmtime)
+    if not reports:
+        return {}
+    with open(reports[-1]) as handle:
+        report = json.load(handle)
+    phases = {}
+    for database in report["databases"]:
+        for phase in database["phases"]:
+            phases[phase["phase"]] = phases.get(phase["phase"], 0) + phase["seconds"]
+    return phases
+
+
+############################################
+# Cases
+############################################
+def apply_settings(settings):
+    """Append the settings to pgenv.sh, which the scripts read on start."""
+    original = PGENV + ".bench"
+    if not os.path.exists(original):
+        shutil.copy(PGENV, original)
+    shutil.copy(original, PGENV)
+    with open(PGENV, "a") as handle:
+        for name, value in settings.items():
+            handle.write(f'export {name}="{value}"\n')
+
+
+def restore_archive(backend, base_dir, settings):
+    name = "latest.gis.dir.tar" if settings["DUMP_ARGS"] == "-Fd" else "latest.gis.dmp"
+    if backend == "S3":
+        return name
+    for path in sorted(glob.glob(os.path.join(base_dir, name + "*"))):
+        if not path.endswith((".meta.json", ".sha256")):
+            return path
+    raise RuntimeError(f"No {name} archive in {base_dir}")
+
+
+def scripts_command(script):
+    # Like cron, the scripts only get their environment from pgenv.sh
+    return ["env", "-i", f"PATH={os.environ['PATH']}", "/bin/bash", f"/backup-scripts/{script}"]
+
+
+def run_case(case, shape, database_bytes):
+    backend = os.environ.get("STORAGE_BACKEND", "FILE").upper()
+    base_dir = f"/{os.environ.get('BUCKET', 'backups')}"
+    metrics_dir = f"/results/metrics/{backend}-{case}"
+    watch = [base_dir, "/data/dump"]
+    settings = dict(BASE_SETTINGS, METRICS_DIR=metrics_dir, **CASES[case])
+
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    for path in glob.glob(os.path.join(base_dir, "latest.*")):
+        shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    apply_settings(settings)
+    results = []
+    backup = measure(scripts_command("backups.sh"), watch)
+    results.append(dict(backup, operation="backup", phases=phase_seconds(metrics_dir, "backup")))
+
+    if backup["exit_code"] == 0:
+        apply_settings(dict(settings, TARGET_ARCHIVE=restore_archive(backend, base_dir, settings)))
+        restore = measure(scripts_command("restore.sh"), watch)
+        results.append(dict(restore, operation="restore", phases=phase_seconds(metrics_dir, "restore")))
+
+    db = connect()
+    with db.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS {RESTORE_DB} WITH (FORCE)")
+
+    for result in results:
+        result.update(
+            backend=backend,
+            case=case,
+            shape=shape,
+            database_bytes=database_bytes,
+            mb_per_s=round(database_bytes / MB / result["seconds"], 2) if result["seconds"] else 0,
+        )
+        print(json.dumps(result))
+    return results
+
+
+def run(cases, shape):
+    db = connect()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT pg_database_size('gis')")
+        database_bytes = cursor.fetchone()[0]
+
+    failed = False
+    os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+    try:
+        for case in cases or sorted(CASES):
+            for result in run_case(case, shape, database_bytes):
+                failed = failed or result["exit_code"] != 0
+                with open(RESULTS, "a") as handle:
+                    handle.write(json.dumps(result) + "\n")
+    finally:
+        if os.path.exists(PGENV + ".bench"):
+            shutil.move(PGENV + ".bench", PGENV)
+    return 1 if failed else 0
+
+
+############################################
+# Baseline comparison
+############################################
+def result_key(result):
+    return "/".join([result["backend"], result["shape"], result["case"], result["operation"]])
+
+
+def compare(results_path, baseline_path, tolerance, update):
+    with open(results_path) as handle:
+        # The last measurement of a key wins
+        results = {result_key(r): r for r in map(json.loads, handle) if r["exit_code"] == 0}
+
+    if update:
+        with open(baseline_path, "w") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+        print(f"Wrote {len(results)} baseline entries to {baseline_path}")
+        return 0
+
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+
+    regressions = 0
+    for key in sorted(results):
+        if key not in baseline:
+            print(f"NEW        {key}: {results[key]['mb_per_s']} MB/s")
+            continue
+        current, previous = results[key], baseline[key]
+        problems = []
+        if current["mb_per_s"] < previous["mb_per_s"] * (1 - tolerance):
+            problems.append(f"throughput {previous['mb_per_s']} -> {current['mb_per_s']} MB/s")
+        for field in ("peak_rss_kb", "peak_disk_bytes"):
+            if previous[field] and current[field] > previous[field] * (1 + tolerance):
+                problems.append(f"{field} {previous[field]} -> {current[field]}")
+        regressions += bool(problems)
+        status = "REGRESSION" if problems else "OK"
+        print(f"{status:<10} {key}: {current['mb_per_s']} MB/s (baseline {previous['mb_per_s']})"
+              + ("; " + "; ".join(problems) if problems else ""))
+
+    return 1 if regressions else 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Backup and restore benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("generate")
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("cases", nargs="*", help=", ".join(sorted(CASES)))
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("--tolerance", type=float, default=0.2)
+    compare_parser.add_argument("--update", action="store_true")
+    args = parser.parse_args(argv[1:])
+
+    shape = os.environ.get("BENCH_SHAPE", "mixed")
+    if args.command == "generate":
+        generate(shape, int(os.environ.get("BENCH_SIZE_MB", 256)))
+        return 0
+    if args.command == "run":
+        unknown = set(args.cases) - set(CASES)
+        if unknown:
+            parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+        return run(args.cases, shape)
+    return compare(args.results, args.baseline, args.tolerance, args.update)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,12 @@
+#!/usr/bin/env bash
+
+set -e
+
+source /backup-scripts/pgenv.sh
+
+# execute benchmarks
+pushd /tests
+
+POSTGRES_DB=gis \
+PYTHONPATH=/lib \
+  python3 bench.py "$@"
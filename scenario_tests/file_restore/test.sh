@@ -34,6 +34,21 @@ run_tests() {
     ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/date_vars.sh
   fi
 
+  if [[ ${compose_file} == 'docker-compose-shadow.yml' ]];then
+    echo "Creating databases the shadow restore must keep for: ${compose_file}"
+    ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/shadow_steps.sh setup
+
+    echo "Running restore with a failing validation query for: ${compose_file}"
+    ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/shadow_steps.sh fail
+    if ${docker_cmd}  "${compose_args[@]}" exec pg_restore /backup-scripts/restore.sh; then
+      echo "ERROR: Restore succeeded although RESTORE_VALIDATION_QUERY failed"
+      exit 1
+    fi
+    ${docker_cmd}  "${compose_args[@]}" exec -w /tests pg_restore \
+      python3 -m unittest -v test_shadow.TestShadowValidationFailed
+    ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/shadow_steps.sh pass
+  fi
+
   echo "Running restore for compose: ${compose_file}"
   ${docker_cmd}  "${compose_args[@]}" exec pg_restore /backup-scripts/restore.sh
 
@@ -44,7 +59,7 @@ run_tests() {
   ${docker_cmd}  "${compose_args[@]}" down -v
 }
 
-compose_names=("docker-compose.yml" "docker-compose-encryption.yml" "docker-compose-directory.yml" "docker-compose-date-time.yml" "docker-compose-date.yml")
+compose_names=("docker-compose.yml" "docker-compose-encryption.yml" "docker-compose-encryption-cbc.yml" "docker-compose-directory.yml" "docker-compose-date-time.yml" "docker-compose-date.yml" "docker-compose-dedup.yml" "docker-compose-shadow.yml")
 for compose_file in "${compose_names[@]}"; do
 
   run_tests "${VERSION}" "${compose_file}"
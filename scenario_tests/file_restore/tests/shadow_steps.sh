@@ -0,0 +1,46 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+source /backup-scripts/pgenv.sh
+
+# Must match restore_shadow_marker
+MARKER="Previous copy kept by a shadow restore"
+
+run_sql() {
+  local db="$1"
+  shift
+  PGPASSWORD="${POSTGRES_PASS}" psql -h "${POSTGRES_HOST}" -p "${POSTGRES_PORT}" -U "${POSTGRES_USER}" \
+    -d "${db}" -v ON_ERROR_STOP=1 -qAt "$@"
+}
+
+case "${1:-}" in
+  setup)
+    # ----------------------------------------------------------------
+    # An existing TARGET_DB the restores must not lose, a stale copy
+    # tagged by an earlier swap and an untagged look-alike
+    # ----------------------------------------------------------------
+    for db in "${TARGET_DB}" "${TARGET_DB}__old_1000000000" "x__old_1000000000"; do
+      run_sql postgres -c "DROP DATABASE IF EXISTS \"${db}\" WITH (FORCE);"
+      run_sql postgres -c "CREATE DATABASE \"${db}\";"
+    done
+    run_sql "${TARGET_DB}" -c "CREATE TABLE shadow_sentinel (note text); INSERT INTO shadow_sentinel VALUES ('before restore');"
+    run_sql postgres -v marker="${MARKER}" <<SQL
+COMMENT ON DATABASE "${TARGET_DB}__old_1000000000" IS :'marker';
+SQL
+    ;;
+
+  fail)
+    printf 'export %s=%q\n' "RESTORE_VALIDATION_QUERY" \
+      "SELECT count(*) > 1000000 FROM restore_test" >> /backup-scripts/pgenv.sh
+    ;;
+
+  pass)
+    printf 'export %s=%q\n' "RESTORE_VALIDATION_QUERY" \
+      "SELECT count(*) > 0 FROM restore_test" >> /backup-scripts/pgenv.sh
+    ;;
+
+  *)
+    echo "Usage: $0 setup|fail|pass"
+    exit 1
+    ;;
+esac
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+
+CHUNK_STORE = "/backup-scripts/lib/tools/chunk_store.py"
+
+
+class TestDedup(unittest.TestCase):
+    """Stores, restores and collects chunks in a scratch repository."""
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.repository = os.path.join(self.workdir.name, "chunks")
+        self.env = dict(os.environ)
+        self.env.pop("DB_DUMP_ENCRYPTION_PASS_PHRASE", None)
+        self.run_store("init", self.repository)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def run_store(self, *args, data=None, compression="zstd"):
+        env = dict(self.env, COMPRESSION=compression)
+        proc = subprocess.run(["python3", CHUNK_STORE, *args], input=data, env=env,
+                              capture_output=True, check=True)
+        return proc.stdout
+
+    def store(self, name, data, compression="zstd"):
+        manifest = os.path.join(self.workdir.name, name)
+        self.run_store("store", self.repository, manifest, data=data, compression=compression)
+        return manifest
+
+    def restore(self, manifest, compression="zstd"):
+        return self.run_store("restore", self.repository, manifest, compression=compression)
+
+    def stored_chunks(self):
+        return sorted(name for folder, _, files in os.walk(self.repository)
+                      if folder != self.repository for name in files)
+
+    @staticmethod
+    def dump(rows):
+        return b"".join(b"INSERT INTO restore_test VALUES (%d, 'row %d');\n" % (i, i)
+                        for i in range(rows))
+
+    def test_restore_after_compression_change(self):
+        """Chunks stored with and without compression restore either way."""
+        raw = self.dump(20000)
+        grown = raw + self.dump(25000)[len(raw):]
+
+        first = self.store("first.dmp.chunks", raw, compression="none")
+        second = self.store("second.dmp.chunks", grown)
+
+        for compression in ("none", "zstd"):
+            self.assertEqual(self.restore(first, compression), raw)
+            self.assertEqual(self.restore(second, compression), grown)
+
+    def test_unchanged_chunks_are_shared(self):
+        raw = self.dump(20000)
+        first = self.store("first.dmp.chunks", raw)
+        chunks_after_first = self.stored_chunks()
+        self.store("second.dmp.chunks", raw)
+
+        self.assertEqual(self.stored_chunks(), chunks_after_first)
+        with open(first) as handle:
+            self.assertEqual(json.load(handle)["sha256"], hashlib.sha256(raw).hexdigest())
+
+    def test_gc_deletes_unreferenced_chunks(self):
+        kept = self.store("kept.dmp.chunks", self.dump(20000))
+        dropped = self.store("dropped.dmp.chunks", self.dump(40000)[::-1])
+        os.remove(dropped)
+
+        dry_run = self.run_store("gc", self.repository, self.workdir.name, "--dry-run").split()
+        self.assertGreater(int(dry_run[0]), 0, "Expected unreferenced chunks after removing a manifest")
+
+        deleted, freed, remaining = self.run_store("gc", self.repository, self.workdir.name).split()
+        self.assertEqual(deleted, dry_run[0])
+        self.assertGreater(int(freed), 0)
+        self.assertEqual(self.run_store("gc", self.repository, self.workdir.name).split()[0], b"0")
+        self.assertEqual(self.restore(kept), self.dump(20000))
+        with open(kept) as handle:
+            referenced = {chunk_id for chunk_id, _ in json.load(handle)["chunks"]}
+        self.assertEqual(int(remaining), len(referenced))
+        self.assertEqual(set(self.stored_chunks()), referenced)
+
+    def test_backup_repository_has_no_orphans(self):
+        """The backup taken by the scenario left no unreferenced chunks behind."""
+        basedir = os.environ.get("MYBASEDIR", "/backups")
+        repository = os.path.join(basedir, "chunks")
+        self.assertTrue(os.path.isdir(repository), "Expected chunk repository %s" % repository)
+        output = self.run_store("gc", repository, basedir, "--dry-run").split()
+        self.assertEqual(output[0], b"0")
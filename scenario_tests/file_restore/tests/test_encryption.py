@@ -0,0 +1,120 @@
+import os
+import struct
+import subprocess
+import unittest
+
+CHUNK_CRYPT = "/backup-scripts/lib/tools/chunk_crypt.py"
+PASSPHRASE = "chunk-crypt-test"
+CHUNK_SIZE = 1 << 20
+# MAGIC | version | chunk size | PBKDF2 iterations | salt | nonce prefix
+HEADER = struct.Struct(">8sBII16s8s")
+LENGTH = struct.Struct(">I")
+
+
+class TestEncryption(unittest.TestCase):
+    """Round-trips and tampers with streams in both encryption formats."""
+
+    def setUp(self):
+        self.env = dict(os.environ, DB_DUMP_ENCRYPTION_PASS_PHRASE=PASSPHRASE)
+
+    def run_crypt(self, action, data, passphrase=PASSPHRASE, check=True):
+        env = dict(self.env, DB_DUMP_ENCRYPTION_PASS_PHRASE=passphrase)
+        return subprocess.run(["python3", CHUNK_CRYPT, action, "2"], input=data, env=env,
+                              capture_output=True, check=check)
+
+    def encrypt(self, data):
+        return self.run_crypt("encrypt", data).stdout
+
+    def decrypt(self, data):
+        return self.run_crypt("decrypt", data).stdout
+
+    def assertRejected(self, data, passphrase=PASSPHRASE):
+        proc = self.run_crypt("decrypt", data, passphrase=passphrase, check=False)
+        self.assertNotEqual(proc.returncode, 0, "Expected the stream to be rejected")
+        return proc
+
+    def encrypt_legacy(self, data, passphrase=PASSPHRASE):
+        return subprocess.run(["openssl", "enc", "-aes-256-cbc", "-pbkdf2", "-iter", "10000",
+                               "-md", "sha256", "-pass", "pass:%s" % passphrase],
+                              input=data, capture_output=True, check=True).stdout
+
+    @staticmethod
+    def sample(size):
+        return (os.urandom(4096) * (size // 4096 + 1))[:size]
+
+    def chunk_offsets(self, sealed):
+        """Offsets of the length prefix of every chunk after the header."""
+        offsets, offset = [], HEADER.size
+        while offset < len(sealed):
+            offsets.append(offset)
+            offset += LENGTH.size + LENGTH.unpack_from(sealed, offset)[0]
+        return offsets
+
+    def test_round_trip(self):
+        for size in (0, 1, CHUNK_SIZE, 3 * CHUNK_SIZE + 17):
+            data = self.sample(size)
+            sealed = self.encrypt(data)
+            self.assertTrue(sealed.startswith(b"PGBKGCM1"))
+            self.assertEqual(self.decrypt(sealed), data, "Round trip failed for %d bytes" % size)
+
+    def test_tampered_chunk_is_rejected(self):
+        sealed = bytearray(self.encrypt(self.sample(2 * CHUNK_SIZE)))
+        sealed[self.chunk_offsets(sealed)[1] + LENGTH.size + 10] ^= 0x01
+        proc = self.assertRejected(bytes(sealed))
+        self.assertIn(b"chunk 1", proc.stderr)
+
+    def test_tampered_header_is_rejected(self):
+        sealed = bytearray(self.encrypt(self.sample(1000)))
+        sealed[HEADER.size - 1] ^= 0x01
+        self.assertRejected(bytes(sealed))
+
+    def test_truncated_stream_is_rejected(self):
+        sealed = self.encrypt(self.sample(3 * CHUNK_SIZE))
+        self.assertRejected(sealed[:self.chunk_offsets(sealed)[-1]])
+        self.assertRejected(sealed[:-1])
+
+    def test_reordered_chunks_are_rejected(self):
+        sealed = self.encrypt(self.sample(3 * CHUNK_SIZE))
+        first, second, third = self.chunk_offsets(sealed)
+        swapped = sealed[:first] + sealed[second:third] + sealed[first:second] + sealed[third:]
+        self.assertRejected(swapped)
+
+    def test_wrong_passphrase_is_rejected(self):
+        self.assertRejected(self.encrypt(self.sample(1000)), passphrase="not-the-passphrase")
+
+    def test_oversized_chunk_size_is_rejected(self):
+        sealed = self.encrypt(self.sample(1000))
+        magic, version, _, iterations, salt, prefix = HEADER.unpack_from(sealed)
+        forged = HEADER.pack(magic, version, 0xFFFFFFFF, iterations, salt, prefix) + sealed[HEADER.size:]
+        proc = self.assertRejected(forged)
+        self.assertIn(b"Invalid chunk size", proc.stderr)
+
+    def test_legacy_round_trip(self):
+        for size in (0, 15, 16, 2 * CHUNK_SIZE + 5):
+            data = self.sample(size)
+            self.assertEqual(self.decrypt(self.encrypt_legacy(data)), data,
+                             "Legacy round trip failed for %d bytes" % size)
+
+    def test_legacy_tampered_is_rejected(self):
+        sealed = bytearray(self.encrypt_legacy(self.sample(1000)))
+        # Turns the padding length byte into an invalid one
+        sealed[-17] ^= 0x80
+        self.assertRejected(bytes(sealed))
+
+    def test_legacy_wrong_passphrase_is_rejected(self):
+        # CBC is not authenticated, a wrong key is only caught by the padding check
+        data = self.sample(1000)
+        proc = self.run_crypt("decrypt", self.encrypt_legacy(data), passphrase="not-the-passphrase",
+                              check=False)
+        self.assertTrue(proc.returncode != 0 or proc.stdout != data,
+                        "Expected a wrong passphrase not to restore the data")
+
+    def test_archive_format(self):
+        """The archive under test was written in the configured format."""
+        archive = os.environ.get("TARGET_ARCHIVE", "")
+        if not os.path.isfile(archive):
+            self.skipTest("%s is not a local archive" % (archive or "TARGET_ARCHIVE"))
+        legacy = os.environ.get("ENCRYPTION_CIPHER", "").lower() in ("aes-256-cbc", "cbc")
+        with open(archive, "rb") as handle:
+            magic = handle.read(8)
+        self.assertEqual(magic, b"Salted__" if legacy else b"PGBKGCM1")
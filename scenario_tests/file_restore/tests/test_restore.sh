@@ -11,3 +11,18 @@ PGHOST=localhost \
 PGDATABASE=${TARGET_DB} \
 PYTHONPATH=/lib \
   python3 -m unittest -v test_restore.TestRestore
+
+if [[ "${BACKUP_DEDUPLICATION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+  PYTHONPATH=/lib \
+    python3 -m unittest -v test_dedup.TestDedup
+fi
+
+if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+  PYTHONPATH=/lib \
+    python3 -m unittest -v test_encryption.TestEncryption
+fi
+
+if [[ "${RESTORE_SHADOW:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+  PYTHONPATH=/lib \
+    python3 -m unittest -v test_shadow.TestShadowRestore
+fi
@@ -0,0 +1,88 @@
+import os
+import unittest
+
+import psycopg2
+
+MARKER = "Previous copy kept by a shadow restore"
+STALE_COPY_EPOCH = "1000000000"
+
+
+def connect(database):
+    conn = psycopg2.connect(
+        host=os.environ.get('POSTGRES_HOST'),
+        database=database,
+        user=os.environ.get('POSTGRES_USER'),
+        password=os.environ.get('POSTGRES_PASS'),
+        port=os.environ.get('POSTGRES_PORT')
+    )
+    conn.autocommit = True
+    return conn
+
+
+class ShadowTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.target = os.environ['TARGET_DB']
+        self.conn = connect('postgres')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def databases(self):
+        with self.conn.cursor() as c:
+            c.execute("""
+                SELECT datname, shobj_description(oid, 'pg_database')
+                FROM pg_database;
+            """)
+            return dict(c.fetchall())
+
+    def has_sentinel(self, database):
+        conn = connect(database)
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT to_regclass('shadow_sentinel') IS NOT NULL;")
+                return c.fetchone()[0]
+        finally:
+            conn.close()
+
+
+class TestShadowValidationFailed(ShadowTestCase):
+    """A restore whose RESTORE_VALIDATION_QUERY fails leaves TARGET_DB alone."""
+
+    def test_target_untouched(self):
+        self.assertTrue(
+            self.has_sentinel(self.target),
+            "Expected %s to keep its data after a failed validation" % self.target
+        )
+
+    def test_shadow_dropped(self):
+        self.assertNotIn(self.target + '__shadow', self.databases())
+
+    def test_no_copy_kept(self):
+        copies = [name for name in self.databases()
+                  if name.startswith(self.target + '__old_') and not name.endswith(STALE_COPY_EPOCH)]
+        self.assertEqual(copies, [], "Expected no previous copy from a failed restore")
+
+
+class TestShadowRestore(ShadowTestCase):
+    """A validated restore is swapped in and only tagged copies expire."""
+
+    def test_previous_copy_kept(self):
+        copies = {name: comment for name, comment in self.databases().items()
+                  if name.startswith(self.target + '__old_') and not name.endswith(STALE_COPY_EPOCH)}
+        self.assertEqual(len(copies), 1, "Expected one previous copy of %s" % self.target)
+        name, comment = copies.popitem()
+        self.assertEqual(comment, MARKER)
+        self.assertTrue(self.has_sentinel(name), "Expected %s to hold the data replaced" % name)
+
+    def test_target_replaced(self):
+        self.assertFalse(self.has_sentinel(self.target))
+
+    def test_shadow_renamed(self):
+        self.assertNotIn(self.target + '__shadow', self.databases())
+
+    def test_tagged_stale_copy_dropped(self):
+        self.assertNotIn(self.target + '__old_' + STALE_COPY_EPOCH, self.databases())
+
+    def test_untagged_look_alike_kept(self):
+        self.assertIn('x__old_' + STALE_COPY_EPOCH, self.databases())
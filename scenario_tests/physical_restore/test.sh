@@ -0,0 +1,54 @@
+#!/usr/bin/env bash
+
+# exit immediately if test fails
+set -e
+
+source ../test-env.sh
+
+# Determine docker compose version to use
+if [[ $(dpkg -l | grep "docker-compose") > /dev/null ]];then
+    VERSION='docker-compose'
+  else
+    VERSION='docker compose'
+fi
+
+run_tests() {
+  local docker_cmd="$1"
+  local compose_file="$2"
+
+  local compose_args=()
+
+  # Only add -f if NOT default compose file
+  if [[ "${compose_file}" != "docker-compose.yml" ]]; then
+    compose_args=(-f "${compose_file}")
+  fi
+
+  echo "Starting services using ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" up -d
+
+  echo "Creating the test table for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/pitr_vars.sh setup
+
+  echo "Running base backup for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" exec pg_restore /backup-scripts/backups.sh
+
+  echo "Writing rows around the recovery target for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/pitr_vars.sh rows
+
+  echo "Running point-in-time restore for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" exec pg_restore \
+    install -d -o postgres -g postgres -m 0700 /var/lib/postgresql/pitr
+  ${docker_cmd}  "${compose_args[@]}" exec pg_restore /backup-scripts/restore.sh
+
+  echo "Running unit tests for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/test_restore.sh
+
+  echo "Bringing down services for compose: ${compose_file}"
+  ${docker_cmd}  "${compose_args[@]}" down -v
+}
+
+compose_names=("docker-compose.yml")
+for compose_file in "${compose_names[@]}"; do
+
+  run_tests "${VERSION}" "${compose_file}"
+done
@@ -0,0 +1,56 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+source /backup-scripts/pgenv.sh
+
+# ------------------------------------------------------------------
+# Rows are written as the superuser of the source cluster, the
+# backup itself only needs the replication role
+# ------------------------------------------------------------------
+run_sql() {
+  PGPASSWORD=docker psql -h "${POSTGRES_HOST}" -p "${POSTGRES_PORT}" -U docker -d gis \
+    -v ON_ERROR_STOP=1 -qAt -c "$1"
+}
+
+case "${1:-}" in
+  setup)
+    run_sql "CREATE TABLE IF NOT EXISTS pitr_test (name text PRIMARY KEY, written timestamptz DEFAULT now());"
+    ;;
+
+  rows)
+    # ----------------------------------------------------------------
+    # One row before and one after a minute boundary, which is the
+    # recovery target (TARGET_ARCHIVE_DATETIME has minute precision)
+    # ----------------------------------------------------------------
+    run_sql "INSERT INTO pitr_test (name) VALUES ('before_target');"
+    sleep $(( 61 - 10#$(date +%S) ))
+    TARGET_ARCHIVE_DATETIME="$(date +%Y-%m-%d-%H-%M)"
+    sleep 2
+    run_sql "INSERT INTO pitr_test (name) VALUES ('after_target');"
+    run_sql "SELECT pg_switch_wal();" >/dev/null
+
+    printf 'export %s="%s"\n' "TARGET_ARCHIVE_DATETIME" "${TARGET_ARCHIVE_DATETIME}" >> /backup-scripts/pgenv.sh
+    echo "TARGET_ARCHIVE_DATETIME=${TARGET_ARCHIVE_DATETIME}"
+
+    # ----------------------------------------------------------------
+    # Wait for the archiver to ship the segment holding the second row
+    # ----------------------------------------------------------------
+    target="${TARGET_ARCHIVE_DATETIME:0:10}T${TARGET_ARCHIVE_DATETIME:11:2}:${TARGET_ARCHIVE_DATETIME:14:2}:00"
+    for _ in $(seq 1 60); do
+      if [[ -f /backups/wal/wal.jsonl ]] && jq -e -s --arg target "${target}" \
+          'any(.[]; (.segment | test("^[0-9A-F]{24}$")) and .archived > $target)' \
+          /backups/wal/wal.jsonl >/dev/null; then
+        echo "WAL after ${target} is archived"
+        exit 0
+      fi
+      sleep 2
+    done
+    echo "ERROR: No WAL archived after ${target}"
+    exit 1
+    ;;
+
+  *)
+    echo "Usage: $0 setup|rows"
+    exit 1
+    ;;
+esac
@@ -0,0 +1,38 @@
+import unittest
+from utils.utils import DBConnection
+
+
+class TestPhysicalRestore(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DBConnection()
+        self.db.conn.autocommit = True
+
+    def tearDown(self):
+        self.db.conn.close()
+
+    def test_promoted(self):
+        with self.db.cursor() as c:
+            c.execute("SELECT pg_is_in_recovery();")
+            self.assertFalse(
+                c.fetchone()[0],
+                "Expected the restored cluster to be promoted after recovery"
+            )
+
+    def test_row_before_target(self):
+        with self.db.cursor() as c:
+            c.execute("SELECT count(*) FROM pitr_test WHERE name = 'before_target';")
+            self.assertEqual(
+                c.fetchone()[0],
+                1,
+                "Expected the row written before TARGET_ARCHIVE_DATETIME to be replayed"
+            )
+
+    def test_row_after_target(self):
+        with self.db.cursor() as c:
+            c.execute("SELECT count(*) FROM pitr_test WHERE name = 'after_target';")
+            self.assertEqual(
+                c.fetchone()[0],
+                0,
+                "Expected the row written after TARGET_ARCHIVE_DATETIME not to be replayed"
+            )
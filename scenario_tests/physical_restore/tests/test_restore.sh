@@ -0,0 +1,49 @@
+#!/usr/bin/env bash
+
+set -e
+
+source /backup-scripts/pgenv.sh
+
+PG_BIN="/usr/lib/postgresql/$(cat /tmp/pg_version.txt)/bin"
+PITR_CONF=/tmp/pitr-conf
+PITR_PORT=5433
+
+# ------------------------------------------------------------------
+# Start a server on the prepared data directory. The configuration of
+# the source cluster is not part of a base backup, so a minimal one
+# is used; the recovery settings come from postgresql.auto.conf.
+# ------------------------------------------------------------------
+mkdir -p "${PITR_CONF}"
+cat > "${PITR_CONF}/postgresql.conf" <<CONF
+port = ${PITR_PORT}
+listen_addresses = 'localhost'
+unix_socket_directories = '/tmp'
+hba_file = '${PITR_CONF}/pg_hba.conf'
+ident_file = '${PITR_CONF}/pg_ident.conf'
+CONF
+printf 'local all all trust\nhost all all 127.0.0.1/32 trust\n' > "${PITR_CONF}/pg_hba.conf"
+: > "${PITR_CONF}/pg_ident.conf"
+chown -R postgres:postgres "${PITR_CONF}"
+
+gosu postgres "${PG_BIN}/pg_ctl" -D "${RESTORE_PGDATA}" -l /tmp/pitr.log -w -t 120 \
+  -o "-c config_file=${PITR_CONF}/postgresql.conf" start
+trap 'gosu postgres "${PG_BIN}/pg_ctl" -D "${RESTORE_PGDATA}" -m fast stop' EXIT
+
+# Recovery stops at the target and promotes the server
+for _ in $(seq 1 60); do
+  if [[ "$(psql -h /tmp -p "${PITR_PORT}" -U docker -d gis -qAt -c 'SELECT pg_is_in_recovery();')" == "f" ]]; then
+    break
+  fi
+  sleep 2
+done
+
+# execute tests
+pushd /tests
+
+POSTGRES_HOST=localhost \
+POSTGRES_PORT=${PITR_PORT} \
+POSTGRES_DB=gis \
+POSTGRES_USER=docker \
+POSTGRES_PASS=docker \
+PYTHONPATH=/lib \
+  python3 -m unittest -v test_restore.TestPhysicalRestore
@@ -26,6 +26,11 @@ run_tests() {
   echo "Starting services using ${compose_file}"
   ${docker_cmd}  "${compose_args[@]}" up -d
 
+  if [[ ${compose_file} == 'docker-compose-seekable.yml' ]];then
+    echo "Adding a large table to the backed up database for: ${compose_file}"
+    ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/seekable_steps.sh
+  fi
+
   echo "Running backup for compose: ${compose_file}"
   ${docker_cmd}  "${compose_args[@]}" exec pg_restore /backup-scripts/backups.sh
 
@@ -34,7 +39,13 @@ run_tests() {
     ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/date_vars.sh
   fi
   echo "Running restore for compose: ${compose_file}"
-  ${docker_cmd}  "${compose_args[@]}" exec pg_restore /backup-scripts/restore.sh
+  if [[ ${compose_file} == 'docker-compose-seekable.yml' ]];then
+    # Keep the block counts the seekable reader reports for the unit tests
+    ${docker_cmd}  "${compose_args[@]}" exec pg_restore \
+      /bin/bash -o pipefail -c '/backup-scripts/restore.sh 2>&1 | tee /tmp/restore.log'
+  else
+    ${docker_cmd}  "${compose_args[@]}" exec pg_restore /backup-scripts/restore.sh
+  fi
 
   echo "Running unit tests for compose: ${compose_file}"
   ${docker_cmd}  "${compose_args[@]}" exec pg_restore /bin/bash /tests/test_restore.sh
@@ -43,7 +54,7 @@ run_tests() {
   ${docker_cmd}  "${compose_args[@]}" down -v
 }
 
-compose_names=("docker-compose.yml" "docker-compose-encryption.yml" "docker-compose-directory.yml" "docker-compose-date-time.yml" "docker-compose-date.yml")
+compose_names=("docker-compose.yml" "docker-compose-encryption.yml" "docker-compose-encryption-cbc.yml" "docker-compose-directory.yml" "docker-compose-date-time.yml" "docker-compose-date.yml" "docker-compose-zstd.yml" "docker-compose-directory-streaming.yml" "docker-compose-seekable.yml")
 for compose_file in "${compose_names[@]}"; do
   run_tests "${VERSION}" "${compose_file}"
 done
@@ -0,0 +1,16 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+source /backup-scripts/pgenv.sh
+
+# ------------------------------------------------------------------
+# A table large enough to span many SEEKABLE_BLOCK_MB blocks, so a
+# restore of another table has most of the archive left to skip
+# ------------------------------------------------------------------
+PGPASSWORD="${POSTGRES_PASS}" psql -h "${POSTGRES_HOST}" -p "${POSTGRES_PORT}" -U "${POSTGRES_USER}" \
+  -d gis -v ON_ERROR_STOP=1 -q <<'SQL'
+DROP TABLE IF EXISTS seekable_filler;
+CREATE TABLE seekable_filler AS
+  SELECT g AS id, md5(g::text) || md5((g * 7)::text) AS note
+  FROM generate_series(1, 300000) AS g;
+SQL
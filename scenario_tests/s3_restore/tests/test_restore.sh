@@ -7,7 +7,16 @@ source /backup-scripts/pgenv.sh
 # execute tests
 pushd /tests
 
-PGHOST=localhost \
-PGDATABASE=${TARGET_DB} \
-PYTHONPATH=/lib \
-  python3 -m unittest -v test_restore.TestRestore
+if [[ "${SEEKABLE_ARCHIVES:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+  # RESTORE_ARGS selects a single table, the other tables are not restored
+  PGHOST=localhost \
+  PGDATABASE=${TARGET_DB} \
+  RESTORE_LOG=/tmp/restore.log \
+  PYTHONPATH=/lib \
+    python3 -m unittest -v test_seekable.TestSeekableRestore
+else
+  PGHOST=localhost \
+  PGDATABASE=${TARGET_DB} \
+  PYTHONPATH=/lib \
+    python3 -m unittest -v test_restore.TestRestore
+fi
@@ -0,0 +1,41 @@
+import os
+import re
+import unittest
+from utils.utils import DBConnection
+
+
+class TestSeekableRestore(unittest.TestCase):
+    """RESTORE_ARGS="-t company" restores one table from a seekable archive."""
+
+    def setUp(self):
+        self.db = DBConnection()
+        self.db.conn.autocommit = True
+
+    def tearDown(self):
+        self.db.conn.close()
+
+    def table_exists(self, table):
+        with self.db.cursor() as c:
+            c.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+            return c.fetchone()[0]
+
+    def test_selected_table_restored(self):
+        with self.db.cursor() as c:
+            c.execute("SELECT name FROM company WHERE id = 1;")
+            self.assertEqual(c.fetchall(), [('Paul',)], "Expected row ('Paul') in company")
+
+    def test_other_tables_skipped(self):
+        for table in ('restore_test', 'seekable_filler'):
+            self.assertFalse(self.table_exists(table), "Expected %s not to be restored" % table)
+
+    def test_rest_of_archive_not_fetched(self):
+        # The TOC is read once on its own to select entries, then with their data
+        with open(os.environ['RESTORE_LOG']) as handle:
+            reads = re.findall(r"Read (\d+) of (\d+) blocks \((\d+) of (\d+) bytes\) for (\d+) entries",
+                               handle.read())
+        self.assertTrue(reads, "Expected a seekable restore in %s" % os.environ['RESTORE_LOG'])
+        read_blocks, blocks, read_bytes, stored, entries = map(int, reads[-1])
+        self.assertGreater(entries, 0, "Expected the company data to be selected")
+        self.assertGreater(blocks, 4, "Expected the archive to span several blocks")
+        self.assertLessEqual(read_blocks, 3, "Expected only the TOC and company blocks to be read")
+        self.assertLess(read_bytes * 4, stored)
@@ -37,7 +37,7 @@ run_tests() {
   ${docker_cmd}  "${compose_args[@]}" down -v
 }
 
-compose_names=("docker-compose.yml" "docker-compose-latest.yml" "docker-compose-checksum.yml")
+compose_names=("docker-compose.yml" "docker-compose-latest.yml" "docker-compose-checksum.yml" "docker-compose-streaming.yml" "docker-compose-multipart.yml")
 for compose_file in "${compose_names[@]}"; do
   run_tests "${VERSION}" "${compose_file}"
 done
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import logging
 import os
 import subprocess
@@ -13,6 +15,7 @@ class TestUpload(unittest.TestCase):
         self.globals_dump_archive = 'globals.sql'
         self.dump_prefix = os.environ.get('DUMPPREFIX')
         self.checksum_validation = os.environ.get('CHECKSUM_VALIDATION')
+        self.streaming_upload = os.environ.get('S3_STREAMING_UPLOAD')
         self.bucket = os.environ["BUCKET"]
         self.current_date = datetime.now()
         self.key = f"{self.current_date.year}/{self.current_date.strftime('%B')}"
@@ -102,3 +105,60 @@ class TestUpload(unittest.TestCase):
             checksum_files,
             f"Checksum files found when validation disabled: {checksum_files}"
         )
+
+    def test_streaming_upload_matches_bucket(self):
+        if str(self.streaming_upload).lower() != "true":
+            self.skipTest("S3_STREAMING_UPLOAD is not enabled")
+
+        # The checksum and manifest are taken from the stream on its way to S3,
+        # so they have to match the bytes that ended up in the bucket.
+        objects = [line.split()[-1] for line in self.process.stdout.splitlines()]
+        dumps = [o for o in objects if o.endswith(".dmp.gz")]
+        self.assertTrue(dumps, "No streamed dump found")
+
+        for dump in dumps:
+            data = subprocess.run(["s3cmd", "get", dump, "-"], capture_output=True, check=True).stdout
+            meta = json.loads(subprocess.run(["s3cmd", "get", f"{dump}.meta.json", "-"], capture_output=True,
+                                             text=True, check=True).stdout)
+            checksum = subprocess.run(["s3cmd", "get", f"{dump}.sha256", "-"], capture_output=True, text=True,
+                                      check=True).stdout.split()[0]
+            manifest = json.loads(subprocess.run(["s3cmd", "get", f"{dump}.manifest.json", "-"],
+                                                 capture_output=True, text=True, check=True).stdout)
+            digest = hashlib.sha256(data).hexdigest()
+
+            self.assertTrue(meta.get("streamed"), f"{dump} was not recorded as streamed")
+            self.assertEqual(checksum, digest, f"Checksum of {dump} does not match the object")
+            self.assertEqual(manifest["sha256"], digest)
+            self.assertEqual(manifest["size"], len(data))
+            # The metadata only points at the manifest
+            self.assertEqual(meta["manifest"]["root"], manifest["root"])
+            self.assertEqual(meta["manifest"]["count"], len(manifest["chunks"]))
+            self.assertNotIn("chunks", meta["manifest"])
+
+    def test_multipart_round_trip(self):
+        if not os.environ.get("S3_PART_SIZE_MB"):
+            return True
+
+        # Three parts at the configured part size, moved in parallel both ways
+        tool = "/backup-scripts/lib/tools/s3_transfer.py"
+        part_size = int(os.environ["S3_PART_SIZE_MB"]) * 1024 * 1024
+        source = "/tmp/multipart-source.bin"
+        target = "/tmp/multipart-target.bin"
+        key = f"{self.s3_base_path}multipart-test.bin"
+
+        with open(source, "wb") as handle:
+            handle.write(os.urandom(part_size * 2 + 12345))
+
+        try:
+            subprocess.run(["python3", tool, "upload", source, key], check=True)
+            subprocess.run(["python3", tool, "download", key, target], check=True)
+
+            with open(source, "rb") as expected, open(target, "rb") as actual:
+                self.assertEqual(expected.read(), actual.read())
+            self.assertFalse(os.path.exists(f"{source}.upload.json"))
+            self.assertFalse(os.path.exists(f"{target}.download.json"))
+        finally:
+            subprocess.run(["s3cmd", "del", key], capture_output=True)
+            for path in (source, target):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -59,9 +59,20 @@ configure_sources() {
   local libs=(
     logging
     monitoring
+    metrics
     db
+    compression
+    catalog
+    change_detection
     encryption
+    dedup
+    slices
+    seekable
+    throttle
+    replicas
+    physical
     s3
+    upload_queue
     retention
     utils
   )
@@ -88,22 +99,29 @@ trap 'on_terminate' SIGTERM SIGINT
 ############################################
 init_logging
 
+if ! acquire_backup_lock; then
+  log "Another backup is still running, skipping this run"
+  exit 0
+fi
+
+metrics_init backup
+
 
 log "Backup job started at $(date +%d-%B-%Y-%H-%M)" true
 notify_monitoring_start
+throttle_start
 
 ############################################
 # DB list and readiness probe
 ############################################
 
-check_db_ready
+# The resident scheduler has already checked the database
+setup_is_warm || check_db_ready
 
-if [ -z "${DBLIST:-}" ]; then
+# Base backups cover the whole cluster
+if [ -z "${DBLIST:-}" ] && ! physical_mode_enabled; then
 
-  until PGPASSWORD=${POSTGRES_PASS} pg_isready ${PG_CONN_PARAMETERS}; do
-    sleep 1
-  done
-  export DBLIST=$(PGPASSWORD=${POSTGRES_PASS} psql ${PG_CONN_PARAMETERS} -l | awk '$1 !~ /[+(|:]|Name|List|template|postgres/ {print $1}')
+  export DBLIST=$(discover_databases)
   log "Database list is::  ${DBLIST}"
 fi
 
@@ -115,19 +133,37 @@ case "${STORAGE_BACKEND}" in
   S3)
 
 
-    s3_init
+    # The resident scheduler keeps the s3cmd config and bucket set up
+    setup_is_warm || s3_init
+    s3_abort_stale_uploads
+    catalog_load
+
+    if physical_mode_enabled; then
+      backup_base
+    else
+      dedup_init
 
-    # Always refresh globals
-    backup_globals
+      # Always refresh globals
+      backup_globals
 
-    # Database + optional table-level dumps
-    backup_databases
+      # Database + optional table-level dumps
+      backup_databases
+    fi
+    upload_queue_flush || log "WARNING: Some uploads failed and stay queued"
+    catalog_publish
     ;;
   FILE|file)
 
 
-    backup_globals
-    backup_databases
+    catalog_load
+
+    if physical_mode_enabled; then
+      backup_base
+    else
+      dedup_init
+      backup_globals
+      backup_databases
+    fi
     ;;
   *)
     log "ERROR: Unknown STORAGE_BACKEND=${STORAGE_BACKEND}"
@@ -141,10 +177,13 @@ esac
 ############################################
 
 run_retention
+catalog_publish
 
 ############################################
 # Finish
 ############################################
 
+throttle_stop
+metrics_finish success
 log "Backup job completed successfully at $(date +%d-%B-%Y-%H-%M)" true
 
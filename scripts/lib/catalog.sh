@@ -0,0 +1,432 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+catalog_log() {
+  log "[Catalog] $*"
+}
+
+############################################
+# Backup catalog
+# One JSON record per artifact in ${MYBASEDIR}/catalog.jsonl, mirrored
+# to s3://${BUCKET}/catalog.jsonl for S3 backends:
+#   {"key", "database", "created", "datetime", "format", "compression",
+#    "size", "checksum", "encrypted", "sidecars"}
+# Table slices and seekable block indexes are listed as sidecars of
+# their archive.
+# Physical base backups also carry "wal_start" and "backup_end".
+# "key" is the S3 key (S3) or the path relative to MYBASEDIR (FILE).
+# "datetime" (YYYY-MM-DDTHH:MM) sorts and compares as a plain string.
+############################################
+catalog_file() {
+  echo "${MYBASEDIR}/catalog.jsonl"
+}
+
+catalog_key() {
+  local artifact="$1"
+
+  if [[ "${STORAGE_BACKEND}" == "S3" ]]; then
+    s3_object_key "${artifact}"
+  else
+    echo "${artifact#"${MYBASEDIR}/"}"
+  fi
+}
+
+# Appends and rewrites from concurrent backup jobs are serialised
+catalog_lock_file() {
+  echo "/tmp/catalog.lock"
+}
+
+############################################
+# Stage the catalog record of a finished artifact
+# Usage: catalog_stage <db> <artifact>
+# Must run while <artifact>.meta.json still exists. The record is
+# only added to the catalog through catalog_commit.
+############################################
+catalog_stage() {
+  local db="$1"
+  local artifact="$2"
+  local pending format size=""
+  local sidecars=()
+
+  pending="$(catalog_file).${db}.pending"
+
+  case "${artifact}" in
+    *.dir.tar*) format="directory" ;;
+    *.base.tar*) format="physical" ;;
+    *) format="custom" ;;
+  esac
+
+  if [[ -f "${artifact}" ]]; then
+    size="$(stat -c %s "${artifact}")"
+  elif [[ "${STORAGE_BACKEND}" == "S3" ]]; then
+    size="$(s3cmd info "s3://${BUCKET}/$(catalog_key "${artifact}")" 2>/dev/null \
+      | awk '/File size:/ {print $3}')" || size=""
+  fi
+
+  [[ -f "${artifact}.meta.json" ]] && sidecars+=(".meta.json")
+  [[ -f "${artifact}.sha256" ]] && sidecars+=(".sha256")
+  jq -e '.manifest.file' "${artifact}.meta.json" >/dev/null 2>&1 && sidecars+=(".manifest.json")
+  jq -e '.seekable' "${artifact}.meta.json" >/dev/null 2>&1 && sidecars+=(".index.json")
+
+  jq -n -c \
+    --arg key "$(catalog_key "${artifact}")" \
+    --arg database "${db}" \
+    --arg created "${MYDATE}" \
+    --arg format "${format}" \
+    --arg size "${size}" \
+    --arg sidecars "${sidecars[*]}" \
+    --slurpfile meta "$([[ -f "${artifact}.meta.json" ]] && echo "${artifact}.meta.json" || echo /dev/null)" \
+    '($meta[0] // {}) as $m
+     | {
+         key: $key,
+         database: $database,
+         created: $created,
+         datetime: (try ($created | strptime("%d-%B-%Y-%H-%M") | strftime("%Y-%m-%dT%H:%M")) catch null),
+         format: $format,
+         compression: ($m.compression // "none"),
+         size: (if $size == "" then null else ($size | tonumber) end),
+         checksum: (($m.checksum // "") | split(" ")[0] | if . == "" then null else . end),
+         encrypted: ($m.encrypted // false),
+         sidecars: (($sidecars | split(" ") | map(select(length > 0)))
+                    + [($m.slices.tables // [])[].slices[].suffix])
+       }
+       + ($m | {wal_start, backup_end} | with_entries(select(.value != null)))' > "${pending}"
+}
+
+############################################
+# Add the staged record to the catalog
+# Usage: catalog_commit <db> <status>
+# Records of queued uploads are committed by the uploader instead (see
+# upload_queue.sh).
+############################################
+catalog_commit() {
+  local db="$1"
+  local status="$2"
+  local pending
+
+  pending="$(catalog_file).${db}.pending"
+  [[ -f "${pending}" ]] || return 0
+
+  if [[ "${status}" == "success" ]]; then
+    catalog_append "${pending}"
+  fi
+
+  rm -f "${pending}"
+}
+
+############################################
+# Append a record to the catalog
+# Usage: catalog_append <record_file>
+# A record with the same key (fixed ARCHIVE_FILENAME) is replaced.
+############################################
+catalog_append() {
+  local record="$1"
+  local catalog key
+
+  catalog="$(catalog_file)"
+  key="$(jq -r '.key' "${record}")"
+  (
+    flock 9
+    if [[ -f "${catalog}" ]] && grep -qF "\"key\":$(jq -c '.key' "${record}")," "${catalog}"; then
+      jq -c --arg key "${key}" 'select(.key != $key)' "${catalog}" > "${catalog}.tmp"
+      mv -f "${catalog}.tmp" "${catalog}"
+    fi
+    cat "${record}" >> "${catalog}"
+  ) 9> "$(catalog_lock_file)"
+}
+
+############################################
+# Record an artifact straight away
+# Usage: catalog_add <db> <artifact>
+############################################
+catalog_add() {
+  catalog_stage "$1" "$2"
+  catalog_commit "$1" "success"
+}
+
+############################################
+# Drop records from the catalog
+# Usage: catalog_remove <keys_file>
+# <keys_file> holds one key per line; keys without a record are ignored.
+############################################
+catalog_remove() {
+  local keys_file="$1"
+  local catalog
+
+  catalog="$(catalog_file)"
+  [[ -f "${catalog}" && -s "${keys_file}" ]] || return 0
+
+  (
+    flock 9
+    jq -n -c --rawfile gone "${keys_file}" \
+      '($gone | split("\n") | map(select(length > 0) | {(.): true}) | add // {}) as $g
+       | inputs
+       | select($g[.key] | not)' \
+      "${catalog}" > "${catalog}.tmp"
+    mv -f "${catalog}.tmp" "${catalog}"
+  ) 9> "$(catalog_lock_file)"
+}
+
+############################################
+# Drop records whose local file is gone (FILE backend)
+############################################
+catalog_prune_missing() {
+  local catalog gone key
+
+  catalog="$(catalog_file)"
+  [[ -f "${catalog}" ]] || return 0
+
+  gone="$(mktemp /tmp/catalog-gone.XXXXXX)"
+  while read -r key; do
+    [[ -e "${MYBASEDIR}/${key}" ]] || printf '%s\n' "${key}" >> "${gone}"
+  done < <(jq -r '.key' "${catalog}")
+
+  if [[ -s "${gone}" ]]; then
+    catalog_log "Removing $(wc -l < "${gone}") records of deleted backups"
+    catalog_remove "${gone}"
+  fi
+  rm -f "${gone}"
+}
+
+############################################
+# List stored objects as "<size> <key>" lines
+# Fails when the bucket cannot be listed.
+############################################
+catalog_list_objects() {
+  local listing
+
+  if [[ "${STORAGE_BACKEND}" == "S3" ]]; then
+    listing="$(s3cmd ls "s3://${BUCKET}" --recursive 2>/dev/null)" || return 1
+    sed -n "s#^[0-9-]* [0-9:]* *\([0-9]*\) *s3://${BUCKET}/\(.*\)#\1 \2#p" <<< "${listing}"
+  else
+    find "${MYBASEDIR}" \( -path "${MYBASEDIR}/chunks" -o -path "${MYBASEDIR}/wal" \) -prune \
+      -o -type f -printf '%s %P\n'
+  fi
+}
+
+############################################
+# Turn a listing (stdin) into catalog records (stdout)
+# Size and sidecars come from the listing; checksum and encryption are
+# left null as reading every .meta.json would cost one request each.
+############################################
+catalog_listing_records() {
+  jq -R -s -c --arg prefix "${DUMPPREFIX}_" '
+      [split("\n")[] | select(length > 0) | capture("^(?<size>[0-9]+) (?<key>.*)$")] as $objects
+      | ($objects | map({(.key): true}) | add // {}) as $keys
+      | $objects[]
+      | .key as $key
+      | ($key | split("/") | last) as $name
+      | select($name | startswith($prefix))
+      | ($name | capture("^(?<stem>.+)\\.(?<created>[0-9]{2}-[A-Za-z]+-[0-9]{4}-[0-9]{2}-[0-9]{2})\\.(?<ext>dmp|dir\\.tar|base\\.tar)(?<comp>\\.gz|\\.zst|\\.chunks)?$")) as $m
+      | {
+          key: $key,
+          database: ($m.stem | ltrimstr($prefix)),
+          created: $m.created,
+          datetime: (try ($m.created | strptime("%d-%B-%Y-%H-%M") | strftime("%Y-%m-%dT%H:%M")) catch null),
+          format: ({"dmp": "custom", "dir.tar": "directory", "base.tar": "physical"}[$m.ext]),
+          compression: ({".gz": "gzip", ".zst": "zstd", ".chunks": "chunked"}[$m.comp // ""] // "none"),
+          size: (.size | tonumber),
+          checksum: null,
+          encrypted: null,
+          sidecars: (([".meta.json", ".sha256", ".manifest.json", ".index.json"] | map(select($keys[$key + .])))
+                    + [$objects[].key | select(startswith($key + ".slice-")) | ltrimstr($key)])
+        }'
+}
+
+############################################
+# Rebuild the catalog from a full listing
+############################################
+catalog_rebuild() {
+  local catalog
+
+  catalog="$(catalog_file)"
+  create_non_existing_directory "${MYBASEDIR}"
+
+  catalog_log "Rebuilding catalog ${catalog} from a full listing" >&2
+
+  { catalog_list_objects || true; } | catalog_listing_records > "${catalog}.tmp"
+
+  mv -f "${catalog}.tmp" "${catalog}"
+  catalog_log "Catalog rebuilt with $(wc -l < "${catalog}") records" >&2
+}
+
+############################################
+# Bring the catalog in line with a full listing before retention
+# Backups the catalog does not know (made by other containers, or
+# before the catalog existed) are added from the listing, and records
+# of objects that are gone are dropped. Records that are kept keep
+# their checksum and encryption. Nothing changes if the listing fails.
+############################################
+catalog_reconcile() {
+  local catalog objects listed
+
+  catalog_load
+  catalog="$(catalog_file)"
+
+  objects="$(mktemp /tmp/catalog-objects.XXXXXX)"
+  if ! catalog_list_objects > "${objects}"; then
+    catalog_log "WARNING: Unable to list stored backups, the catalog is used as is"
+    rm -f "${objects}"
+    return 0
+  fi
+  listed="$(mktemp /tmp/catalog-listed.XXXXXX)"
+  catalog_listing_records < "${objects}" > "${listed}"
+  rm -f "${objects}"
+
+  (
+    flock 9
+    jq -n -c --slurpfile listed "${listed}" \
+      '($listed | map({(.key): true}) | add // {}) as $present
+       | [inputs] as $records
+       | ($records | map({(.key): true}) | add // {}) as $known
+       | ($records[] | select($present[.key])),
+         ($listed[] | select($known[.key] | not))' \
+      "${catalog}" > "${catalog}.tmp"
+    mv -f "${catalog}.tmp" "${catalog}"
+  ) 9> "$(catalog_lock_file)"
+
+  rm -f "${listed}"
+  catalog_log "Reconciled catalog with a full listing, $(wc -l < "${catalog}") records"
+}
+
+############################################
+# Make sure a local catalog is available
+# Order: CATALOG_REBUILD → local copy → bucket copy → full listing
+############################################
+catalog_load() {
+  local catalog
+  catalog="$(catalog_file)"
+
+  if [[ "${CATALOG_REBUILD:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    catalog_rebuild
+    return 0
+  fi
+
+  [[ -f "${catalog}" ]] && return 0
+
+  if [[ "${STORAGE_BACKEND}" == "S3" ]]; then
+    create_non_existing_directory "${MYBASEDIR}"
+    if s3cmd get "s3://${BUCKET}/catalog.jsonl" "${catalog}" >/dev/null 2>&1; then
+      catalog_log "Loaded catalog from s3://${BUCKET}/catalog.jsonl" >&2
+      return 0
+    fi
+    rm -f "${catalog}"
+  fi
+
+  catalog_rebuild
+}
+
+############################################
+# Catalog to read for a restore
+# Prints its path. S3 restores always fetch the bucket copy, which
+# backups in other containers publish to; the local catalog.jsonl is
+# only the working copy of the backups running here.
+############################################
+catalog_read() {
+  local catalog copy
+  catalog="$(catalog_file)"
+
+  if [[ "${STORAGE_BACKEND}" == "S3" && ! "${CATALOG_REBUILD:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    copy="${MYBASEDIR}/catalog.restore.jsonl"
+    create_non_existing_directory "${MYBASEDIR}"
+    if s3cmd get --force "s3://${BUCKET}/catalog.jsonl" "${copy}" >/dev/null 2>&1; then
+      catalog_log "Loaded catalog from s3://${BUCKET}/catalog.jsonl" >&2
+      echo "${copy}"
+      return 0
+    fi
+    rm -f "${copy}"
+    catalog_log "WARNING: Unable to fetch s3://${BUCKET}/catalog.jsonl, using the local catalog" >&2
+  fi
+
+  catalog_load >&2 || return 1
+  echo "${catalog}"
+}
+
+############################################
+# Upload the catalog to the bucket (S3 backend)
+############################################
+catalog_publish() {
+  local catalog
+  catalog="$(catalog_file)"
+
+  [[ "${STORAGE_BACKEND}" == "S3" && -f "${catalog}" ]] || return 0
+
+  if retry 3 s3cmd put "${catalog}" "s3://${BUCKET}/catalog.jsonl" >/dev/null 2>&1; then
+    catalog_log "Published catalog to s3://${BUCKET}/catalog.jsonl"
+  else
+    catalog_log "WARNING: Unable to publish catalog to s3://${BUCKET}/catalog.jsonl"
+  fi
+}
+
+############################################
+# Resolve TARGET_ARCHIVE_DATETIME / TARGET_ARCHIVE_DATE_ONLY
+# Prints the key of the matching artifact (latest of the day for a
+# date), or returns 1 when there is no catalog or no match.
+############################################
+catalog_resolve() {
+  local catalog key=""
+  local want_datetime="${TARGET_ARCHIVE_DATETIME:-}"
+  local want_date="${TARGET_ARCHIVE_DATE_ONLY:-}"
+
+  catalog="$(catalog_read)" || return 1
+  [[ -s "${catalog}" ]] || return 1
+
+  if [[ -n "${want_datetime}" ]]; then
+    key="$(jq -r -s \
+      --arg prefix "${DUMPPREFIX}_" \
+      --arg want "${want_datetime:0:10}T${want_datetime:11:2}:${want_datetime:14:2}" \
+      'map(select(.datetime == $want and .format != "physical" and (.key | split("/") | last | startswith($prefix))))
+       | last | .key // empty' "${catalog}")"
+  elif [[ -n "${want_date}" ]]; then
+    key="$(jq -r -s \
+      --arg prefix "${DUMPPREFIX}_" \
+      --arg date "${want_date}" \
+      'map(select((.datetime // "")[0:10] == $date and .format != "physical" and (.key | split("/") | last | startswith($prefix))))
+       | max_by(.datetime) | .key // empty' "${catalog}")"
+  fi
+
+  [[ -n "${key}" ]] || return 1
+
+  catalog_log "Resolved ${key} from catalog" >&2
+  echo "${key}"
+}
+
+############################################
+# Objects (artifacts + sidecars) of records older than <cutoff>
+# Usage: catalog_expired_objects <cutoff YYYY-MM-DDTHH:MM> [keep]
+# Prints "<size>\t<key>" lines; sidecars count as 0 bytes. The newest
+# <keep> backups (MIN_SAVED_FILE) are never selected.
+############################################
+catalog_expired_objects() {
+  local cutoff="$1"
+  local keep="${2:-0}"
+
+  jq -r -s --arg cutoff "${cutoff}" --argjson keep "${keep}" \
+    '(sort_by(.datetime) | reverse | .[0:$keep] | map({(.key): true}) | add // {}) as $protected
+     | .[]
+     | select(.datetime != null and .datetime < $cutoff and ($protected[.key] | not))
+     | .key as $k | "\(.size // 0)\t\($k)", (.sidecars[]? | "0\t\($k + .)")' \
+    "$(catalog_file)"
+}
+
+############################################
+# Objects to consolidate: all but the earliest backup per database and
+# day among records older than <cutoff>
+# Usage: catalog_consolidated_objects <cutoff YYYY-MM-DDTHH:MM> [keep]
+############################################
+catalog_consolidated_objects() {
+  local cutoff="$1"
+  local keep="${2:-0}"
+
+  jq -r -s --arg cutoff "${cutoff}" --argjson keep "${keep}" \
+    '(sort_by(.datetime) | reverse | .[0:$keep] | map({(.key): true}) | add // {}) as $protected
+     | [.[] | select(.datetime != null and .datetime < $cutoff)]
+     | group_by([.database, .datetime[0:10]])[]
+     | sort_by(.datetime) | .[1:][]
+     | select($protected[.key] | not)
+     | .key as $k | "\(.size // 0)\t\($k)", (.sidecars[]? | "0\t\($k + .)")' \
+    "$(catalog_file)"
+}
@@ -0,0 +1,205 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+change_log() {
+  log "[Change Detection] $*"
+}
+
+change_detection_enabled() {
+  [[ "${CHANGE_DETECTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+############################################
+# State file for a database
+# Usage: fingerprint_state_file <db>
+############################################
+fingerprint_state_file() {
+  echo "${MYBASEDIR}/.fingerprints/${1}.json"
+}
+
+############################################
+# Cheap change fingerprint of a database
+# Usage: database_fingerprint <db> <format> <codec>
+# Built from the pg_stat_database write counters, which any committed
+# INSERT/UPDATE/DELETE/DDL moves (including catalog changes), plus a
+# hash of the settings that shape the artifact. Prints nothing when
+# the counters cannot be read, which forces a full dump.
+############################################
+database_fingerprint() {
+  local db="$1"
+  local format="$2"
+  local codec="$3"
+  local counters settings
+
+  counters="$(
+    psql ${PG_CONN_PARAMETERS} -d "${db}" -At -c \
+      "SELECT concat_ws(':', datid,
+                        coalesce(extract(epoch FROM stats_reset)::bigint, 0),
+                        tup_inserted, tup_updated, tup_deleted)
+       FROM pg_stat_database
+       WHERE datname = current_database()" 2>/dev/null
+  )" || counters=""
+
+  if [[ -z "${counters}" ]]; then
+    change_log "WARNING: Unable to read statistics for ${db}, running a full dump" >&2
+    return 0
+  fi
+
+  settings="$(
+    printf '%s|%s|%s|%s|%s|%s' "${format}" "${DUMP_ARGS}" "${codec}" \
+      "${DB_DUMP_ENCRYPTION:-false}" "$(encryption_cipher)" "${STORAGE_BACKEND}" \
+      | md5sum | cut -c1-12
+  )"
+
+  echo "${counters}:${settings}"
+}
+
+############################################
+# Stage the fingerprint of a finished artifact
+# Usage: stage_fingerprint <db> <artifact>
+# Must run while <artifact>.meta.json still exists. The staged state
+# only becomes current through commit_fingerprint.
+############################################
+stage_fingerprint() {
+  local db="$1"
+  local artifact="$2"
+  local state
+
+  [[ -n "${CHANGE_FINGERPRINT:-}" ]] || return 0
+
+  state="$(fingerprint_state_file "${db}")"
+  create_non_existing_directory "$(dirname "${state}")"
+
+  jq -n \
+    --arg database "${db}" \
+    --arg fingerprint "${CHANGE_FINGERPRINT}" \
+    --arg artifact "${artifact}" \
+    --arg extension "${artifact#"${BASE_FILENAME}"}" \
+    --slurpfile metadata "${artifact}.meta.json" \
+    '{
+      database: $database,
+      fingerprint: $fingerprint,
+      artifact: $artifact,
+      extension: $extension,
+      metadata: $metadata[0]
+    }' > "${state}.pending"
+}
+
+############################################
+# Make the staged fingerprint current
+# Usage: commit_fingerprint <db> <status>
+############################################
+commit_fingerprint() {
+  local db="$1"
+  local status="$2"
+  local state
+
+  state="$(fingerprint_state_file "${db}")"
+  [[ -f "${state}.pending" ]] || return 0
+
+  if [[ "${status}" == "success" ]]; then
+    mv -f "${state}.pending" "${state}"
+  else
+    rm -f "${state}.pending"
+  fi
+}
+
+############################################
+# Reference-link the previous backup of an unchanged database
+# Usage: link_unchanged_backup <db>
+# Creates this run's artifact from the last one without dumping:
+# a hard link for FILE backends, a server-side copy for S3. The new
+# artifact carries this run's date, so retention always sees a fresh
+# latest backup. Prints the new artifact path, or returns 1 when a
+# full dump is needed.
+############################################
+link_unchanged_backup() {
+  local db="$1"
+  local state previous extension artifact name checksum
+
+  [[ -n "${CHANGE_FINGERPRINT:-}" ]] || return 1
+
+  state="$(fingerprint_state_file "${db}")"
+  [[ -f "${state}" ]] || return 1
+  [[ "$(jq -r '.fingerprint' "${state}")" == "${CHANGE_FINGERPRINT}" ]] || return 1
+
+  previous="$(jq -r '.artifact' "${state}")"
+  extension="$(jq -r '.extension' "${state}")"
+  artifact="${BASE_FILENAME}${extension}"
+  name="$(basename "${artifact}")"
+
+  change_log "Database ${db} unchanged since $(basename "${previous}")" >&2
+
+  if [[ "${STORAGE_BACKEND}" == "S3" ]]; then
+    local previous_key key
+    previous_key="$(s3_object_key "${previous}")"
+    key="$(s3_object_key "${artifact}")"
+
+    if [[ "${previous}" == "${artifact}" ]]; then
+      s3cmd info "s3://${BUCKET}/${key}" >/dev/null 2>&1 || return 1
+    elif ! retry 3 s3cmd cp "s3://${BUCKET}/${previous_key}" "s3://${BUCKET}/${key}" >/dev/null 2>&1; then
+      change_log "WARNING: Unable to copy s3://${BUCKET}/${previous_key}, running a full dump" >&2
+      return 1
+    fi
+  else
+    [[ -f "${previous}" ]] || {
+      change_log "WARNING: Previous backup ${previous} is gone, running a full dump" >&2
+      return 1
+    }
+
+    if [[ "${previous}" != "${artifact}" ]]; then
+      ln -f "${previous}" "${artifact}" 2>/dev/null || cp -p "${previous}" "${artifact}"
+    fi
+    # Retention works on modification times
+    touch "${artifact}"
+  fi
+
+  # Table slices (see slices.sh), the chunk manifest and the block
+  # index of a seekable archive (see seekable.sh) follow their archive
+  local suffix
+  while read -r suffix; do
+    [[ -n "${suffix}" && "${previous}" != "${artifact}" ]] || continue
+    if [[ "${STORAGE_BACKEND}" == "S3" ]]; then
+      retry 3 s3cmd cp "s3://${BUCKET}/${previous_key}${suffix}" "s3://${BUCKET}/${key}${suffix}" >/dev/null 2>&1 || {
+        change_log "WARNING: Unable to copy ${previous_key}${suffix}, running a full dump" >&2
+        return 1
+      }
+    else
+      ln -f "${previous}${suffix}" "${artifact}${suffix}" 2>/dev/null \
+        || cp -p "${previous}${suffix}" "${artifact}${suffix}" || return 1
+      touch "${artifact}${suffix}"
+    fi
+  done < <(jq -r '.metadata.slices.tables[]?.slices[]?.suffix, (.metadata.manifest.file // empty), (.metadata.seekable.index // empty)' "${state}")
+
+  # Sidecars keep the original checksum under the new name
+  checksum="$(jq -r '.metadata.checksum // empty' "${state}")"
+  jq \
+    --arg checksum "${checksum%% *}  ${name}" \
+    --arg linked_from "$(basename "${previous}")" \
+    '.metadata
+      | if .checksum then .checksum = $checksum else . end
+      | .linked_from = $linked_from' \
+    "${state}" > "${artifact}.meta.json" || return 1
+
+  if [[ -n "${checksum}" && "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    printf '%s  %s\n' "${checksum%% *}" "${name}" > "${artifact}.sha256"
+  fi
+
+  stage_fingerprint "${db}" "${artifact}"
+  catalog_stage "${db}" "${artifact}"
+
+  if [[ "${STORAGE_BACKEND}" == "S3" ]]; then
+    s3_upload_sidecars "${artifact}" >&2 || return 1
+
+    if [[ "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
+      cleanup_file "${artifact}.sha256" >&2
+      cleanup_file "${artifact}.meta.json" >&2
+    fi
+  fi
+
+  change_log "Linked ${name} to $(basename "${previous}")" >&2
+  echo "${artifact}"
+}
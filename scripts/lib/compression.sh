@@ -0,0 +1,170 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+compression_log() {
+  log "[Compression] $*"
+}
+
+############################################
+# Resolve codec for a dump format
+# Usage: resolve_compression <format>
+# COMPRESSION=auto skips external compression for formats that
+# pg_dump already compresses (custom/directory).
+############################################
+resolve_compression() {
+  local format="$1"
+  local codec="${COMPRESSION:-gzip}"
+
+  codec="${codec,,}"
+
+  if [[ "${codec}" == "auto" ]]; then
+    if [[ "${format}" =~ ^(custom|directory)$ ]] && ! pg_dump_compression_disabled; then
+      codec="none"
+    elif command -v zstd >/dev/null 2>&1; then
+      codec="zstd"
+    else
+      codec="gzip"
+    fi
+  fi
+
+  case "${codec}" in
+    none|gzip|pigz|zstd)
+      ;;
+    *)
+      compression_log "ERROR: Unknown COMPRESSION=${COMPRESSION}, valid values: none | gzip | pigz | zstd | auto" >&2
+      return 1
+      ;;
+  esac
+
+  if [[ "${codec}" != "none" && "${codec}" != "gzip" ]] && ! command -v "${codec}" >/dev/null 2>&1; then
+    compression_log "WARNING: ${codec} not installed, falling back to gzip" >&2
+    codec="gzip"
+  fi
+
+  echo "${codec}"
+}
+
+############################################
+# Checks whether DUMP_ARGS turns off pg_dump compression
+############################################
+pg_dump_compression_disabled() {
+  [[ "${DUMP_ARGS}" =~ (^|[[:space:]])(-Z[[:space:]]*0|--compress[=[:space:]]0|--compress[=[:space:]]none)($|[[:space:]]) ]]
+}
+
+############################################
+# Extra pg_dump args for an external codec
+# Usage: pg_dump_compression_args <format> <codec>
+# For the parallel codecs, pg_dump's built-in single-threaded zlib
+# compression is switched off (unless DUMP_ARGS sets it) so that the
+# data is only compressed once. That includes encrypted dumps, which
+# are compressed before they are encrypted.
+############################################
+pg_dump_compression_args() {
+  local format="$1"
+  local codec="$2"
+
+  [[ "${format}" =~ ^(custom|directory)$ ]] || return 0
+  [[ "${codec}" == "pigz" || "${codec}" == "zstd" ]] || return 0
+  [[ "${DUMP_ARGS}" =~ (^|[[:space:]])(-Z|--compress) ]] && return 0
+
+  echo "-Z0"
+}
+
+############################################
+# File extension for a codec
+# Usage: compression_extension <codec>
+############################################
+compression_extension() {
+  case "$1" in
+    gzip|pigz) echo ".gz" ;;
+    zstd) echo ".zst" ;;
+    *) echo "" ;;
+  esac
+}
+
+############################################
+# Thread count for parallel codecs
+############################################
+compression_threads() {
+  local threads="${COMPRESSION_THREADS:-0}"
+
+  if (( threads <= 0 )); then
+    threads="$(nproc 2>/dev/null || echo 1)"
+  fi
+
+  echo "${threads}"
+}
+
+############################################
+# Compression command line for a codec
+# Usage: compression_command <codec>
+############################################
+compression_command() {
+  local codec="$1"
+  local level="${COMPRESSION_LEVEL:-}"
+
+  case "${codec}" in
+    gzip) echo "gzip -${level:-9} -c" ;;
+    pigz) echo "pigz -${level:-9} -p $(compression_threads) -c" ;;
+    zstd) echo "zstd -q -${level:-3} -T$(compression_threads) -c" ;;
+    *) echo "cat" ;;
+  esac
+}
+
+############################################
+# Decompression command line for a codec
+# Usage: decompression_command <codec>
+############################################
+decompression_command() {
+  case "$1" in
+    gzip) echo "gzip -dc" ;;
+    pigz)
+      if command -v pigz >/dev/null 2>&1; then
+        echo "pigz -dc"
+      else
+        echo "gzip -dc"
+      fi
+      ;;
+    zstd) echo "zstd -q -dc" ;;
+    *) echo "cat" ;;
+  esac
+}
+
+############################################
+# Stream helpers (stdin → stdout)
+############################################
+compress_stream() {
+  $(compression_command "$1")
+}
+
+decompress_stream() {
+  $(decompression_command "$1")
+}
+
+############################################
+# Detect the codec of an archive
+# Usage: detect_compression <archive> [metadata_file]
+# The metadata "compression" field wins, the extension is the fallback.
+############################################
+detect_compression() {
+  local archive="$1"
+  local meta="${2:-${archive}.meta.json}"
+  local codec=""
+
+  if [[ -f "${meta}" ]]; then
+    codec="$(jq -r '.compression // empty' "${meta}")"
+  fi
+
+  if [[ -z "${codec}" ]]; then
+    case "${archive}" in
+      *.gz) codec="gzip" ;;
+      *.zst) codec="zstd" ;;
+      *) codec="none" ;;
+    esac
+  fi
+
+  echo "${codec}"
+}
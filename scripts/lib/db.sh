@@ -37,6 +37,17 @@ check_db_ready() {
   done
 }
 
+############################################
+# List the databases to back up
+# Prints one name per line, skipping templates and postgres.
+############################################
+discover_databases() {
+  until PGPASSWORD=${POSTGRES_PASS} pg_isready ${PG_CONN_PARAMETERS} >&2; do
+    sleep 1
+  done
+  PGPASSWORD=${POSTGRES_PASS} psql ${PG_CONN_PARAMETERS} -l | awk '$1 !~ /[+(|:]|Name|List|template|postgres/ {print $1}'
+}
+
 ############################################
 # Globals backup
 ############################################
@@ -84,6 +95,12 @@ backup_globals() {
 backup_databases() {
   local post_hook="${1:-}"
   DB_COUNT=$(wc -w <<< "${DBLIST}")
+
+  if (( ${BACKUP_CONCURRENCY:-1} > 1 && DB_COUNT > 1 )); then
+    backup_databases_concurrently "${post_hook}"
+    return 0
+  fi
+
   for DB in ${DBLIST}; do
     backup_single_database "${DB}" "${post_hook}"
 
@@ -93,6 +110,62 @@ backup_databases() {
   done
 }
 
+############################################
+# Concurrent DB backup dispatcher
+############################################
+backup_databases_concurrently() {
+  local post_hook="${1:-}"
+  local status_file
+  local job_rc db
+  local failed=()
+
+  status_file="$(mktemp /tmp/backup-status.XXXXXX)"
+
+  # Jobs share the run's MYDATE; artifact names are unique per database,
+  # so there is no need to wait for the minute to roll over between dumps.
+  export BACKUP_CONCURRENT_RUN=true
+  export BACKUP_POST_HOOK="${post_hook}"
+
+  db_log "Backing up ${DB_COUNT} databases with BACKUP_CONCURRENCY=${BACKUP_CONCURRENCY}"
+
+  # shellcheck disable=SC2086
+  run_job_pool "${BACKUP_CONCURRENCY}" "${status_file}" backup_database_job ${DBLIST}
+
+  while read -r job_rc db; do
+    if [[ "${job_rc}" -eq 0 ]]; then
+      db_log "Backup of ${db} succeeded"
+    else
+      db_log "ERROR: Backup of ${db} failed with exit code ${job_rc}"
+      failed+=("${db}")
+    fi
+  done < "${status_file}"
+
+  rm -f "${status_file}"
+  unset BACKUP_CONCURRENT_RUN BACKUP_POST_HOOK
+
+  if (( ${#failed[@]} > 0 )); then
+    db_log "ERROR: ${#failed[@]} of ${DB_COUNT} database backups failed: ${failed[*]}"
+    notify_monitoring "failure" || true
+    exit 1
+  fi
+
+  db_log "All ${DB_COUNT} database backups completed successfully"
+  notify_monitoring "success" || true
+}
+
+############################################
+# Single database job (concurrent mode)
+############################################
+backup_database_job() {
+  local DB="$1"
+
+  backup_single_database "${DB}" "${BACKUP_POST_HOOK:-}"
+
+  if [[ "${DB_TABLES,,}" =~ [Tt][Rr][Uu][Ee] ]]; then
+    dump_tables "${DB}"
+  fi
+}
+
 ############################################
 # Single DB backup
 ############################################
@@ -102,6 +175,7 @@ backup_single_database() {
   local status="success"
 
   create_non_existing_directory "${MYBACKUPDIR}"
+  metrics_reset_artifact
 
   if [[ -z "${ARCHIVE_FILENAME:-}" ]]; then
     BASE_FILENAME="${MYBACKUPDIR}/${DUMPPREFIX}_${DB}.${MYDATE}"
@@ -115,62 +189,145 @@ backup_single_database() {
   # Detect dump format
   ##########################################
   FORMAT="$(get_dump_format "${DUMP_ARGS}")"
+
+  # External compression applies to directory dumps and to S3 uploads
+  local codec="none"
+  if [[ "${FORMAT}" == "directory" || "${STORAGE_BACKEND}" == "S3" ]]; then
+    codec="$(resolve_compression "${FORMAT}")"
+  fi
+  # Deduplicated dumps are compressed chunk by chunk (see dedup.sh)
+  if [[ "${FORMAT}" == "custom" ]] && dedup_enabled; then
+    codec="chunked"
+  fi
+  local dump_args
+  dump_args="${DUMP_ARGS} $(pg_dump_compression_args "${FORMAT}" "${codec}")"
+
+  # Directory format dumps tables in parallel with DUMP_JOBS workers
+  if [[ "${FORMAT}" == "directory" && "${DUMP_JOBS:-1}" -gt 1 ]] \
+    && [[ ! "${DUMP_ARGS}" =~ (^|[[:space:]])(-j|--jobs) ]]; then
+    dump_args="${dump_args} -j $(throttle_jobs "${DUMP_JOBS}")"
+  fi
+
   local start_minute
   start_minute="$(date +%Y-%m-%d-%H-%M)"
 
+  # Fingerprint before dumping, so writes made during the dump show up next run
+  local linked_file=""
+  CHANGE_FINGERPRINT=""
+  if change_detection_enabled; then
+    CHANGE_FINGERPRINT="$(database_fingerprint "${DB}" "${FORMAT}" "${codec}")"
+    linked_file="$(link_unchanged_backup "${DB}")" || linked_file=""
+  fi
+
+  # The dump may read from a replica (see replicas.sh)
+  local primary_conn="${PG_CONN_PARAMETERS}"
+  local PG_CONN_PARAMETERS="${PG_CONN_PARAMETERS}"
+  local DUMP_SOURCE=""
+  if [[ -z "${linked_file}" ]] && replica_routing_enabled; then
+    route_database_dump "${DB}"
+  fi
+
   db_log "Starting backup of database ${DB} using format ${FORMAT} at $(date +%d-%B-%Y-%H-%M)"
 
+  # Tables over TABLE_SLICE_MB are exported in slices (see slices.sh)
+  if [[ -z "${linked_file}" ]] && table_slicing_enabled; then
+    plan_table_slices "${DB}"
+    dump_args="${dump_args} $(table_slice_dump_args)"
+  fi
+
+  ##########################################
+  # UNCHANGED (reference-linked, no dump)
+  ##########################################
+  if [[ -n "${linked_file}" ]]; then
+    db_log "Skipped dump of unchanged database ${DB}, linked ${linked_file}"
+
+    [[ -n "${post_hook}" ]] && "${post_hook}" "${linked_file}"
+
   ##########################################
   # DIRECTORY FORMAT
   ##########################################
-  if [[ "${FORMAT}" == "directory" ]]; then
+  elif [[ "${FORMAT}" == "directory" ]]; then
     local dump_dir="${BASE_FILENAME}.dir"
-    local tar_file="${BASE_FILENAME}.dir.tar.gz"
+    local tar_file="${BASE_FILENAME}.dir.tar$(compression_extension "${codec}")"
 
     rm -rf "${dump_dir}"
 
     create_non_existing_directory "${dump_dir}"
 
-    if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
-      db_log "ERROR: Encryption not supported with directory format"
-      status="failure"
-    fi
+    export_table_slices "${DB}" "${tar_file}" || status="failure"
+
+    metrics_begin
+    pg_dump ${PG_CONN_PARAMETERS} ${dump_args} -d "${DB}" -f "${dump_dir}" \
+      || status="failure"
+    metrics_end "${DB}" dump 0 "${dump_dir}" "${status}"
 
     if [[ "${status}" == "success" ]]; then
-      pg_dump ${PG_CONN_PARAMETERS} ${DUMP_ARGS} -d "${DB}" -f "${dump_dir}" \
-        || status="failure"
+      # Restores check it against the free space before unpacking
+      local DUMP_UNPACKED_BYTES
+      DUMP_UNPACKED_BYTES="$(du -sb "${dump_dir}" | cut -f1)"
+      write_directory_archive "${DB}" "${dump_dir}" "${tar_file}" "${codec}" || status="failure"
     fi
+    rm -rf "${dump_dir}"
 
     if [[ "${status}" == "success" ]]; then
-      db_log "Tarring directory dump with max compression"
-      tar -C "$(dirname "${dump_dir}")" \
-          -I 'gzip -9' \
-          -cf "${tar_file}" "$(basename "${dump_dir}")" \
-          || status="failure"
+      setup_metadata "${tar_file}" "${codec}"
+      stage_fingerprint "${DB}" "${tar_file}"
+      catalog_stage "${DB}" "${tar_file}"
+      store_directory_archive "${DB}" "${tar_file}" || status="failure"
     fi
 
-    rm -rf "${dump_dir}"
+    [[ "${status}" == "success" && -n "${post_hook}" ]] && "${post_hook}" "${tar_file}"
+
+  ##########################################
+  # DEDUPLICATED (-Fc → .dmp.chunks manifest + shared chunks)
+  ##########################################
+  elif [[ "${codec}" == "chunked" ]]; then
+    local final_file="${BASE_FILENAME}.dmp.chunks"
+
+    export_table_slices "${DB}" "${final_file}" || status="failure"
+    if [[ "${status}" == "success" ]]; then
+      dump_to_chunk_store "${DB}" "${final_file}" "${dump_args}" || status="failure"
+    fi
 
-    ##########################################
-    # Checksum + metadata (FINAL artifact)
-    ##########################################
     if [[ "${status}" == "success" && "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
-      generate_gz_checksum "${tar_file}" || status="failure"
+      metrics_begin
+      generate_gz_checksum "${final_file}" || status="failure"
+      metrics_end "${DB}" checksum "${final_file}" 0 "${status}"
     fi
 
     if [[ "${status}" == "success" ]]; then
-      setup_metadata "${tar_file}"
+      setup_metadata "${final_file}" "${codec}"
+      stage_fingerprint "${DB}" "${final_file}"
+      catalog_stage "${DB}" "${final_file}"
     fi
 
     if [[ "${status}" == "success" && "${STORAGE_BACKEND}" == "S3" ]]; then
-      s3_upload "${tar_file}" || status="failure"
+      metrics_begin
+      s3_upload "${final_file}" || status="failure"
+      metrics_end "${DB}" upload "${final_file}" transfer "${status}"
 
       if [[ "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
-        cleanup_file "${tar_file}.sha256"
+        cleanup_file "${final_file}.sha256"
+        cleanup_file "${final_file}.manifest.json"
+        cleanup_file "${final_file}.meta.json"
+        cleanup_file "${final_file}"
       fi
     fi
 
-    [[ "${status}" == "success" && -n "${post_hook}" ]] && "${post_hook}" "${tar_file}"
+    [[ "${status}" == "success" && -n "${post_hook}" ]] && "${post_hook}" "${final_file}"
+
+  ##########################################
+  # S3 STREAMING (-Fc → .dmp[.gz|.zst], no local staging)
+  ##########################################
+  elif [[ "${STORAGE_BACKEND}" == "S3" && "${S3_STREAMING_UPLOAD:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    local final_file="${BASE_FILENAME}.dmp$(compression_extension "${codec}")"
+
+    export_table_slices "${DB}" "${final_file}" || status="failure"
+    if [[ "${status}" == "success" ]]; then
+      stream_dump_to_s3 "${DB}" "${final_file}" "${codec}" "${dump_args}" || status="failure"
+    fi
+
+    [[ "${status}" == "success" && -n "${post_hook}" ]] && "${post_hook}" "${final_file}"
 
   ##########################################
   # CUSTOM FORMAT (-Fc)
@@ -179,14 +336,41 @@ backup_single_database() {
     local dump_file="${BASE_FILENAME}.dmp"
     local final_file="${dump_file}"
 
+    # Slices are named after the artifact that is finally stored
+    if [[ "${STORAGE_BACKEND}" == "S3" && "${codec}" != "none" ]]; then
+      export_table_slices "${DB}" "${dump_file}$(compression_extension "${codec}")" || status="failure"
+    else
+      export_table_slices "${DB}" "${dump_file}" || status="failure"
+    fi
+
     ##########################################
     # Dump database
     ##########################################
-    if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ \
+        && "${STORAGE_BACKEND}" == "S3" && "${codec}" != "none" ]]; then
+      # Ciphertext does not compress, so compression comes first and no
+      # plain copy of the dump is written
+      local DUMP_ENCODING="compress-encrypt"
+      final_file="${dump_file}$(compression_extension "${codec}")"
+      db_log "Dumping database ${DB} with ${codec} compression and encryption"
+      require_encryption_key
+      set -o pipefail
+      metrics_begin
+      pg_dump ${PG_CONN_PARAMETERS} ${dump_args} -d "${DB}" \
+        | throttle_stream \
+        | compress_stream "${codec}" \
+        | encrypt_stream > "${final_file}"
+      rc=$?
+      set +o pipefail
+      unset_dump_encryption_pass
+      [[ $rc -ne 0 ]] && status="failure"
+    elif [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
       db_log "Dumping database ${DB} with encryption"
       require_encryption_key
       set -o pipefail
-      pg_dump ${PG_CONN_PARAMETERS} ${DUMP_ARGS} -d "${DB}" \
+      metrics_begin
+      pg_dump ${PG_CONN_PARAMETERS} ${dump_args} -d "${DB}" \
+        | throttle_stream \
         | encrypt_stream > "${dump_file}"
       rc=$?
       set +o pipefail
@@ -194,48 +378,79 @@ backup_single_database() {
       [[ $rc -ne 0 ]] && status="failure"
     else
       db_log "Dumping database ${DB} without encryption"
-      pg_dump ${PG_CONN_PARAMETERS} ${DUMP_ARGS} -d "${DB}" > "${dump_file}" \
-        || status="failure"
+      local rc=0
+      # A pg_dump failing mid-dump must not pass as throttle_stream's status
+      set -o pipefail
+      metrics_begin
+      pg_dump ${PG_CONN_PARAMETERS} ${dump_args} -d "${DB}" \
+        | throttle_stream > "${dump_file}" || rc=$?
+      set +o pipefail
+      (( rc == 0 )) || status="failure"
     fi
+    metrics_end "${DB}" dump 0 "${final_file}" "${status}"
 
     ##########################################
     # S3 backend → compress first
     ##########################################
-    if [[ "${status}" == "success" && "${STORAGE_BACKEND}" == "S3" ]]; then
-      local gz_file="${dump_file}.gz"
-      gzip -9 -c "${dump_file}" > "${gz_file}" || status="failure"
+    # Encrypted dumps were already compressed while dumping
+    if [[ "${final_file}" != "${dump_file}" ]]; then
+      db_log "Dumped ${DB} to ${final_file}"
+    elif [[ "${status}" == "success" && "${STORAGE_BACKEND}" == "S3" ]] && seekable_enabled; then
+      local gz_file="${dump_file}$(compression_extension "${codec}")"
+      db_log "Writing ${dump_file} as a seekable archive (compression=${codec})"
+      metrics_begin
+      seekable_compress "${codec}" "${dump_file}" "${gz_file}" || status="failure"
+      metrics_end "${DB}" compress "${dump_file}" "${gz_file}" "${status}"
+      final_file="${gz_file}"
+    elif [[ "${status}" == "success" && "${STORAGE_BACKEND}" == "S3" && "${codec}" != "none" ]]; then
+      local gz_file="${dump_file}$(compression_extension "${codec}")"
+      db_log "Compressing ${dump_file} with ${codec}"
+      metrics_begin
+      compress_stream "${codec}" < "${dump_file}" > "${gz_file}" || status="failure"
+      metrics_end "${DB}" compress "${dump_file}" "${gz_file}" "${status}"
       final_file="${gz_file}"
-
-
-
     fi
 
     ##########################################
     # Checksum + metadata (FINAL artifact ONLY)
     ##########################################
     if [[ "${status}" == "success" && "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+      metrics_begin
       generate_gz_checksum "${final_file}" || status="failure"
+      metrics_end "${DB}" checksum "${final_file}" 0 "${status}"
     fi
 
     if [[ "${status}" == "success" ]]; then
-      setup_metadata "${final_file}"
+      setup_metadata "${final_file}" "${codec}"
+      stage_fingerprint "${DB}" "${final_file}"
+      catalog_stage "${DB}" "${final_file}"
     fi
 
 
     ##########################################
     # Upload
     ##########################################
-    if [[ "${status}" == "success" && "${STORAGE_BACKEND}" == "S3" ]]; then
+    if [[ "${status}" == "success" && "${STORAGE_BACKEND}" == "S3" ]] \
+        && upload_queue_add "${DB}" "${final_file}"; then
+      # The uploader removes the artifact once it is in the bucket
+      if [[ "${dump_file}" != "${final_file}" && "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
+        cleanup_file "${dump_file}"
+      fi
+    elif [[ "${status}" == "success" && "${STORAGE_BACKEND}" == "S3" ]]; then
+      metrics_begin
       s3_upload "${final_file}" || status="failure"
+      metrics_end "${DB}" upload "${final_file}" transfer "${status}"
 
 
 
       if [[ "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
-        db_log "Cleaning uncompressed file ${gz_file} "
+        db_log "Cleaning local dump files for ${final_file}"
         cleanup_file "${final_file}.sha256"
+        cleanup_file "${final_file}.manifest.json"
 
         cleanup_file "${final_file}"
         cleanup_file "${final_file}.meta.json"
+        cleanup_file "${final_file}.index.json"
         cleanup_file "${dump_file}"
       fi
     fi
@@ -243,10 +458,24 @@ backup_single_database() {
     [[ "${status}" == "success" && -n "${post_hook}" ]] && "${post_hook}" "${final_file}"
   fi
 
+  # Recovery conflicts cancel long dumps on a standby, so a dump that
+  # failed on a replica is taken again from the primary
+  if [[ "${status}" == "failure" && "${DUMP_SOURCE}" == *'"role":"replica"'* ]]; then
+    db_log "WARNING: Dump of ${DB} from a replica failed, retrying against the primary"
+    close_table_slices
+    PG_CONN_PARAMETERS="${primary_conn}"
+    REPLICA_FALLBACK=true backup_single_database "${DB}" "${post_hook}"
+    return
+  fi
+
   ##########################################
   # Final status + monitoring
   ##########################################
-  if [[ "${status}" == "success" ]]; then
+  close_table_slices
+  commit_fingerprint "${DB}" "${status}"
+  catalog_commit "${DB}" "${status}"
+
+  if [[ "${status}" == "success" && "${BACKUP_CONCURRENT_RUN:-false}" != "true" ]]; then
     local end_minute
     end_minute="$(date +%Y-%m-%d-%H-%M)"
 
@@ -259,47 +488,393 @@ backup_single_database() {
   fi
 
   unset_postgres_pass
-  notify_monitoring "${status}" || true
+  # Concurrent runs report a single aggregated status once all jobs finish
+  if [[ "${BACKUP_CONCURRENT_RUN:-false}" != "true" ]]; then
+    notify_monitoring "${status}" || true
+  fi
   [[ "${status}" == "success" ]]
 }
+############################################
+# Are directory archives streamed straight to S3?
+############################################
+directory_archive_streamed() {
+  [[ "${STORAGE_BACKEND}" == "S3" && "${S3_STREAMING_UPLOAD:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+############################################
+# Archive a dump directory into its final tar artifact
+# Usage: write_directory_archive <db> <dump_dir> <tar_file> <codec>
+# The tar is written locally and checksummed, or streamed to S3 (see
+# directory_archive_streamed). Files leave <dump_dir> as they are added.
+############################################
+write_directory_archive() {
+  local DB="$1"
+  local dump_dir="$2"
+  local tar_file="$3"
+  local codec="$4"
+  local rc=0
+
+  set -o pipefail
+  if directory_archive_streamed; then
+    db_log "Streaming $(basename "${dump_dir}") to S3 with compression=${codec}"
+    metrics_begin
+    archive_directory_dump "${dump_dir}" "${codec}" \
+      | encode_directory_stream \
+      | s3_stream_upload "${tar_file}" \
+      || rc=$?
+    metrics_end "${DB}" stream "${METRICS_LAST_BYTES_OUT:-0}" transfer "${rc}"
+    return "${rc}"
+  fi
+
+  db_log "Tarring $(basename "${dump_dir}") with compression=${codec}"
+  metrics_begin
+  archive_directory_dump "${dump_dir}" "${codec}" \
+    | encode_directory_stream > "${tar_file}" \
+    || rc=$?
+  metrics_end "${DB}" archive "${METRICS_LAST_BYTES_OUT:-0}" "${tar_file}" "${rc}"
+
+  if (( rc == 0 )) && [[ "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    metrics_begin
+    generate_gz_checksum "${tar_file}" || rc=$?
+    metrics_end "${DB}" checksum "${tar_file}" 0 "${rc}"
+  fi
+  return "${rc}"
+}
+
+############################################
+# Upload a finished tar artifact and its sidecars (S3 backend)
+# Usage: store_directory_archive <db> <tar_file>
+# Runs once setup_metadata has written <tar_file>.meta.json. A streamed
+# archive is already in the bucket, so only its sidecars are sent.
+# With UPLOAD_QUEUE the archive is queued instead (see upload_queue.sh).
+############################################
+store_directory_archive() {
+  local DB="$1"
+  local tar_file="$2"
+  local rc=0
+
+  [[ "${STORAGE_BACKEND}" == "S3" ]] || return 0
+
+  if directory_archive_streamed; then
+    s3_upload_sidecars "${tar_file}" || return 1
+
+    if [[ "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
+      cleanup_file "${tar_file}.sha256"
+      cleanup_file "${tar_file}.manifest.json"
+      cleanup_file "${tar_file}.meta.json"
+    fi
+    return 0
+  fi
+
+  upload_queue_add "${DB}" "${tar_file}" && return 0
+
+  metrics_begin
+  s3_upload "${tar_file}" || rc=$?
+  metrics_end "${DB}" upload "${tar_file}" transfer "${rc}"
+
+  if [[ "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
+    cleanup_file "${tar_file}.sha256"
+    cleanup_file "${tar_file}.manifest.json"
+  fi
+  return "${rc}"
+}
+
+############################################
+# Archive a directory-format dump to stdout
+# Usage: archive_directory_dump <dump_dir> <codec>
+# pg_dump already compresses every table file, so with COMPRESSION
+# none/auto the files are stored as-is. Each file is removed as soon as
+# it is in the archive, which keeps peak disk usage close to one copy
+# of the dump instead of two.
+############################################
+archive_directory_dump() {
+  local dump_dir="$1"
+  local codec="$2"
+
+  tar -C "$(dirname "${dump_dir}")" \
+      --remove-files \
+      -cf - "$(basename "${dump_dir}")" \
+    | compress_stream "${codec}"
+}
+
+############################################
+# Encrypt a directory archive stream when DB_DUMP_ENCRYPTION is on
+# Directory archives are compressed before they are encrypted, so the
+# codec still sees plain data. decode_directory_stream undoes this.
+############################################
+encode_directory_stream() {
+  if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    encrypt_stream
+  else
+    cat
+  fi
+}
+
+############################################
+# Streaming dump → compress → hash → upload
+# Usage: stream_dump_to_s3 <db> <artifact> <codec> <dump_args>
+############################################
+stream_dump_to_s3() {
+  local DB="$1"
+  local artifact="$2"
+  local codec="$3"
+  local dump_args="$4"
+  local rc=0
+
+  set -o pipefail
+  # Stages overlap, so the whole pipeline is timed as one stream phase
+  metrics_begin
+  if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    db_log "Streaming encrypted dump of ${DB} to S3"
+    require_encryption_key
+    # Ciphertext does not compress, so compression comes first
+    local DUMP_ENCODING="compress-encrypt"
+    pg_dump ${PG_CONN_PARAMETERS} ${dump_args} -d "${DB}" \
+      | throttle_stream \
+      | metrics_meter \
+      | compress_stream "${codec}" \
+      | encrypt_stream \
+      | s3_stream_upload "${artifact}" || rc=$?
+    unset_dump_encryption_pass
+  else
+    db_log "Streaming dump of ${DB} to S3"
+    pg_dump ${PG_CONN_PARAMETERS} ${dump_args} -d "${DB}" \
+      | throttle_stream \
+      | metrics_meter \
+      | compress_stream "${codec}" \
+      | s3_stream_upload "${artifact}" || rc=$?
+  fi
+  metrics_end "${DB}" stream metered transfer "${rc}"
+
+  if (( rc != 0 )); then
+    db_log "ERROR: Streaming backup of ${DB} failed"
+    cleanup_file "${artifact}.sha256"
+    return "${rc}"
+  fi
+
+  # Sidecars are derived from the stream just uploaded
+  local DUMP_STREAMED=true
+  setup_metadata "${artifact}" "${codec}"
+  stage_fingerprint "${DB}" "${artifact}"
+  catalog_stage "${DB}" "${artifact}"
+  s3_upload_sidecars "${artifact}" || return 1
+
+  if [[ "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
+    cleanup_file "${artifact}.sha256"
+    cleanup_file "${artifact}.manifest.json"
+    cleanup_file "${artifact}.meta.json"
+  fi
+}
+
+############################################
+# Exported snapshot session
+# Usage: open_snapshot_session <db> / close_snapshot_session
+# Keeps a REPEATABLE READ transaction open in a background psql and
+# exports its snapshot as SNAPSHOT_ID, so several pg_dump processes
+# (pg_dump --snapshot) see exactly the same data.
+############################################
+open_snapshot_session() {
+  local db="$1"
+  local snap_file
+  local waited=0
+  local max_wait=$(( ${DB_READY_TIMEOUT:-20} * 10 ))
+
+  snap_file="$(mktemp /tmp/snapshot.XXXXXX)"
+
+  coproc SNAPSHOT_SESSION {
+    psql ${PG_CONN_PARAMETERS} -d "${db}" -At -q -v ON_ERROR_STOP=1 >/dev/null 2>&1
+  }
+
+  printf '\\o %s\nBEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;\nSELECT pg_export_snapshot();\n\\o\n' \
+    "${snap_file}" >&"${SNAPSHOT_SESSION[1]}"
+
+  until [[ -s "${snap_file}" ]] || (( waited >= max_wait )); do
+    sleep 0.1
+    waited=$(( waited + 1 ))
+  done
+
+  SNAPSHOT_ID="$(head -n 1 "${snap_file}")"
+  rm -f "${snap_file}"
+
+  if [[ -z "${SNAPSHOT_ID}" ]]; then
+    db_log "ERROR: Unable to export a snapshot for ${db}"
+    close_snapshot_session
+    return 1
+  fi
+
+  db_log "Exported snapshot ${SNAPSHOT_ID} for ${db}"
+}
+
+close_snapshot_session() {
+  [[ -n "${SNAPSHOT_SESSION_PID:-}" ]] || return 0
+
+  local pid="${SNAPSHOT_SESSION_PID}"
+  printf 'COMMIT;\n\\q\n' >&"${SNAPSHOT_SESSION[1]}" 2>/dev/null || true
+  wait "${pid}" 2>/dev/null || true
+  unset SNAPSHOT_ID
+}
+
 ############################################
 # Table-level dumps
+# All tables are dumped from one exported snapshot by a pool of
+# TABLE_DUMP_JOBS workers, largest tables first. Each table is written
+# as a custom-format archive and listed in a per-database index.
 ############################################
 dump_tables() {
   local DATABASE="$1"
+  local status_file
+  local failed=()
+  local tables=()
 
   db_log "Starting table-level dumps for ${DATABASE}"
 
+  validate_postgres_pass
+
+  local primary_conn="${PG_CONN_PARAMETERS}"
+  local PG_CONN_PARAMETERS="${PG_CONN_PARAMETERS}"
+  local DUMP_SOURCE=""
+  if replica_routing_enabled; then
+    route_database_dump "${DATABASE}"
+  fi
+
   mapfile -t tables < <(
-    PGPASSWORD="${POSTGRES_PASS}" \
-    psql ${PG_CONN_PARAMETERS} -d "${DATABASE}" -At -F '.' \
+    psql ${PG_CONN_PARAMETERS} -d "${DATABASE}" -At -F $'\t' \
     -c "SELECT table_schema, table_name
         FROM information_schema.tables
         WHERE table_schema NOT IN ('information_schema','pg_catalog','topology', 'pg_toast')
-        ORDER BY table_schema, table_name"
+        ORDER BY pg_total_relation_size(format('%I.%I', table_schema, table_name)::regclass) DESC,
+                 table_schema, table_name"
   )
 
-  for tbl in "${tables[@]}"; do
-    local schema="${tbl%%.*}"
-    local table="${tbl##*.}"
-    local fqtn="${schema}.${table}"
-    local out="${MYBACKUPDIR}/${DUMPPREFIX}_${fqtn}_${MYDATE}.sql"
+  if (( ${#tables[@]} == 0 )); then
+    db_log "No tables found in ${DATABASE}"
+    unset_postgres_pass
+    return 0
+  fi
 
+  metrics_begin
+  open_snapshot_session "${DATABASE}"
 
+  db_log "Dumping ${#tables[@]} tables of ${DATABASE} with TABLE_DUMP_JOBS=${TABLE_DUMP_JOBS:-1}"
 
-    if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
-      set -o pipefail
-      db_log "Dumping Encrypted table ${fqtn}"
-      pg_dump ${PG_CONN_PARAMETERS} -d "${DATABASE}" -t "${fqtn}" \
-        | encrypt_stream \
-        > "${out}"
-      set +o pipefail
-    else
-      db_log "Dumping table ${fqtn}"
-      pg_dump ${PG_CONN_PARAMETERS} -d "${DATABASE}" -t "${fqtn}" \
-        > "${out}"
-    fi
-  done
+  status_file="$(mktemp /tmp/table-status.XXXXXX)"
+  run_job_pool "${TABLE_DUMP_JOBS:-1}" "${status_file}" dump_table_job "${tables[@]}"
+
+  local snapshot="${SNAPSHOT_ID}"
+  close_snapshot_session
+
+  write_table_index "${DATABASE}" "${status_file}" "${snapshot}"
+  mapfile -t failed < <(job_pool_failures "${status_file}")
+  rm -f "${status_file}"
+
+  metrics_end "${DATABASE}" tables 0 \
+    "$(jq '[.tables[].size] | add // 0' "$(table_index_path "${DATABASE}")")" "${#failed[@]}"
+
+  unset_postgres_pass
+
+  if (( ${#failed[@]} > 0 )) && [[ "${DUMP_SOURCE}" == *'"role":"replica"'* ]]; then
+    db_log "WARNING: ${#failed[@]} table dumps of ${DATABASE} from a replica failed, retrying against the primary"
+    PG_CONN_PARAMETERS="${primary_conn}"
+    REPLICA_FALLBACK=true dump_tables "${DATABASE}"
+    return
+  fi
+
+  if (( ${#failed[@]} > 0 )); then
+    db_log "ERROR: ${#failed[@]} table dumps failed for ${DATABASE}: ${failed[*]//$'\t'/.}"
+    return 1
+  fi
+
+  db_log "Table-level dumps for ${DATABASE} completed"
+}
+
+############################################
+# Table artifact path
+# Usage: table_dump_path <db> <schema> <table>
+############################################
+table_dump_path() {
+  local db="$1"
+  local schema="$2"
+  local table="$3"
+
+  echo "${MYBACKUPDIR}/${DUMPPREFIX}_${db}.${schema//\//_}.${table//\//_}_${MYDATE}.dmp"
+}
+
+############################################
+# Dump one table (job pool worker)
+# Usage: dump_table_job "<schema>\t<table>"
+############################################
+dump_table_job() {
+  local schema table out
+  IFS=$'\t' read -r schema table <<< "$1"
+
+  out="$(table_dump_path "${DATABASE}" "${schema}" "${table}")"
+
+  # Quote identifiers so mixed-case and special names match exactly
+  local pattern="\"${schema}\".\"${table}\""
+
+  set -o pipefail
+  if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    db_log "Dumping Encrypted table ${schema}.${table}"
+    pg_dump ${PG_CONN_PARAMETERS} -d "${DATABASE}" --snapshot="${SNAPSHOT_ID}" -Fc -t "${pattern}" \
+      | throttle_stream \
+      | encrypt_stream \
+      > "${out}"
+  else
+    db_log "Dumping table ${schema}.${table}"
+    pg_dump ${PG_CONN_PARAMETERS} -d "${DATABASE}" --snapshot="${SNAPSHOT_ID}" -Fc -t "${pattern}" \
+      | throttle_stream \
+      > "${out}"
+  fi
+}
+
+############################################
+# Table index path
+# Usage: table_index_path <db>
+############################################
+table_index_path() {
+  echo "${MYBACKUPDIR}/${DUMPPREFIX}_$1.tables.${MYDATE}.json"
+}
+
+############################################
+# Per-database table index
+# Usage: write_table_index <db> <status_file> <snapshot>
+############################################
+write_table_index() {
+  local db="$1"
+  local status_file="$2"
+  local snapshot="$3"
+  local index
+  index="$(table_index_path "${db}")"
+  local rc item schema table out
+  local encrypted="false"
+
+  [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && encrypted="true"
+
+  while read -r rc item; do
+    [[ "${rc}" -eq 0 ]] || continue
+    IFS=$'\t' read -r schema table <<< "${item}"
+    out="$(table_dump_path "${db}" "${schema}" "${table}")"
+    printf '%s\t%s\t%s\t%s\n' "${schema}" "${table}" "$(basename "${out}")" "$(stat -c %s "${out}")"
+  done < "${status_file}" \
+    | jq -R -s \
+        --arg database "${db}" \
+        --arg snapshot "${snapshot}" \
+        --arg created "${MYDATE}" \
+        --argjson encrypted "${encrypted}" \
+        --argjson source "${DUMP_SOURCE:-null}" \
+        '{
+          database: $database,
+          snapshot: $snapshot,
+          created: $created,
+          format: "custom",
+          encrypted: $encrypted,
+          tables: [
+            split("\n")[] | select(length > 0) | split("\t")
+            | {schema: .[0], table: .[1], file: .[2], size: (.[3] | tonumber)}
+          ]
+        } + (if $source then {source: $source} else {} end)' > "${index}"
+
+  db_log "Wrote table index ${index}"
 }
 
 ############################################
@@ -322,40 +897,226 @@ restore_recreate_db() {
   unset_postgres_pass
 }
 
+############################################
+# Does RESTORE_ARGS ask for a parallel pg_restore?
+# Parallel restores need a seekable archive, so they cannot read stdin.
+############################################
+restore_args_parallel() {
+  [[ "${RESTORE_ARGS:-}" =~ (^|[[:space:]])(-j|--jobs) ]]
+}
+
+############################################
+# pg_restore jobs for an archive
+# Usage: restore_jobs <archive> [codec] [encrypted]
+# RESTORE_JOBS=auto sizes -j from the archive's table of contents: one
+# job per table data, index and constraint entry, capped by the cores
+# left to this restore. RESTORE_FANOUT is the number of databases a
+# cluster or multi-target restore runs at once, and a single restore
+# gets every core. Archives under 16 MiB restore with a single job. A compressed or
+# encrypted custom dump only has its head decoded to read the TOC.
+############################################
+restore_jobs() {
+  local archive="$1"
+  local codec="${2:-none}"
+  local encrypted="${3:-false}"
+  local cores size listing="" entries
+
+  if [[ "${RESTORE_JOBS:-auto}" != "auto" ]]; then
+    echo "${RESTORE_JOBS}"
+    return 0
+  fi
+
+  # A deduplicated dump is sized from its manifest
+  if [[ "${archive}" == *.chunks ]]; then
+    size="$(jq -r '.size' "${archive}")"
+  else
+    size="$(du -sb "${archive}" | cut -f1)"
+  fi
+  if (( size < 16 * 1024 * 1024 )); then
+    echo 1
+    return 0
+  fi
+
+  cores=$(( $(nproc) / ${RESTORE_FANOUT:-1} ))
+  (( cores < 1 )) && cores=1
+
+  if [[ "${archive}" == *.chunks ]]; then
+    listing="$(chunk_restore_stream "${archive}" 2>/dev/null | pg_restore -l 2>/dev/null)" || true
+  elif [[ "${codec}" == "none" && ! "${encrypted}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    listing="$(pg_restore -l "${archive}" 2>/dev/null)" || listing=""
+  else
+    # pg_restore stops reading once it has the TOC
+    listing="$(decode_dump_stream "${codec}" "${encrypted}" < "${archive}" 2>/dev/null \
+      | pg_restore -l 2>/dev/null)" || true
+  fi
+
+  entries="$(grep -cE '^[0-9]+; [0-9]+ [0-9]+ (TABLE DATA|INDEX|CONSTRAINT|FK CONSTRAINT|BLOBS|LARGE OBJECTS|MATERIALIZED VIEW DATA) ' <<< "${listing}" || true)"
+  (( entries < 1 )) && entries=1
+
+  echo $(( entries < cores ? entries : cores ))
+}
+
+############################################
+# pg_restore -j option for an archive
+# Usage: restore_jobs_arg <archive> [codec] [encrypted]
+# Prints nothing when RESTORE_ARGS sets its own -j or one job is enough.
+############################################
+restore_jobs_arg() {
+  restore_args_parallel && return 0
+
+  local jobs
+  jobs="$(restore_jobs "$@")"
+  if (( jobs > 1 )); then
+    echo "-j ${jobs}"
+  fi
+}
+
+############################################
+# Will the restore run in parallel?
+# Usage: restore_wants_parallel [archive codec encrypted]
+# Parallel restores need a seekable archive, so a streamed dump has to
+# be spooled first. A download stream cannot be peeked at, so with
+# RESTORE_JOBS=auto it is spooled and sized from the spool.
+############################################
+restore_wants_parallel() {
+  restore_args_parallel && return 0
+
+  if [[ "${RESTORE_JOBS:-auto}" != "auto" ]]; then
+    (( RESTORE_JOBS > 1 ))
+    return
+  fi
+
+  (( $# > 0 )) || return 0
+  (( $(restore_jobs "$@") > 1 ))
+}
+
+############################################
+# PGOPTIONS for restore sessions
+# Adds each RESTORE_SESSION_SETTINGS name=value as a -c option.
+############################################
+restore_pgoptions() {
+  local setting
+  local options="${PGOPTIONS:-}"
+
+  for setting in ${RESTORE_SESSION_SETTINGS:-}; do
+    options+=" -c ${setting}"
+  done
+
+  echo "${options# }"
+}
+
+############################################
+# Turn a stored custom archive back into a plain dump (stdin → stdout)
+# Usage: decode_dump_stream <codec> <encrypted> [encoding]
+# Undoes compress_stream and encrypt_stream in reverse order. <encoding>
+# is the order recorded in the metadata (RESTORE_META_ENCODING):
+# "compress-encrypt", or empty for archives that were encrypted before
+# they were compressed.
+############################################
+decode_dump_stream() {
+  local codec="$1"
+  local encrypted="${2:-false}"
+  local encoding="${3-${RESTORE_META_ENCODING:-}}"
+
+  if [[ "${encrypted}" =~ ^([Tt][Rr][Uu][Ee])$ && "${encoding}" == "compress-encrypt" ]]; then
+    decrypt_stream | decompress_stream "${codec}"
+  elif [[ "${encrypted}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    decompress_stream "${codec}" | decrypt_stream
+  else
+    decompress_stream "${codec}"
+  fi
+}
+
+############################################
+# Turn a stored directory archive back into a plain tar stream
+# Usage: decode_directory_stream <codec> <encrypted>
+############################################
+decode_directory_stream() {
+  local codec="$1"
+  local encrypted="${2:-false}"
+
+  if [[ "${encrypted}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    decrypt_stream | decompress_stream "${codec}"
+  else
+    decompress_stream "${codec}"
+  fi
+}
+
+############################################
+# Restore a custom archive read from stdin
+# Usage: restore_dump_stream <db> <codec> <encrypted> <spool_dir> [archive]
+# pg_restore reads the decoded stream directly. When the restore runs in
+# parallel, or has table slices to load between its sections, the
+# decoded dump is spooled once into <spool_dir> instead.
+# <archive> is the file stdin reads, if any, which sizes the restore.
+############################################
+restore_dump_stream() {
+  local db="$1"
+  local codec="$2"
+  local encrypted="$3"
+  local spool_dir="$4"
+  local archive="${5:-}"
+  local rc=0
+
+  if restore_has_slices || restore_wants_parallel ${archive:+"${archive}" "${codec}" "${encrypted}"}; then
+    local spool
+    spool="$(mktemp "${spool_dir}/restore.XXXXXX.dmp")"
+    db_log "Spooling decoded dump to ${spool} for parallel restore"
+    decode_dump_stream "${codec}" "${encrypted}" > "${spool}" || rc=$?
+    (( rc == 0 )) && { restore_dump "${spool}" "${db}" || rc=$?; }
+    rm -f "${spool}"
+    return "${rc}"
+  fi
+
+  validate_postgres_pass
+  db_log "Streaming dump into ${db} (compression=${codec}, encrypted=${encrypted})"
+  decode_dump_stream "${codec}" "${encrypted}" \
+    | PGOPTIONS="$(restore_pgoptions)" pg_restore ${PG_CONN_PARAMETERS} -d "${db}" ${RESTORE_ARGS} || rc=$?
+  unset_postgres_pass
+  return "${rc}"
+}
+
 ############################################
 # Restore dump (encrypted or not)
+# With table slices the schema and data are restored first, then the
+# slices are loaded and the post-data section (indexes, constraints,
+# triggers) is restored last.
 ############################################
 restore_dump() {
   local archive="$1"
   local db="$2"
   local db_encryption="${3:-false}"
 
-  validate_postgres_pass
   FORMAT="$(get_dump_format "${DUMP_ARGS}")"
-  if [[ "${FORMAT}" == "directory" ]]; then
-    db_log "Restoring directory dump into ${db}"
-    pg_restore ${PG_CONN_PARAMETERS} "${archive}" -d "${db}" ${RESTORE_ARGS}
+  if [[ "${FORMAT}" != "directory" && "${db_encryption}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    db_log "Restoring encrypted dump into ${db}"
+    restore_dump_stream "${db}" none true "$(dirname "${archive}")" "${archive}" < "${archive}"
+    return
+  fi
 
-  else
+  local jobs_arg rc=0
+  jobs_arg="$(restore_jobs_arg "${archive}")"
 
-    if [[ "${db_encryption}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
-      db_log "Restoring encrypted dump into ${db}"
-      validate_dump_encryption_pass
-      local tmp_dump
-      tmp_dump="$(mktemp /tmp/decrypted.XXXXXX.dmp)"
-      openssl enc -d -aes-256-cbc \
-        -pass pass:"${DB_DUMP_ENCRYPTION_PASS_PHRASE}" \
-        -pbkdf2 -iter 10000 -md sha256 \
-        -in "${archive}" \
-        -out "${tmp_dump}"
-
-      pg_restore ${PG_CONN_PARAMETERS} "${tmp_dump}" -d "${db}" ${RESTORE_ARGS}
-      rm -f "${tmp_dump}"
-      unset_dump_encryption_pass
-    else
-      db_log "Restoring dump into ${db}"
-      pg_restore ${PG_CONN_PARAMETERS} "${archive}" -d "${db}" ${RESTORE_ARGS}
-    fi
+  validate_postgres_pass
+  if [[ "${FORMAT}" == "directory" ]]; then
+    db_log "Restoring directory dump into ${db}${jobs_arg:+ (${jobs_arg})}"
+  else
+    db_log "Restoring dump into ${db}${jobs_arg:+ (${jobs_arg})}"
+  fi
+  if restore_has_slices; then
+    PGOPTIONS="$(restore_pgoptions)" \
+      pg_restore ${PG_CONN_PARAMETERS} "${archive}" -d "${db}" ${RESTORE_ARGS} ${jobs_arg} \
+        --section=pre-data --section=data || return 1
+    restore_table_slices "${db}" "$(dirname "${archive}")" || return 1
+    db_log "Restoring post-data section into ${db}"
+    PGOPTIONS="$(restore_pgoptions)" \
+      pg_restore ${PG_CONN_PARAMETERS} "${archive}" -d "${db}" ${RESTORE_ARGS} ${jobs_arg} \
+        --section=post-data || rc=$?
+  else
+    PGOPTIONS="$(restore_pgoptions)" \
+      pg_restore ${PG_CONN_PARAMETERS} "${archive}" -d "${db}" ${RESTORE_ARGS} ${jobs_arg} || rc=$?
   fi
   unset_postgres_pass
-}
\ No newline at end of file
+  # The status callers act on, also when they run under || (no errexit)
+  return "${rc}"
+}
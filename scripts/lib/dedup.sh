@@ -0,0 +1,159 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+dedup_log() {
+  log "[Dedup] $*"
+}
+
+dedup_enabled() {
+  [[ "${BACKUP_DEDUPLICATION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+############################################
+# Deduplicated chunk repository
+# Custom-format dumps are cut into content-defined chunks that are
+# stored once under ${MYBASEDIR}/chunks (FILE) or s3://${BUCKET}/chunks
+# (S3). Each backup is a small <name>.dmp.chunks manifest listing its
+# chunks, which takes the place of the .dmp archive in the catalog,
+# sidecars and retention (see tools/chunk_store.py).
+############################################
+chunk_repository() {
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    echo "s3://${BUCKET}/chunks"
+  else
+    echo "${MYBASEDIR}/chunks"
+  fi
+}
+
+# Where the manifests live, for garbage collection
+chunk_manifest_root() {
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    echo "s3://${BUCKET}"
+  else
+    echo "${MYBASEDIR}"
+  fi
+}
+
+############################################
+# Run the chunk store tool
+# Usage: chunk_store <init|store|restore|gc> [args...]
+# Chunks are only encrypted when DB_DUMP_ENCRYPTION is on; restores get
+# the passphrase whenever it is set, the manifest says what is needed.
+############################################
+chunk_store() {
+  local passphrase="${DB_DUMP_ENCRYPTION_PASS_PHRASE:-}"
+
+  if [[ "$1" =~ ^(init|store)$ && ! "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    passphrase=""
+  fi
+
+  DB_DUMP_ENCRYPTION_PASS_PHRASE="${passphrase}" \
+    python3 "${LIB_DIR}/tools/chunk_store.py" "$@"
+}
+
+############################################
+# Prepare the repository before the dumps
+# Creates the key salt once, so concurrent jobs share it.
+############################################
+dedup_init() {
+  dedup_enabled || return 0
+
+  [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && require_encryption_key
+  if ! chunk_store init "$(chunk_repository)"; then
+    dedup_log "ERROR: Unable to initialise chunk repository $(chunk_repository)"
+    return 1
+  fi
+  dedup_log "Deduplicating custom-format dumps into $(chunk_repository)"
+}
+
+############################################
+# pg_dump args for a deduplicated dump
+# Usage: dedup_dump_args <dump_args>
+# pg_dump compression would change the bytes of a whole table when one
+# row changes, so it is switched off (unless DUMP_ARGS sets it) and the
+# chunks are compressed one by one instead.
+############################################
+dedup_dump_args() {
+  local dump_args="$1"
+
+  if [[ "${DUMP_ARGS}" =~ (^|[[:space:]])(-Z|--compress) ]]; then
+    echo "${dump_args}"
+  else
+    echo "${dump_args} -Z0"
+  fi
+}
+
+############################################
+# Dump a database into the chunk repository
+# Usage: dump_to_chunk_store <db> <manifest> <dump_args>
+# Only chunks the repository does not hold yet are written. The
+# manifest is written locally and then stored like any archive.
+############################################
+dump_to_chunk_store() {
+  local DB="$1"
+  local manifest="$2"
+  local dump_args="$3"
+  local rc=0
+
+  db_log "Dumping database ${DB} into chunk repository $(chunk_repository)"
+
+  set -o pipefail
+  # Stages overlap, so the whole pipeline is timed as one stream phase
+  metrics_begin
+  pg_dump ${PG_CONN_PARAMETERS} $(dedup_dump_args "${dump_args}") -d "${DB}" \
+    | throttle_stream \
+    | metrics_meter \
+    | chunk_store store "$(chunk_repository)" "${manifest}" || rc=$?
+  metrics_end "${DB}" stream metered "${manifest}" "${rc}"
+
+  if (( rc != 0 )); then
+    db_log "ERROR: Deduplicated backup of ${DB} failed"
+    rm -f "${manifest}"
+  fi
+  return "${rc}"
+}
+
+############################################
+# Reassemble a deduplicated dump (→ stdout)
+# Usage: chunk_restore_stream <manifest>
+# Chunks are fetched and verified in parallel and written in order.
+############################################
+chunk_restore_stream() {
+  chunk_store restore "$(chunk_repository)" "$1"
+}
+
+############################################
+# Delete chunks no manifest references any more
+# Runs after expiry and consolidation have removed manifests. Reference
+# counts are taken from the manifests left in the bucket or MYBASEDIR;
+# if one of them cannot be read, nothing is deleted.
+############################################
+chunk_gc() {
+  local output count bytes kept
+  local args=()
+
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    dedup_enabled || grep -q '\.chunks"' "$(catalog_file)" 2>/dev/null || return 0
+  else
+    [[ -d "$(chunk_repository)" ]] || return 0
+  fi
+
+  [[ "${CLEANUP_DRY_RUN:-false}" == "true" ]] && args+=(--dry-run)
+
+  retention_log "Collecting unreferenced chunks in $(chunk_repository)"
+  if ! output="$(chunk_store gc "$(chunk_repository)" "$(chunk_manifest_root)" "${args[@]}")"; then
+    retention_log "ERROR: Chunk garbage collection failed"
+    return 0
+  fi
+
+  read -r count bytes kept <<< "${output}"
+  RETENTION_DELETED_COUNT=$(( RETENTION_DELETED_COUNT + count ))
+  RETENTION_FREED_BYTES=$(( RETENTION_FREED_BYTES + bytes ))
+
+  local verb="Deleted"
+  [[ "${CLEANUP_DRY_RUN:-false}" == "true" ]] && verb="[DRY-RUN] Would delete"
+  retention_log "${verb} ${count} unreferenced chunks, ${bytes} bytes (${kept} chunks still referenced)"
+}
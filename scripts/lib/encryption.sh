@@ -12,20 +12,44 @@ require_encryption_key() {
   fi
 }
 
+############################################
+# Cipher for new dumps
+# aes-256-gcm (default) is chunked, authenticated and multi-threaded,
+# aes-256-cbc is the legacy single-threaded openssl format.
+############################################
+encryption_cipher() {
+  case "${ENCRYPTION_CIPHER:-aes-256-gcm}" in
+    aes-256-cbc|AES-256-CBC|cbc|CBC) echo "aes-256-cbc" ;;
+    *) echo "aes-256-gcm" ;;
+  esac
+}
+
+chunk_crypt() {
+  DB_DUMP_ENCRYPTION_PASS_PHRASE="${DB_DUMP_ENCRYPTION_PASS_PHRASE}" \
+    python3 "${LIB_DIR}/tools/chunk_crypt.py" "$1" "${ENCRYPTION_THREADS:-0}"
+}
+
 encrypt_stream() {
   require_encryption_key
 
-  openssl enc -aes-256-cbc \
-    -pbkdf2 -iter 10000 -md sha256 \
-    -pass "pass:${DB_DUMP_ENCRYPTION_PASS_PHRASE}"
+  if [[ "$(encryption_cipher)" == "aes-256-cbc" ]]; then
+    openssl enc -aes-256-cbc \
+      -pbkdf2 -iter 10000 -md sha256 \
+      -pass "pass:${DB_DUMP_ENCRYPTION_PASS_PHRASE}"
+  else
+    chunk_crypt encrypt
+  fi
 }
 
+############################################
+# Decrypt either format (stdin → stdout)
+# The format is read from the stream header, so CBC archives made
+# before the switch restore the same way.
+############################################
 decrypt_stream() {
   require_encryption_key
 
-  openssl enc -d -aes-256-cbc \
-    -pbkdf2 -iter 10000 -md sha256 \
-    -pass "pass:${DB_DUMP_ENCRYPTION_PASS_PHRASE}"
+  chunk_crypt decrypt
 }
 
 encrypt_dump() {
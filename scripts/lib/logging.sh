@@ -50,11 +50,20 @@ log() {
 on_error() {
   local line="$1"
   log "ERROR at line ${line}"
+  metrics_finish "failure" || true
   notify_monitoring "failure"
   exit 2
 }
 
 on_terminate() {
   log "Termination signal received"
+  # Stop any background backup jobs still running
+  local pids
+  pids="$(jobs -pr)"
+  if [[ -n "${pids}" ]]; then
+    kill ${pids} 2>/dev/null || true
+    # Let them run their own cleanup before exiting
+    wait ${pids} 2>/dev/null || true
+  fi
   exit 143
 }
\ No newline at end of file
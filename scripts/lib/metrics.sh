@@ -0,0 +1,258 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+metrics_log() {
+  log "[METRICS] $*"
+}
+
+metrics_enabled() {
+  [[ "${METRICS_ENABLED:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+# Enabled and initialised for this run
+metrics_active() {
+  metrics_enabled && [[ -n "${METRICS_RUN_FILE:-}" ]]
+}
+
+metrics_now() {
+  printf '%s\n' "${EPOCHREALTIME/,/.}"
+}
+
+############################################
+# Start collecting metrics for a run
+# Usage: metrics_init <backup|restore>
+# Phase records are appended to METRICS_RUN_FILE as JSON lines, which
+# concurrent backup jobs share. metrics_finish turns them into the
+# Prometheus textfile and the JSON run report.
+############################################
+metrics_init() {
+  metrics_enabled || return 0
+
+  export METRICS_JOB="$1"
+  export METRICS_RUN_DATE="$(date +%d-%B-%Y-%H-%M)"
+  export METRICS_RUN_STARTED="$(metrics_now)"
+  export METRICS_RUN_FILE="$(mktemp /tmp/metrics-run.XXXXXX)"
+  ARTIFACT_METRICS=""
+}
+
+############################################
+# Forget the phases recorded for the previous artifact
+############################################
+metrics_reset_artifact() {
+  ARTIFACT_METRICS=""
+}
+
+############################################
+# Phase timing
+# Usage: metrics_begin
+#        <phase commands>
+#        metrics_end <db> <phase> <bytes_in> <bytes_out> [status|exit_code]
+# Byte counts are a number, a path (file or directory size), "transfer"
+# for the bytes s3_transfer moved during the phase, or "metered" for the
+# bytes that went through metrics_meter. Retries made by retry and by
+# s3_transfer during the phase are counted. Phases do not nest.
+############################################
+metrics_begin() {
+  metrics_active || return 0
+
+  METRICS_PHASE_STARTED="$(metrics_now)"
+  METRICS_RETRIES=0
+  export S3_TRANSFER_STATS="$(mktemp /tmp/metrics-transfer.XXXXXX)"
+  export METRICS_METER="$(mktemp /tmp/metrics-meter.XXXXXX)"
+}
+
+metrics_end() {
+  metrics_active && [[ -n "${METRICS_PHASE_STARTED:-}" ]] || return 0
+
+  local db="$1"
+  local phase="$2"
+  local status="${5:-success}"
+  local transfer_bytes transfer_retries metered bytes_in bytes_out record
+
+  read -r transfer_bytes transfer_retries < <(
+    awk '{ b += $1; r += $2 } END { print b + 0, r + 0 }' "${S3_TRANSFER_STATS}"
+  )
+  metered="$(awk '/ bytes/ { print $1; exit }' "${METRICS_METER}")"
+  rm -f "${S3_TRANSFER_STATS}" "${METRICS_METER}"
+  unset S3_TRANSFER_STATS METRICS_METER
+  local started="${METRICS_PHASE_STARTED}"
+  unset METRICS_PHASE_STARTED
+
+  bytes_in="$(metrics_bytes "${3:-0}" "${transfer_bytes}" "${metered:-0}")"
+  bytes_out="$(metrics_bytes "${4:-0}" "${transfer_bytes}" "${metered:-0}")"
+  METRICS_LAST_BYTES_OUT="${bytes_out}"
+
+  case "${status}" in
+    0|success) status="success" ;;
+    *) status="failure" ;;
+  esac
+
+  record="$(jq -nc \
+    --arg job "${METRICS_JOB}" \
+    --arg database "${db}" \
+    --arg phase "${phase}" \
+    --arg status "${status}" \
+    --argjson started "${started}" \
+    --argjson ended "$(metrics_now)" \
+    --argjson bytes_in "${bytes_in}" \
+    --argjson bytes_out "${bytes_out}" \
+    --argjson retries "$(( ${METRICS_RETRIES:-0} + transfer_retries ))" \
+    '{
+      job: $job, database: $database, phase: $phase, status: $status,
+      seconds: (($ended - $started) * 1000 | round / 1000),
+      bytes_in: $bytes_in, bytes_out: $bytes_out, retries: $retries
+    }
+    | .throughput_bytes_per_second =
+        (if .seconds > 0 then ([.bytes_in, .bytes_out] | max) / .seconds | floor else 0 end)
+    | if ($phase | IN("compress", "archive", "stream")) and $job == "backup"
+         and .bytes_in > 0 and .bytes_out > 0
+      then .compression_ratio = (.bytes_in / .bytes_out * 1000 | round / 1000)
+      else . end')"
+
+  printf '%s\n' "${record}" >> "${METRICS_RUN_FILE}"
+  ARTIFACT_METRICS+="${record}"$'\n'
+
+  metrics_log "$(jq -r '"\(.database // "" | if . == "" then "run" else . end) \(.phase): \(.seconds)s, \(.bytes_in) bytes in, \(.bytes_out) bytes out, \(.throughput_bytes_per_second) B/s, \(.retries) retries (\(.status))"' <<< "${record}")"
+}
+
+############################################
+# Resolve a metrics_end byte count
+# Usage: metrics_bytes <spec> <transfer_bytes> <metered_bytes>
+############################################
+metrics_bytes() {
+  local spec="$1"
+
+  if [[ "${spec}" =~ ^[0-9]+$ ]]; then
+    echo "${spec}"
+  elif [[ "${spec}" == "transfer" ]]; then
+    echo "$2"
+  elif [[ "${spec}" == "metered" ]]; then
+    echo "$3"
+  elif [[ -d "${spec}" ]]; then
+    du -sb "${spec}" | cut -f1
+  elif [[ -f "${spec}" ]]; then
+    stat -c %s "${spec}"
+  else
+    echo 0
+  fi
+}
+
+############################################
+# Count the bytes of a stream (pipeline stage)
+# Usage: <producer> | metrics_meter | <consumer>
+############################################
+metrics_meter() {
+  if metrics_active && [[ -n "${METRICS_METER:-}" ]]; then
+    LC_ALL=C dd bs=1M 2> "${METRICS_METER}"
+  else
+    cat
+  fi
+}
+
+############################################
+# Phases of the current artifact as a .meta.json field
+# Prints nothing when no phase was recorded.
+############################################
+metrics_meta_field() {
+  [[ -n "${ARTIFACT_METRICS:-}" ]] || return 0
+
+  printf ',"metrics": %s' "$(jq -sc '
+    {phases: (map({(.phase): {seconds, bytes_in, bytes_out, throughput_bytes_per_second, retries}}) | add)}
+    + (map(select(.compression_ratio) | {compression_ratio}) | add // {})' <<< "${ARTIFACT_METRICS}")"
+}
+
+############################################
+# Write the run report and Prometheus textfile
+# Usage: metrics_finish <success|failure>
+# METRICS_DIR receives <job>.<date>.json for every run and
+# pg_backup_<job>.prom, replaced atomically, for the node_exporter
+# textfile collector.
+############################################
+metrics_finish() {
+  metrics_active || return 0
+
+  local status="$1"
+  local ended report prom
+  ended="$(metrics_now)"
+  report="${METRICS_DIR}/${METRICS_JOB}.${METRICS_RUN_DATE}.json"
+  prom="${METRICS_DIR}/pg_backup_${METRICS_JOB}.prom"
+
+  create_non_existing_directory "${METRICS_DIR}"
+
+  jq -s \
+    --arg job "${METRICS_JOB}" \
+    --arg status "${status}" \
+    --argjson started "${METRICS_RUN_STARTED}" \
+    --argjson ended "${ended}" \
+    '{
+      job: $job,
+      status: $status,
+      started: ($started | floor | todate),
+      finished: ($ended | floor | todate),
+      seconds: (($ended - $started) * 1000 | round / 1000),
+      retries: (map(.retries) | add // 0),
+      databases: (
+        map(select(.database != "")) | group_by(.database)
+        | map({
+            database: .[0].database,
+            seconds: (map(.seconds) | add * 1000 | round / 1000),
+            retries: (map(.retries) | add),
+            phases: map(del(.job, .database))
+          })
+      ),
+      phases: map(select(.database == "") | del(.job, .database))
+    }' "${METRICS_RUN_FILE}" > "${report}"
+
+  jq -rs \
+    --arg job "${METRICS_JOB}" \
+    --arg status "${status}" \
+    --argjson started "${METRICS_RUN_STARTED}" \
+    --argjson ended "${ended}" \
+    -f /dev/stdin "${METRICS_RUN_FILE}" > "${prom}.tmp" <<'JQ'
+def esc: tostring | gsub("\\\\"; "\\\\") | gsub("\""; "\\\"") | gsub("\n"; "\\n");
+def labels: "job=\"\($job)\",database=\"\(.database | esc)\",phase=\"\(.phase | esc)\"";
+def family($name; $help; $field):
+  "# HELP \($name) \($help)",
+  "# TYPE \($name) gauge",
+  (.[] | select(.[$field] != null) | "\($name){\(labels)} \(.[$field])");
+
+# One sample per database and phase, even if a phase ran twice
+(group_by([.database, .phase]) | map(
+  .[0] + {
+    seconds: (map(.seconds) | add),
+    bytes_in: (map(.bytes_in) | add),
+    bytes_out: (map(.bytes_out) | add),
+    retries: (map(.retries) | add),
+    success: (if all(.status == "success") then 1 else 0 end)
+  }
+  | .throughput_bytes_per_second =
+      (if .seconds > 0 then ([.bytes_in, .bytes_out] | max) / .seconds | floor else 0 end)
+)) as $phases
+| $phases
+| family("pg_backup_phase_duration_seconds"; "Wall time of a backup or restore phase."; "seconds"),
+  family("pg_backup_phase_input_bytes"; "Bytes read by a phase."; "bytes_in"),
+  family("pg_backup_phase_output_bytes"; "Bytes written by a phase."; "bytes_out"),
+  family("pg_backup_phase_throughput_bytes_per_second"; "Throughput of a phase."; "throughput_bytes_per_second"),
+  family("pg_backup_phase_retries"; "Retried operations during a phase."; "retries"),
+  family("pg_backup_phase_success"; "Whether a phase succeeded (1) or failed (0)."; "success"),
+  family("pg_backup_compression_ratio"; "Uncompressed over stored bytes."; "compression_ratio"),
+  "# HELP pg_backup_run_duration_seconds Wall time of the last run.",
+  "# TYPE pg_backup_run_duration_seconds gauge",
+  "pg_backup_run_duration_seconds{job=\"\($job)\"} \(($ended - $started) * 1000 | round / 1000)",
+  "# HELP pg_backup_run_success Whether the last run succeeded (1) or failed (0).",
+  "# TYPE pg_backup_run_success gauge",
+  "pg_backup_run_success{job=\"\($job)\"} \(if $status == "success" then 1 else 0 end)",
+  "# HELP pg_backup_run_timestamp_seconds Time the last run finished.",
+  "# TYPE pg_backup_run_timestamp_seconds gauge",
+  "pg_backup_run_timestamp_seconds{job=\"\($job)\"} \($ended | floor)"
+JQ
+  mv "${prom}.tmp" "${prom}"
+
+  rm -f "${METRICS_RUN_FILE}"
+  unset METRICS_RUN_FILE
+
+  metrics_log "Wrote ${report} and ${prom}"
+}
@@ -0,0 +1,400 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+physical_log() {
+  log "[Physical] $*"
+}
+
+physical_mode_enabled() {
+  [[ "${BACKUP_MODE:-logical}" =~ ^([Pp][Hh][Yy][Ss][Ii][Cc][Aa][Ll])$ ]]
+}
+
+wal_archiving_enabled() {
+  physical_mode_enabled && [[ "${WAL_ARCHIVING:-true}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+############################################
+# WAL archive layout
+# Segments and timeline history files are stored one per object under
+# ${MYBASEDIR}/wal (FILE) or s3://${BUCKET}/wal (S3), compressed with
+# COMPRESSION and encrypted like directory archives. wal/wal.jsonl
+# indexes them, one JSON record per file:
+#   {"segment", "key", "archived", "compression", "encrypted", "size",
+#    "checksum"}
+# "key" is the S3 key (S3) or the path relative to MYBASEDIR (FILE).
+############################################
+wal_dir() {
+  echo "${MYBASEDIR}/wal"
+}
+
+wal_index_file() {
+  echo "$(wal_dir)/wal.jsonl"
+}
+
+# pg_receivewal writes here; completed files are shipped and removed
+wal_spool_dir() {
+  echo "${WAL_SPOOL_DIR:-${MYBASEDIR}/.wal-spool}"
+}
+
+# The archiver and retention both rewrite the index
+wal_lock_file() {
+  echo "/tmp/wal.lock"
+}
+
+############################################
+# Physical base backup
+# pg_basebackup writes the cluster as tar files (base.tar, pg_wal.tar
+# and one per tablespace) together with the WAL needed to make it
+# consistent, so every base backup restores on its own. The directory
+# is then stored like a directory dump: compressed, encrypted,
+# checksummed, uploaded and recorded in the catalog as
+# PG_cluster.<date>.base.tar[.gz|.zst].
+############################################
+backup_base() {
+  local status="success"
+  local codec base_dir tar_file wal_start="" backup_end tablespaces="{}"
+
+  create_non_existing_directory "${MYBACKUPDIR}"
+  metrics_reset_artifact
+
+  if [[ -z "${ARCHIVE_FILENAME:-}" ]]; then
+    BASE_FILENAME="${MYBACKUPDIR}/${DUMPPREFIX}_cluster.${MYDATE}"
+  else
+    BASE_FILENAME="${MYBASEDIR}/${ARCHIVE_FILENAME}.cluster"
+  fi
+
+  codec="$(resolve_compression physical)"
+  base_dir="${BASE_FILENAME}.base"
+  tar_file="${base_dir}.tar$(compression_extension "${codec}")"
+
+  physical_log "Starting base backup at $(date +%d-%B-%Y-%H-%M)"
+  rm -rf "${base_dir}"
+
+  validate_postgres_pass
+  metrics_begin
+  pg_basebackup ${PG_CONN_PARAMETERS} -D "${base_dir}" -Ft -X stream $(throttle_basebackup_args) \
+    --checkpoint=fast --label="$(basename "${BASE_FILENAME}")" || status="failure"
+  metrics_end cluster dump 0 "${base_dir}" "${status}"
+  unset_postgres_pass
+  backup_end="$(date +%Y-%m-%dT%H:%M:%S)"
+
+  # Read before the tar files leave the directory
+  if [[ "${status}" == "success" ]]; then
+    wal_start="$(tar -xOf "${base_dir}/base.tar" backup_label \
+      | sed -n 's/^START WAL LOCATION: .* (file \([0-9A-F]*\))$/\1/p')" || status="failure"
+    tablespaces="$({ tar -xOf "${base_dir}/base.tar" tablespace_map 2>/dev/null || true; } \
+      | jq -R -s -c '[split("\n")[] | capture("^(?<oid>[0-9]+) (?<path>.+)$") | {(.oid): .path}] | add // {}')"
+    physical_log "Base backup starts at WAL segment ${wal_start}"
+  fi
+
+  if [[ "${status}" == "success" ]]; then
+    write_directory_archive cluster "${base_dir}" "${tar_file}" "${codec}" || status="failure"
+  fi
+  rm -rf "${base_dir}"
+
+  if [[ "${status}" == "success" ]]; then
+    setup_metadata "${tar_file}" "${codec}"
+    jq --arg wal_start "${wal_start}" \
+       --arg backup_end "${backup_end}" \
+       --argjson tablespaces "${tablespaces}" \
+       '. + {backup_mode: "physical", wal_start: $wal_start, backup_end: $backup_end, tablespaces: $tablespaces}' \
+       "${tar_file}.meta.json" > "${tar_file}.meta.json.tmp"
+    mv -f "${tar_file}.meta.json.tmp" "${tar_file}.meta.json"
+    catalog_stage cluster "${tar_file}"
+    store_directory_archive cluster "${tar_file}" || status="failure"
+  fi
+
+  if [[ "${status}" == "success" && "${STORAGE_BACKEND}" == "S3" \
+        && "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
+    cleanup_file "${tar_file}"
+    cleanup_file "${tar_file}.meta.json"
+  fi
+
+  catalog_commit cluster "${status}"
+
+  if [[ "${status}" != "success" ]]; then
+    physical_log "ERROR: Base backup failed at $(date +%d-%B-%Y-%H-%M)"
+    notify_monitoring "failure" || true
+    exit 1
+  fi
+
+  physical_log "Base backup ${tar_file} completed at $(date +%d-%B-%Y-%H-%M)"
+  notify_monitoring "success" || true
+}
+
+############################################
+# Make sure a local WAL index is available
+# Order: local copy → bucket copy → listing of the WAL archive
+############################################
+wal_index_load() {
+  local index
+  index="$(wal_index_file)"
+
+  [[ -f "${index}" ]] && return 0
+  create_non_existing_directory "$(wal_dir)"
+
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    if s3cmd get "s3://${BUCKET}/$(catalog_key "${index}")" "${index}" >/dev/null 2>&1; then
+      physical_log "Loaded WAL index from s3://${BUCKET}/$(catalog_key "${index}")" >&2
+      return 0
+    fi
+    rm -f "${index}"
+  fi
+
+  wal_index_rebuild "${index}"
+}
+
+############################################
+# Rebuild a WAL index from a listing of the WAL archive
+# Usage: wal_index_rebuild <output>
+# The archive time is the object's modification time. Encryption and
+# checksums are not in a listing, so they are left null; restores then
+# follow DB_DUMP_ENCRYPTION.
+############################################
+wal_index_rebuild() {
+  local output="$1"
+
+  physical_log "Rebuilding WAL index from a listing of the WAL archive" >&2
+
+  {
+    if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+      s3cmd ls "s3://${BUCKET}/wal/" 2>/dev/null \
+        | sed -n "s#^\([0-9-]*\) \([0-9:]*\) *\([0-9]*\) *s3://${BUCKET}/\(.*\)#\3 \1T\2:00 \4#p" || true
+    elif [[ -d "$(wal_dir)" ]]; then
+      find "$(wal_dir)" -maxdepth 1 -type f -printf '%s %TY-%Tm-%TdT%TT wal/%f\n'
+    fi
+  } | jq -R -c '
+      capture("^(?<size>[0-9]+) (?<archived>[^ ]+) (?<key>.*)$")
+      | (.key | split("/") | last) as $name
+      | ($name | capture("^(?<segment>[0-9A-F]{24}|[0-9A-F]{8}\\.history)(?<comp>\\.gz|\\.zst)?$")) as $m
+      | {
+          segment: $m.segment,
+          key: .key,
+          archived: .archived[0:19],
+          compression: ({".gz": "gzip", ".zst": "zstd"}[$m.comp // ""] // "none"),
+          encrypted: null,
+          size: (.size | tonumber),
+          checksum: null
+        }' > "${output}.tmp"
+
+  mv -f "${output}.tmp" "${output}"
+  physical_log "WAL index rebuilt with $(wc -l < "${output}") records" >&2
+}
+
+############################################
+# Upload the WAL index to the bucket (S3 backend)
+############################################
+wal_index_publish() {
+  local index
+  index="$(wal_index_file)"
+
+  [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ && -f "${index}" ]] || return 0
+
+  if ! (
+    flock 9
+    retry 3 s3cmd put "${index}" "s3://${BUCKET}/$(catalog_key "${index}")" >/dev/null 2>&1
+  ) 9> "$(wal_lock_file)"; then
+    physical_log "WARNING: Unable to publish WAL index to s3://${BUCKET}/$(catalog_key "${index}")"
+  fi
+}
+
+############################################
+# Store one completed WAL file
+# Usage: wal_ship_segment <spool_file>
+# Compressed, then encrypted, then checksummed, written to the WAL
+# archive and added to the index.
+############################################
+wal_ship_segment() {
+  local source="$1"
+  local name codec stored key size
+  local checksum="" encrypted="false" rc=0
+
+  name="$(basename "${source}")"
+  codec="$(resolve_compression physical)"
+  stored="$(wal_dir)/${name}$(compression_extension "${codec}")"
+  [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && encrypted="true"
+
+  mkdir -p "$(wal_dir)"
+  set -o pipefail
+  compress_stream "${codec}" < "${source}" | encode_directory_stream > "${stored}.tmp" || rc=$?
+  if (( rc != 0 )); then
+    physical_log "ERROR: Unable to encode WAL file ${name}"
+    rm -f "${stored}.tmp"
+    return "${rc}"
+  fi
+  mv -f "${stored}.tmp" "${stored}"
+
+  if [[ "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    checksum="$(sha256sum "${stored}" | cut -d' ' -f1)"
+  fi
+  size="$(stat -c %s "${stored}")"
+  key="$(catalog_key "${stored}")"
+
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    retry 3 s3_transfer upload "${stored}" "s3://${BUCKET}/${key}" >/dev/null || rc=$?
+    rm -f "${stored}"
+    if (( rc != 0 )); then
+      physical_log "ERROR: Unable to upload WAL file ${name}"
+      return "${rc}"
+    fi
+  fi
+
+  (
+    flock 9
+    jq -n -c \
+      --arg segment "${name}" \
+      --arg key "${key}" \
+      --arg archived "$(date +%Y-%m-%dT%H:%M:%S)" \
+      --arg compression "${codec}" \
+      --argjson encrypted "${encrypted}" \
+      --argjson size "${size}" \
+      --arg checksum "${checksum}" \
+      '{segment: $segment, key: $key, archived: $archived, compression: $compression,
+        encrypted: $encrypted, size: $size,
+        checksum: (if $checksum == "" then null else $checksum end)}' >> "$(wal_index_file)"
+  ) 9> "$(wal_lock_file)"
+}
+
+############################################
+# Ship every completed file in the spool
+# pg_receivewal names a segment it is still writing *.partial, so only
+# complete segments and history files are picked up. A file leaves the
+# spool once it is in the archive.
+############################################
+wal_ship_ready() {
+  local spool file last=""
+  local shipped=0 rc=0
+
+  spool="$(wal_spool_dir)"
+
+  while read -r file; do
+    wal_ship_segment "${spool}/${file}" || { rc=1; break; }
+    rm -f "${spool}/${file}"
+    last="${file}"
+    shipped=$(( shipped + 1 ))
+  done < <(find "${spool}" -maxdepth 1 -type f -regextype posix-extended \
+             -regex '.*/([0-9A-F]{24}|[0-9A-F]{8}\.history)' -printf '%f\n' | sort)
+
+  (( shipped > 0 )) || return "${rc}"
+
+  wal_index_publish
+  physical_log "Archived ${shipped} WAL files, up to ${last}"
+  return "${rc}"
+}
+
+############################################
+# Streaming WAL receiver
+# pg_receivewal streams WAL through the WAL_SLOT_NAME replication slot,
+# so the server keeps any WAL the archiver has not received yet, even
+# while the archiver is down.
+############################################
+wal_create_slot() {
+  validate_postgres_pass
+  if ! pg_receivewal ${PG_CONN_PARAMETERS} --slot="${WAL_SLOT_NAME:-pg_backup}" --create-slot --if-not-exists; then
+    physical_log "ERROR: Unable to create replication slot ${WAL_SLOT_NAME:-pg_backup}"
+    return 1
+  fi
+  physical_log "Using replication slot ${WAL_SLOT_NAME:-pg_backup}"
+}
+
+wal_receiver_start() {
+  validate_postgres_pass
+  physical_log "Starting pg_receivewal into $(wal_spool_dir)"
+  pg_receivewal ${PG_CONN_PARAMETERS} -D "$(wal_spool_dir)" \
+    --slot="${WAL_SLOT_NAME:-pg_backup}" --no-loop &
+  WAL_RECEIVER_PID=$!
+}
+
+############################################
+# Main loop of the WAL archiver
+# Usage: wal_archiver_loop
+# Restarts pg_receivewal when it exits and ships completed files every
+# WAL_ARCHIVE_INTERVAL seconds.
+############################################
+wal_archiver_loop() {
+  local rc
+
+  create_non_existing_directory "$(wal_spool_dir)"
+  wal_index_load
+  wal_create_slot || return 1
+
+  WAL_RECEIVER_PID=""
+  while true; do
+    if [[ -z "${WAL_RECEIVER_PID}" ]] || ! kill -0 "${WAL_RECEIVER_PID}" 2>/dev/null; then
+      if [[ -n "${WAL_RECEIVER_PID}" ]]; then
+        rc=0
+        wait "${WAL_RECEIVER_PID}" || rc=$?
+        physical_log "WARNING: pg_receivewal exited with code ${rc}, restarting it"
+      fi
+      wal_receiver_start
+    fi
+
+    wal_ship_ready || physical_log "WARNING: WAL shipping failed, retrying in ${WAL_ARCHIVE_INTERVAL:-10}s"
+
+    # Waiting on a background sleep lets SIGTERM interrupt it right away
+    sleep "${WAL_ARCHIVE_INTERVAL:-10}" &
+    wait $! || true
+  done
+}
+
+############################################
+# Remove WAL no base backup needs any more
+# Segments before the start of the oldest base backup in the catalog
+# can not be replayed from any backup that is kept. Timeline history
+# files are always kept. Segment names are compared without their
+# timeline, like pg_archivecleanup does.
+############################################
+wal_retention() {
+  local oldest selection index count
+
+  [[ -f "$(catalog_file)" ]] || return 0
+
+  # Records rebuilt from a listing do not know where their WAL starts
+  if jq -e -s 'any(.[]; .format == "physical" and .wal_start == null)' "$(catalog_file)" >/dev/null; then
+    retention_log "WARNING: A base backup in the catalog has no WAL start, keeping all WAL"
+    return 0
+  fi
+
+  oldest="$(jq -r -s 'map(select(.format == "physical" and .wal_start != null) | .wal_start) | min_by(.[8:]) // empty' "$(catalog_file)")"
+  [[ -n "${oldest}" ]] || return 0
+
+  wal_index_load
+  index="$(wal_index_file)"
+  selection="$(mktemp /tmp/retention-wal.XXXXXX)"
+  jq -r --arg oldest "${oldest:8}" \
+    'select((.segment | test("^[0-9A-F]{24}$")) and .segment[8:] < $oldest) | "\(.size // 0)\t\(.key)"' \
+    "${index}" > "${selection}"
+
+  count="$(wc -l < "${selection}")"
+  if (( count == 0 )); then
+    retention_log "No WAL segments older than ${oldest}, the start of the oldest base backup"
+    rm -f "${selection}"
+    return 0
+  fi
+
+  retention_log "Removing ${count} WAL segments older than ${oldest}, the start of the oldest base backup"
+
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    s3_delete_objects "${selection}" "wal"
+  else
+    local key
+    while IFS=$'\t' read -r _ key; do
+      delete_file "${MYBASEDIR}/${key}" "wal"
+    done < "${selection}"
+  fi
+
+  if [[ "${CLEANUP_DRY_RUN:-false}" != "true" ]]; then
+    (
+      flock 9
+      jq -c --rawfile gone <(cut -f2 "${selection}") \
+        '($gone | split("\n") | map(select(length > 0) | {(.): true}) | add // {}) as $g
+         | select($g[.key] | not)' "${index}" > "${index}.tmp"
+      mv -f "${index}.tmp" "${index}"
+    ) 9> "$(wal_lock_file)"
+    wal_index_publish
+  fi
+  rm -f "${selection}"
+}
@@ -0,0 +1,135 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+replica_log() {
+  log "[Replicas] $*"
+}
+
+replica_routing_enabled() {
+  [[ -n "${POSTGRES_REPLICAS:-}" ]]
+}
+
+############################################
+# Replica routing
+# POSTGRES_REPLICAS lists standbys as "host[:port]" (port defaults to
+# POSTGRES_PORT). Before each database is dumped, every standby is
+# checked: it must answer within REPLICA_CONNECT_TIMEOUT seconds, be in
+# recovery, stream from the primary, and replay within REPLICA_MAX_LAG
+# seconds of the primary's current WAL position.
+# Databases are spread round-robin over the standbys that pass, so
+# with BACKUP_CONCURRENCY several standbys are read at the same time.
+# When none passes, the dump reads from the primary (POSTGRES_HOST).
+#
+# Globals, the primary connection and catalog bookkeeping stay on the
+# primary. The host used is recorded as "source" in the .meta.json.
+# A dump that fails on a replica, for instance when a recovery conflict
+# cancels it, is taken again from the primary (REPLICA_FALLBACK).
+############################################
+
+# DUMP_SOURCE for a dump read from the primary
+replica_primary_source() {
+  jq -nc --arg host "${POSTGRES_HOST:-db}" --argjson port "${POSTGRES_PORT:-5432}" \
+    '{host: $host, port: $port, role: "primary", lag_seconds: null}'
+}
+
+############################################
+# Current WAL position of the primary
+# Standbys are measured against it, since a standby that lost its
+# connection has replayed all it received and looks caught up.
+############################################
+replica_primary_lsn() {
+  psql ${PG_CONN_PARAMETERS} -d postgres -At -v ON_ERROR_STOP=1 -c "SELECT pg_current_wal_lsn()"
+}
+
+############################################
+# Check one standby
+# Usage: replica_probe <host> <port> <primary_lsn>
+# Prints the replay lag in seconds: 0 once the standby has replayed up
+# to <primary_lsn>, otherwise the age of its last replayed transaction.
+# Prints "primary" when the host is not in recovery, "disconnected"
+# when it is not streaming from the primary, and "unknown" when it has
+# not replayed any transaction yet. Fails when the host cannot be
+# reached.
+############################################
+replica_probe() {
+  PGCONNECT_TIMEOUT="${REPLICA_CONNECT_TIMEOUT:-5}" \
+    psql ${PG_CONN_PARAMETERS} -h "$1" -p "$2" -d postgres -At -v ON_ERROR_STOP=1 \
+      -v primary_lsn="$3" <<'SQL'
+SELECT CASE
+  WHEN NOT pg_is_in_recovery() THEN 'primary'
+  WHEN COALESCE((SELECT status FROM pg_stat_wal_receiver), '') <> 'streaming' THEN 'disconnected'
+  WHEN pg_last_wal_replay_lsn() >= :'primary_lsn'::pg_lsn THEN '0'
+  ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::int::text, 'unknown')
+END;
+SQL
+}
+
+############################################
+# Pick the host a database is dumped from
+# Usage: route_database_dump <db>
+# Points PG_CONN_PARAMETERS at the chosen standby and sets DUMP_SOURCE
+# to its JSON description. Callers declare both local, so the routing
+# only lasts for the dump of <db>:
+#   local PG_CONN_PARAMETERS="${PG_CONN_PARAMETERS}" DUMP_SOURCE=""
+############################################
+route_database_dump() {
+  local db="$1"
+  local max_lag="${REPLICA_MAX_LAG:-60}"
+  local entry host port lag primary_lsn position=0 d
+  local eligible=()
+
+  if [[ "${REPLICA_FALLBACK:-false}" == "true" ]]; then
+    replica_log "Dumping ${db} from the primary ${POSTGRES_HOST:-db} after a failed replica dump"
+    DUMP_SOURCE="$(replica_primary_source)"
+    return 0
+  fi
+
+  if ! primary_lsn="$(replica_primary_lsn 2>/dev/null)" || [[ -z "${primary_lsn}" ]]; then
+    replica_log "WARNING: Unable to read the WAL position of the primary, replicas are not checked"
+    primary_lsn=""
+  fi
+
+  for entry in ${POSTGRES_REPLICAS}; do
+    [[ -n "${primary_lsn}" ]] || break
+
+    host="${entry%%:*}"
+    port="${POSTGRES_PORT:-5432}"
+    [[ "${entry}" == *:* ]] && port="${entry##*:}"
+
+    if ! lag="$(replica_probe "${host}" "${port}" "${primary_lsn}" 2>/dev/null)" || [[ -z "${lag}" ]]; then
+      replica_log "WARNING: Replica ${host}:${port} is unreachable, skipping it"
+    elif [[ "${lag}" == "primary" ]]; then
+      replica_log "WARNING: ${host}:${port} is not in recovery, skipping it"
+    elif [[ "${lag}" == "disconnected" ]]; then
+      replica_log "WARNING: Replica ${host}:${port} is not streaming from the primary, skipping it"
+    elif [[ ! "${lag}" =~ ^[0-9]+$ ]]; then
+      replica_log "WARNING: Replica ${host}:${port} has not replayed any transaction yet, skipping it"
+    elif (( lag > max_lag )); then
+      replica_log "WARNING: Replica ${host}:${port} lags ${lag}s (REPLICA_MAX_LAG=${max_lag}), skipping it"
+    else
+      eligible+=("${host} ${port} ${lag}")
+    fi
+  done
+
+  if (( ${#eligible[@]} == 0 )); then
+    replica_log "No eligible replica for ${db}, dumping from the primary ${POSTGRES_HOST:-db}"
+    DUMP_SOURCE="$(replica_primary_source)"
+    return 0
+  fi
+
+  # Position of the database in DBLIST, so databases take turns
+  for d in ${DBLIST:-}; do
+    [[ "${d}" == "${db}" ]] && break
+    position=$(( position + 1 ))
+  done
+
+  read -r host port lag <<< "${eligible[position % ${#eligible[@]}]}"
+  PG_CONN_PARAMETERS="${PG_CONN_PARAMETERS} -h ${host} -p ${port}"
+  DUMP_SOURCE="$(jq -nc --arg host "${host}" --argjson port "${port}" --argjson lag "${lag}" \
+    '{host: $host, port: $port, role: "replica", lag_seconds: $lag}')"
+
+  replica_log "Dumping ${db} from replica ${host}:${port} (lag ${lag}s)"
+}
@@ -0,0 +1,185 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+shopt -s inherit_errexit
+
+############################################
+# Helpers
+############################################
+restore_cachelog() {
+  log "[DB Restore Cache] $*"
+}
+
+restore_cache_enabled() {
+  [[ "${RESTORE_CACHE:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+# SHA-256 of an archive, from the checksum of its metadata
+restore_cache_key() {
+  jq -r '.checksum // empty | split(" ")[0]' "$1" 2>/dev/null
+}
+
+############################################
+# Local archive cache
+# S3 restores keep the archives they download in RESTORE_CACHE_DIR, one
+# directory per archive content, named after its SHA-256 (the checksum
+# recorded in the metadata and the catalog). Restoring the same content
+# again, under any name (change detection links unchanged dumps to new
+# names), uses the local copy instead of downloading it.
+#
+# Archives are verified against their checksum before they enter the
+# cache. When one is added, the least recently used entries are evicted
+# until the cache fits RESTORE_CACHE_MAX_MB. A restore holds a shared
+# lock on the entry it reads, and entries in use are never evicted.
+############################################
+
+############################################
+# Fetch an S3 archive through the cache
+# Usage: restore_cache_fetch <archive_key> <meta_path> <target_db>
+# Sets RESTORE_CACHE_ARCHIVE to the cached copy, with <meta_path> next
+# to it as its .meta.json, and keeps the entry until
+# restore_cache_release.
+# Returns 1 when the archive cannot be cached (no checksum), so the
+# caller downloads it as usual, and 2 when the download fails.
+############################################
+restore_cache_fetch() {
+  local archive_key="$1"
+  local meta_path="$2"
+  local target_db="$3"
+  local dir="${RESTORE_CACHE_DIR:-/data/restore-cache}"
+  local name key entry incoming rc=0
+
+  name="$(basename "${archive_key}")"
+  key="$(restore_cache_key "${meta_path}")"
+  if [[ ! "${key}" =~ ^[0-9a-f]{64}$ ]]; then
+    restore_cachelog "No checksum recorded for ${name}, downloading it without the cache"
+    return 1
+  fi
+
+  create_non_existing_directory "${dir}"
+  entry="${dir}/${key}"
+
+  if restore_cache_pin "${entry}" "${name}" "${meta_path}"; then
+    restore_cachelog "Cache hit for ${name} (${key:0:12})"
+    return 0
+  fi
+
+  restore_cachelog "Cache miss for ${name} (${key:0:12}), downloading"
+  incoming="$(mktemp -d "${dir}/.incoming.XXXXXX")" || return 2
+
+  metrics_begin
+  if [[ "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && has_hash_manifest "${meta_path}"; then
+    # Every part is verified as it lands
+    s3_transfer download "s3://${BUCKET}/${archive_key}" "${incoming}/${name}" "${meta_path}" || rc=$?
+  else
+    s3_transfer download "s3://${BUCKET}/${archive_key}" "${incoming}/${name}" || rc=$?
+    if (( rc == 0 )) && [[ "$(sha256sum "${incoming}/${name}" | cut -d ' ' -f 1)" != "${key}" ]]; then
+      restore_cachelog "ERROR: Checksum mismatch for ${name}"
+      rc=1
+    fi
+  fi
+  metrics_end "${target_db}" download transfer "${incoming}/${name}" "${rc}"
+
+  if (( rc != 0 )); then
+    rm -rf "${incoming}"
+    return 2
+  fi
+
+  # Another restore may have cached the same content meanwhile
+  : > "${incoming}/.lock"
+  (
+    flock 9
+    if [[ -d "${entry}" ]]; then
+      rm -rf "${incoming}"
+    else
+      mv "${incoming}" "${entry}"
+    fi
+  ) 9> "${dir}/.lock"
+
+  restore_cache_pin "${entry}" "${name}" "${meta_path}" || return 2
+  restore_cache_evict "${dir}" "${entry}"
+}
+
+############################################
+# Take a shared lock on a cache entry and expose it under <name>
+# Usage: restore_cache_pin <entry> <name> <meta_path>
+# Fails when the entry does not exist or was just evicted.
+############################################
+restore_cache_pin() {
+  local entry="$1"
+  local name="$2"
+  local meta_path="$3"
+  local existing
+
+  [[ -f "${entry}/.lock" ]] || return 1
+  exec {RESTORE_CACHE_FD}< "${entry}/.lock" || return 1
+  flock -s "${RESTORE_CACHE_FD}"
+
+  # Evicted between the check and the lock
+  if [[ ! -d "${entry}" ]]; then
+    restore_cache_release
+    return 1
+  fi
+
+  # Same content cached under another name
+  if [[ ! -f "${entry}/${name}" ]]; then
+    existing="$(find "${entry}" -maxdepth 1 -type f ! -name '.*' ! -name '*.meta.json' -print -quit)"
+    if [[ -z "${existing}" ]] || ! ln -f "${existing}" "${entry}/${name}"; then
+      restore_cache_release
+      return 1
+    fi
+  fi
+
+  cp "${meta_path}" "${entry}/${name}.meta.json.$$"
+  mv -f "${entry}/${name}.meta.json.$$" "${entry}/${name}.meta.json"
+
+  # Most recently used entries are evicted last
+  touch "${entry}"
+  RESTORE_CACHE_ARCHIVE="${entry}/${name}"
+}
+
+restore_cache_release() {
+  [[ -n "${RESTORE_CACHE_FD:-}" ]] || return 0
+  exec {RESTORE_CACHE_FD}<&-
+  unset RESTORE_CACHE_FD RESTORE_CACHE_ARCHIVE
+}
+
+############################################
+# Evict least recently used entries over RESTORE_CACHE_MAX_MB
+# Usage: restore_cache_evict <dir> <keep>
+# Downloads left behind by interrupted restores go after a day.
+############################################
+restore_cache_evict() {
+  local dir="$1"
+  local keep="$2"
+  local limit=$(( ${RESTORE_CACHE_MAX_MB:-10240} * 1024 * 1024 ))
+  local total size entry
+
+  (
+    flock 9
+
+    find "${dir}" -mindepth 1 -maxdepth 1 -type d -name '.incoming.*' -mmin +1440 \
+      -exec rm -rf {} + 2>/dev/null || true
+
+    total="$(du -sb "${dir}" | cut -f 1)"
+    while read -r _ entry; do
+      (( total > limit )) || break
+      [[ "${entry}" == "${keep}" ]] && continue
+
+      # Entries read by a running restore stay
+      exec 8< "${entry}/.lock" || continue
+      if ! flock -n -x 8; then
+        exec 8<&-
+        continue
+      fi
+
+      size="$(du -sb "${entry}" | cut -f 1)"
+      rm -rf "${entry}"
+      exec 8<&-
+      total=$(( total - size ))
+      restore_cachelog "Evicted ${entry##*/} ($(( size / 1024 / 1024 )) MB)"
+    done < <(find "${dir}" -mindepth 1 -maxdepth 1 -type d ! -name '.*' -printf '%T@ %p\n' | sort -n)
+
+    (( total <= limit )) \
+      || restore_cachelog "WARNING: Cache holds $(( total / 1024 / 1024 )) MB, over RESTORE_CACHE_MAX_MB=${RESTORE_CACHE_MAX_MB:-10240}"
+  ) 9> "${dir}/.lock"
+}
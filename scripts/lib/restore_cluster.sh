@@ -0,0 +1,162 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+shopt -s inherit_errexit
+
+############################################
+# Helpers
+############################################
+restore_clusterlog() {
+  log "[DB Cluster Restore] $*"
+}
+
+############################################
+# Archives to restore, one per database
+# Prints "<database>\t<key>\t<format>" for the newest catalog record of
+# each database at or before TARGET_ARCHIVE_DATETIME, the end of
+# TARGET_ARCHIVE_DATE_ONLY, or the newest backups when neither is set.
+# DBLIST limits the databases.
+############################################
+cluster_restore_plan() {
+  local cutoff="9999"
+  local catalog
+
+  if [[ -n "${TARGET_ARCHIVE_DATETIME:-}" ]]; then
+    cutoff="${TARGET_ARCHIVE_DATETIME:0:10}T${TARGET_ARCHIVE_DATETIME:11:2}:${TARGET_ARCHIVE_DATETIME:14:2}"
+  elif [[ -n "${TARGET_ARCHIVE_DATE_ONLY:-}" ]]; then
+    cutoff="${TARGET_ARCHIVE_DATE_ONLY}T23:59"
+  fi
+
+  catalog="$(catalog_read)" || return 1
+
+  jq -r -s \
+    --arg prefix "${DUMPPREFIX}_" \
+    --arg cutoff "${cutoff}" \
+    --arg only "${DBLIST:-}" \
+    '($only | split("[\\s,]+"; null) | map(select(length > 0))) as $only
+     | map(select(.datetime != null and .datetime <= $cutoff and .format != "physical"
+                  and (.key | split("/") | last | startswith($prefix))
+                  and ($only == [] or (.database | IN($only[])))))
+     | group_by(.database)[]
+     | max_by(.datetime)
+     | "\(.database)\t\(.key)\t\(.format)"' "${catalog}"
+}
+
+############################################
+# Restore globals.sql (roles and tablespaces)
+# Objects that already exist are reported by psql and skipped.
+############################################
+restore_globals() {
+  local globals="${MYBASEDIR}/globals.sql"
+  local rc=0
+
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    globals="$(mktemp /tmp/globals.XXXXXX.sql)"
+    if ! s3cmd get --force "s3://${BUCKET}/globals.sql" "${globals}" >/dev/null; then
+      restore_clusterlog "ERROR: Unable to download s3://${BUCKET}/globals.sql"
+      rm -f "${globals}"
+      return 1
+    fi
+  elif [[ ! -f "${globals}" ]]; then
+    restore_clusterlog "ERROR: ${globals} not found"
+    return 1
+  fi
+
+  restore_clusterlog "Restoring globals from ${globals}"
+  validate_postgres_pass
+  psql ${PG_CONN_PARAMETERS} -d postgres -q -f "${globals}" 2>&1 \
+    | { grep -v 'already exists' || true; } || rc=$?
+  unset_postgres_pass
+
+  [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]] && rm -f "${globals}"
+  (( rc == 0 )) || restore_clusterlog "ERROR: Restoring globals failed"
+  return "${rc}"
+}
+
+############################################
+# Restore one database of the plan (run_job_pool job)
+# Usage: cluster_restore_job <database>
+############################################
+cluster_restore_job() {
+  local db="$1"
+  local key="${CLUSTER_ARCHIVES[${db}]}"
+  local dump_args="-Fc"
+  local started="${EPOCHSECONDS}"
+  local done_count
+
+  [[ "${CLUSTER_FORMATS[${db}]}" == "directory" ]] && dump_args="-Fd"
+
+  restore_clusterlog "Restoring ${db} from ${key}"
+
+  case "${STORAGE_BACKEND}" in
+    S3|s3)
+      DUMP_ARGS="${dump_args}" TARGET_DB="${db}" TARGET_ARCHIVE="" TARGET_ARCHIVE_KEY="${key}" \
+        s3_restore "" "${db}"
+      ;;
+    *)
+      DUMP_ARGS="${dump_args}" TARGET_DB="${db}" TARGET_ARCHIVE="${MYBASEDIR}/${key}" \
+        file_restore
+      ;;
+  esac
+
+  printf '%s\n' "${db}" >> "${CLUSTER_PROGRESS}"
+  done_count="$(wc -l < "${CLUSTER_PROGRESS}")"
+  restore_clusterlog "Restored ${db} in $(( EPOCHSECONDS - started ))s (${done_count}/${#CLUSTER_ARCHIVES[@]} databases)"
+}
+
+############################################
+# Restore the whole cluster
+# globals.sql first, then every database of cluster_restore_plan, at
+# most RESTORE_CONCURRENCY at a time. Each database is restored under
+# its own name.
+############################################
+cluster_restore() {
+  local plan status_file failed db key format
+  declare -gA CLUSTER_ARCHIVES=()
+  declare -gA CLUSTER_FORMATS=()
+
+  restore_clusterlog "Cluster restore requested (point in time: ${TARGET_ARCHIVE_DATETIME:-${TARGET_ARCHIVE_DATE_ONLY:-latest}})"
+
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    s3_init false
+  fi
+
+  plan="$(cluster_restore_plan)" || return 1
+  while IFS=$'\t' read -r db key format; do
+    [[ -n "${db}" ]] || continue
+    CLUSTER_ARCHIVES["${db}"]="${key}"
+    CLUSTER_FORMATS["${db}"]="${format}"
+    restore_clusterlog "Planned ${db}: ${key}"
+  done <<< "${plan}"
+
+  if (( ${#CLUSTER_ARCHIVES[@]} == 0 )); then
+    restore_clusterlog "ERROR: No backups found in the catalog for this point in time"
+    return 1
+  fi
+
+  if is_dry_run; then
+    restore_clusterlog "[DRY-RUN] Would restore globals and ${#CLUSTER_ARCHIVES[@]} databases"
+    return 0
+  fi
+
+  restore_globals || return 1
+
+  status_file="$(mktemp /tmp/restore-jobs.XXXXXX)"
+  CLUSTER_PROGRESS="$(mktemp /tmp/restore-progress.XXXXXX)"
+  restore_clusterlog "Restoring ${#CLUSTER_ARCHIVES[@]} databases, ${RESTORE_CONCURRENCY:-1} at a time"
+
+  # Databases restoring at once share the cores (see restore_jobs)
+  local RESTORE_FANOUT="${RESTORE_CONCURRENCY:-1}"
+  (( ${#CLUSTER_ARCHIVES[@]} < RESTORE_FANOUT )) && RESTORE_FANOUT="${#CLUSTER_ARCHIVES[@]}"
+
+  run_job_pool "${RESTORE_CONCURRENCY:-1}" "${status_file}" cluster_restore_job "${!CLUSTER_ARCHIVES[@]}"
+
+  failed="$(job_pool_failures "${status_file}")"
+  rm -f "${status_file}" "${CLUSTER_PROGRESS}"
+
+  if [[ -n "${failed}" ]]; then
+    restore_clusterlog "ERROR: Restore failed for: $(xargs <<< "${failed}")"
+    return 1
+  fi
+
+  restore_clusterlog "Cluster restore completed for ${#CLUSTER_ARCHIVES[@]} databases"
+}
@@ -43,7 +43,8 @@ file_restore() {
   ##########################################
   # Validate archive
   ##########################################
-  if [[ ! -f "${archive}" ]]; then
+  # A directory is accepted for -Fd dumps already extracted by s3_restore
+  if [[ ! -f "${archive}" && ! -d "${archive}" ]]; then
     restore_log "ERROR: Archive ${archive} not found"
     return 1
   fi
@@ -59,11 +60,15 @@ file_restore() {
   local format
   format="$(get_dump_format "${DUMP_ARGS}")"
 
+  local codec
+  codec="$(detect_compression "${archive}")"
+
   restore_log "File restore requested"
   restore_log "Archive=${archive}"
   restore_log "Target DB=${TARGET_DB}"
   restore_log "Format=${format}"
   restore_log "Encrypted=${RESTORE_META_ENCRYPTED}"
+  restore_log "Compression=${codec}"
   restore_log "Dry-run=${RESTORE_DRY_RUN:-false}"
   restore_log "Extraction folder=${decrypt_folder}"
 
@@ -86,55 +91,123 @@ file_restore() {
   ##########################################
   check_pg_major_compatibility "${RESTORE_META_PG_MAJOR}" || return 1
 
-  if [[ -n "${RESTORE_META_CHECKSUM}" ]]; then
-    validate_checksum "${archive}" || return 1
+  local rc=0
+  if [[ -n "${RESTORE_META_CHECKSUM}" && "${RESTORE_CHECKSUM_VERIFIED:-false}" != "true" ]]; then
+    metrics_begin
+    validate_checksum "${archive}" || rc=$?
+    metrics_end "${TARGET_DB}" verify "${archive}" 0 "${rc}"
+    (( rc == 0 )) || return 1
   fi
 
   ##########################################
-  # Recreate DB
-  ##########################################
-  restore_recreate_db "${TARGET_DB}" || return 1
-
+  # DIRECTORY FORMAT (-Fd → .dir.tar[.gz|.zst]) → extract once
   ##########################################
-  # DIRECTORY FORMAT (-Fd → .tar.gz)
-  ##########################################
-  if [[ "${format}" == "directory" ]]; then
-    [[ "${archive}" != *.tar.gz ]] && {
-      restore_log "ERROR: Directory-format restore requires .tar.gz archive"
+  local extracted=""
+  if [[ "${format}" == "directory" && ! -d "${archive}" ]]; then
+    [[ "${archive}" != *.tar* ]] && {
+      restore_log "ERROR: Directory-format restore requires a .tar archive"
       return 1
     }
 
     local filename base_name
     filename="$(basename "${archive}")"
-    base_name="${filename%.tar.gz}"
-
-    restore_log "Extracting directory dump ${archive} into ${decrypt_folder}/${base_name}"
-    tar -xzf "${archive}" -C "${decrypt_folder}" || {
+    base_name="${filename%.tar*}"
+    extracted="${decrypt_folder}/${base_name}"
+
+    # pg_restore -j reads the directory from disk, so the whole dump is
+    # unpacked; single pass, no intermediate copy
+    rm -rf "${extracted:?}"
+    check_unpack_space "${archive}.meta.json" "${decrypt_folder}" "${archive}" || return 1
+    restore_log "Extracting directory dump ${archive} into ${extracted}"
+    decode_directory_stream "${codec}" "${RESTORE_META_ENCRYPTED}" < "${archive}" \
+      | tar -xf - -C "${decrypt_folder}" || {
       restore_log "ERROR: Failed to extract ${archive}"
+      rm -rf "${extracted:?}"
       return 1
     }
-
-    restore_dump "${decrypt_folder}/${base_name}" "${TARGET_DB}" || return 1
+    archive="${extracted}"
+  fi
 
   ##########################################
-  # CUSTOM FORMAT (-Fc → .dmp / .dmp.gz)
+  # Restore into each target database
   ##########################################
-  else
-    local dump_file="${archive}"
+  local targets=()
+  read -ra targets <<< "${TARGET_DB//,/ }"
 
-    # Handle S3-style compressed custom dumps
-    if [[ "${archive}" == *.gz ]]; then
-      restore_log "Decompressing custom dump ${archive}"
-      gunzip -kf "${archive}" || return 1
-      dump_file="${archive%.gz}"
-    fi
+  if (( ${#targets[@]} > 1 )); then
+    local status_file failed
+    status_file="$(mktemp /tmp/restore-jobs.XXXXXX)"
+    restore_log "Restoring ${archive} into ${#targets[@]} databases, ${RESTORE_CONCURRENCY:-1} at a time"
 
+    # Databases restoring at once share the cores (see restore_jobs)
+    local RESTORE_FANOUT="${RESTORE_CONCURRENCY:-1}"
+    (( ${#targets[@]} < RESTORE_FANOUT )) && RESTORE_FANOUT="${#targets[@]}"
 
+    run_job_pool "${RESTORE_CONCURRENCY:-1}" "${status_file}" file_restore_target "${targets[@]}"
 
-    restore_dump "${dump_file}" "${TARGET_DB}" "${RESTORE_META_ENCRYPTED}" || return 1
+    failed="$(job_pool_failures "${status_file}")"
+    rm -f "${status_file}"
+    if [[ -n "${failed}" ]]; then
+      restore_log "ERROR: Restore failed for: $(xargs <<< "${failed}")"
+      rc=1
+    fi
+  else
+    file_restore_target "${targets[0]}" || rc=$?
   fi
 
-  restore_log "File restore completed successfully for ${TARGET_DB}"
+  [[ -n "${extracted}" ]] && rm -rf "${extracted:?}"
+  (( rc == 0 )) || return 1
   return 0
 }
 
+############################################
+# Restore the archive of file_restore into one database
+# Usage: file_restore_target <db>
+# Runs inside file_restore (or as its run_job_pool job) and reads its
+# archive, format and codec.
+############################################
+file_restore_target() {
+  local db="$1"
+  local rc=0
+  local into
+
+  # With RESTORE_SHADOW the restore goes to a shadow of <db> (see restore_shadow.sh)
+  into="$(restore_shadow_name "${db}")"
+  restore_recreate_db "${into}" || return 1
+
+  metrics_begin
+
+  ##########################################
+  # DIRECTORY FORMAT (extracted)
+  ##########################################
+  if [[ "${format}" == "directory" ]]; then
+    restore_dump "${archive}" "${into}" || rc=$?
+
+  ##########################################
+  # DEDUPLICATED (-Fc → .dmp.chunks manifest)
+  ##########################################
+  elif [[ "${codec}" == "chunked" ]]; then
+    # Chunks decrypt themselves, the reassembled stream is a plain dump
+    restore_log "Reassembling deduplicated dump ${archive} from $(chunk_repository)"
+    chunk_restore_stream "${archive}" \
+      | restore_dump_stream "${into}" none false "$(dirname "${archive}")" "${archive}" || rc=$?
+
+  ##########################################
+  # CUSTOM FORMAT (-Fc → .dmp / .dmp.gz / .dmp.zst)
+  ##########################################
+  elif [[ "${codec}" == "none" ]]; then
+    restore_dump "${archive}" "${into}" "${RESTORE_META_ENCRYPTED}" || rc=$?
+
+  else
+    # Decompress (and decrypt) on the way into pg_restore, no intermediate copies
+    restore_log "Decoding custom dump ${archive} (${codec}) into ${into}"
+    restore_dump_stream "${into}" "${codec}" "${RESTORE_META_ENCRYPTED}" \
+      "$(dirname "${archive}")" "${archive}" < "${archive}" || rc=$?
+  fi
+
+  metrics_end "${db}" restore "${archive}" 0 "${rc}"
+  restore_shadow_finish "${db}" "${into}" "${rc}" || return 1
+
+  restore_log "File restore completed successfully for ${db}"
+}
+
@@ -0,0 +1,282 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+shopt -s inherit_errexit
+
+############################################
+# Helpers
+############################################
+restore_physicallog() {
+  log "[Physical Restore] $*"
+}
+
+############################################
+# Point in time to recover to
+# Prints TARGET_ARCHIVE_DATETIME as YYYY-MM-DDTHH:MM:SS, the end of
+# TARGET_ARCHIVE_DATE_ONLY, or nothing to replay all archived WAL.
+############################################
+physical_restore_target() {
+  if [[ -n "${TARGET_ARCHIVE_DATETIME:-}" ]]; then
+    echo "${TARGET_ARCHIVE_DATETIME:0:10}T${TARGET_ARCHIVE_DATETIME:11:2}:${TARGET_ARCHIVE_DATETIME:14:2}:00"
+  elif [[ -n "${TARGET_ARCHIVE_DATE_ONLY:-}" ]]; then
+    echo "${TARGET_ARCHIVE_DATE_ONLY}T23:59:59"
+  fi
+}
+
+############################################
+# Base backup to restore from
+# Usage: physical_restore_base <target>
+# Prints the key of TARGET_ARCHIVE, or of the newest base backup that
+# finished before <target> (the newest one without a target).
+############################################
+physical_restore_base() {
+  local target="$1"
+  local catalog
+
+  if [[ -n "${TARGET_ARCHIVE:-}" ]]; then
+    catalog_key "${TARGET_ARCHIVE}"
+    return 0
+  fi
+
+  catalog="$(catalog_read)" || return 1
+
+  jq -r -s --arg target "${target:-9999}" \
+    'map(select(.format == "physical" and (.backup_end // .datetime) != null
+                and (.backup_end // .datetime) <= $target))
+     | max_by(.backup_end // .datetime) | .key // empty' "${catalog}"
+}
+
+############################################
+# WAL files to replay after a base backup
+# Usage: physical_restore_wal <index> <wal_start> <target>
+# Prints "<key>\t<segment>\t<compression>\t<encrypted>\t<checksum>"
+# for every timeline history file and for the segments from <wal_start>
+# on, up to the first one archived after <target>, which holds the end
+# of the recovery.
+############################################
+physical_restore_wal() {
+  local index="$1"
+  local wal_start="$2"
+  local target="$3"
+
+  jq -r -s --arg start "${wal_start:8}" --arg target "${target:-9999}" \
+    '(map(select(.segment | endswith(".history"))))
+     + (map(select((.segment | test("^[0-9A-F]{24}$")) and .segment[8:] >= $start))
+        | sort_by(.segment[8:], .segment)
+        | (map(.archived > $target) | index(true)) as $last
+        | if $last == null then . else .[0:$last + 1] end)
+     | .[]
+     | [.key, .segment, .compression, (if .encrypted == null then "" else (.encrypted | tostring) end), (.checksum // "")]
+     | @tsv' "${index}"
+}
+
+############################################
+# Fetch and decode one WAL file into the restore archive
+# Usage: physical_restore_wal_job "<key>\t<segment>\t<compression>\t<encrypted>\t<checksum>"
+############################################
+physical_restore_wal_job() {
+  local key segment codec encrypted checksum stored
+  IFS=$'\t' read -r key segment codec encrypted checksum <<< "$1"
+
+  [[ -n "${encrypted}" ]] || encrypted="${DB_DUMP_ENCRYPTION:-false}"
+
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    stored="${PHYSICAL_WAL_ARCHIVE}/${segment}.stored"
+    s3_transfer download "s3://${BUCKET}/${key}" "${stored}" >/dev/null
+  else
+    stored="${MYBASEDIR}/${key}"
+  fi
+
+  if [[ -n "${checksum}" && "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]] \
+      && [[ "$(sha256sum "${stored}" | cut -d' ' -f1)" != "${checksum}" ]]; then
+    restore_physicallog "ERROR: Checksum mismatch for WAL file ${segment}"
+    return 1
+  fi
+
+  set -o pipefail
+  decode_directory_stream "${codec}" "${encrypted}" < "${stored}" > "${PHYSICAL_WAL_ARCHIVE}/${segment}"
+  [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]] && rm -f "${stored}"
+  return 0
+}
+
+############################################
+# Physical restore
+# Rebuilds a data directory in RESTORE_PGDATA from the base backup
+# picked by physical_restore_base and the archived WAL after it, then
+# configures recovery to TARGET_ARCHIVE_DATETIME (or to the end of the
+# archive). PostgreSQL must be stopped; recovery runs when it is
+# started on RESTORE_PGDATA, and the server is promoted once the target
+# is reached.
+############################################
+physical_restore() {
+  local target base_key meta archive codec encrypted wal_start recovery_time
+  local index status_file failed owner
+  local rc=0
+
+  target="$(physical_restore_target)"
+  restore_physicallog "Physical restore requested (point in time: ${target:-latest})"
+
+  if [[ -z "${RESTORE_PGDATA:-}" ]]; then
+    restore_physicallog "ERROR: RESTORE_PGDATA is required for a physical restore"
+    return 1
+  fi
+  if [[ -d "${RESTORE_PGDATA}" ]] \
+      && [[ -n "$(find "${RESTORE_PGDATA}" -mindepth 1 -maxdepth 1 ! -name lost+found -print -quit)" ]]; then
+    restore_physicallog "ERROR: ${RESTORE_PGDATA} is not empty, refusing to overwrite it"
+    return 1
+  fi
+
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    s3_init false
+  fi
+
+  base_key="$(physical_restore_base "${target}")" || return 1
+  if [[ -z "${base_key}" ]]; then
+    restore_physicallog "ERROR: No base backup found in the catalog before ${target:-now}"
+    return 1
+  fi
+  restore_physicallog "Base backup: ${base_key}"
+
+  ##########################################
+  # Metadata
+  ##########################################
+  local workdir
+  workdir="$(mktemp -d /tmp/physical-restore.XXXXXX)"
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    meta="${workdir}/$(basename "${base_key}").meta.json"
+    s3cmd get --force "s3://${BUCKET}/${base_key}.meta.json" "${meta}" >/dev/null || { rm -rf "${workdir}"; return 1; }
+  else
+    archive="${MYBASEDIR}/${base_key}"
+    meta="${archive}.meta.json"
+  fi
+
+  load_restore_metadata "${meta%.meta.json}" || { rm -rf "${workdir}"; return 1; }
+  codec="$(detect_compression "${base_key}" "${meta}")"
+  encrypted="${RESTORE_META_ENCRYPTED}"
+  wal_start="$(jq -r '.wal_start // empty' "${meta}")"
+
+  ##########################################
+  # WAL to replay
+  ##########################################
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    # A fresh copy, the archiver may be appending to the local one
+    index="${workdir}/wal.jsonl"
+    s3cmd get --force "s3://${BUCKET}/wal/wal.jsonl" "${index}" >/dev/null 2>&1 \
+      || wal_index_rebuild "${index}"
+  else
+    wal_index_load
+    index="${workdir}/wal.jsonl"
+    cp "$(wal_index_file)" "${index}"
+  fi
+
+  local wal_files=()
+  mapfile -t wal_files < <(physical_restore_wal "${index}" "${wal_start}" "${target}")
+
+  restore_physicallog "PostgreSQL major version: ${RESTORE_META_PG_MAJOR}"
+  restore_physicallog "Compression=${codec} Encrypted=${encrypted} WAL start=${wal_start}"
+  restore_physicallog "WAL files to replay: ${#wal_files[@]}"
+
+  if [[ -n "${target}" ]] && ! jq -e -s --arg target "${target}" \
+      'any(.[]; .archived > $target)' "${index}" >/dev/null; then
+    restore_physicallog "WARNING: No WAL archived after ${target} yet, recovery stops at the end of the archive"
+  fi
+
+  if is_dry_run; then
+    restore_physicallog "[DRY-RUN] Would restore ${base_key} into ${RESTORE_PGDATA}"
+    restore_physicallog "[DRY-RUN] Would replay ${#wal_files[@]} WAL files up to ${target:-the end of the archive}"
+    rm -rf "${workdir}"
+    return 0
+  fi
+
+  ##########################################
+  # Base backup → RESTORE_PGDATA
+  ##########################################
+  create_non_existing_directory "${RESTORE_PGDATA}"
+  owner="$(stat -c '%u:%g' "${RESTORE_PGDATA}")"
+  mkdir -p "${RESTORE_PGDATA}/pg_wal" "${RESTORE_PGDATA}/pg_tblspc"
+
+  # Tablespaces are restored to their original locations
+  local oid location
+  while IFS=$'\t' read -r oid location; do
+    [[ -n "${oid}" ]] || continue
+    restore_physicallog "Restoring tablespace ${oid} into ${location}"
+    create_non_existing_directory "${location}"
+    ln -sfn "${location}" "${RESTORE_PGDATA}/pg_tblspc/${oid}"
+  done < <(jq -r '.tablespaces // {} | to_entries[] | "\(.key)\t\(.value)"' "${meta}")
+
+  # Each tar of the base backup is unpacked as it is read, without staging
+  export RESTORE_PGDATA
+  local unpack='name="${TAR_FILENAME##*/}"
+    case "${name}" in
+      base.tar) tar -xf - -C "${RESTORE_PGDATA}" ;;
+      pg_wal.tar) tar -xf - -C "${RESTORE_PGDATA}/pg_wal" ;;
+      *.tar) tar -xf - -C "${RESTORE_PGDATA}/pg_tblspc/${name%.tar}/" ;;
+      *) cat > /dev/null ;;
+    esac'
+
+  restore_physicallog "Unpacking ${base_key} into ${RESTORE_PGDATA}"
+  metrics_begin
+  set -o pipefail
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    s3_stream_object "${base_key}" "${meta}" \
+      decode_directory_stream "${codec}" "${encrypted}" \
+      | tar -xf - -C "${workdir}" --to-command="${unpack}" || rc=$?
+  else
+    if [[ -n "${RESTORE_META_CHECKSUM}" ]]; then
+      validate_checksum "${archive}" || rc=$?
+    fi
+    (( rc == 0 )) && {
+      decode_directory_stream "${codec}" "${encrypted}" < "${archive}" \
+        | tar -xf - -C "${workdir}" --to-command="${unpack}" || rc=$?
+    }
+  fi
+  metrics_end cluster extract transfer "${RESTORE_PGDATA}" "${rc}"
+
+  if (( rc != 0 )); then
+    restore_physicallog "ERROR: Unable to unpack ${base_key}"
+    rm -rf "${workdir}"
+    return 1
+  fi
+
+  ##########################################
+  # Archived WAL → RESTORE_PGDATA/pg_wal_archive
+  ##########################################
+  PHYSICAL_WAL_ARCHIVE="${RESTORE_PGDATA}/pg_wal_archive"
+  create_non_existing_directory "${PHYSICAL_WAL_ARCHIVE}"
+
+  if (( ${#wal_files[@]} > 0 )); then
+    restore_physicallog "Fetching ${#wal_files[@]} WAL files, ${S3_TRANSFER_CONCURRENCY:-4} at a time"
+    status_file="$(mktemp /tmp/restore-wal.XXXXXX)"
+    metrics_begin
+    run_job_pool "${S3_TRANSFER_CONCURRENCY:-4}" "${status_file}" physical_restore_wal_job "${wal_files[@]}"
+    failed="$(job_pool_failures "${status_file}")"
+    metrics_end cluster download "${PHYSICAL_WAL_ARCHIVE}" 0 "$([[ -z "${failed}" ]] && echo success || echo failure)"
+    rm -f "${status_file}"
+
+    if [[ -n "${failed}" ]]; then
+      restore_physicallog "ERROR: Unable to fetch $(wc -l <<< "${failed}") WAL files"
+      rm -rf "${workdir}"
+      return 1
+    fi
+  fi
+
+  ##########################################
+  # Recovery settings
+  ##########################################
+  {
+    printf '\n# Physical restore of %s\n' "${base_key}"
+    printf "restore_command = 'cp pg_wal_archive/%%f \"%%p\"'\n"
+    if [[ -n "${target}" ]]; then
+      recovery_time="$(date -d "${target/T/ }" '+%Y-%m-%d %H:%M:%S%z')"
+      printf "recovery_target_time = '%s'\n" "${recovery_time}"
+    fi
+    printf "recovery_target_action = 'promote'\n"
+  } >> "${RESTORE_PGDATA}/postgresql.auto.conf"
+  touch "${RESTORE_PGDATA}/recovery.signal"
+
+  chown -R "${owner}" "${RESTORE_PGDATA}"
+  chmod 0700 "${RESTORE_PGDATA}"
+  rm -rf "${workdir}"
+
+  restore_physicallog "Data directory ${RESTORE_PGDATA} is ready"
+  restore_physicallog "Start PostgreSQL on it to recover to ${recovery_time:-the end of the archived WAL}; pg_wal_archive can be removed once it is promoted"
+}
@@ -20,6 +20,15 @@ resolve_backup_from_date() {
   local want_date="${TARGET_ARCHIVE_DATE_ONLY:-}"
 
   local candidates=()
+  local key
+
+  ############################################
+  # Catalog lookup (no listing)
+  ############################################
+  if key="$(catalog_resolve)"; then
+    echo "${key}"
+    return 0
+  fi
 
   ############################################
   # Walk S3 directory ONCE
@@ -31,11 +40,10 @@ resolve_backup_from_date() {
 
     # Must look like a dump
     [[ "$fname" != ${DUMPPREFIX}_* ]] && continue
-    [[ "$fname" =~ \.(dmp\.gz|dir\.tar\.gz)$ ]] || continue
+    [[ "$fname" =~ \.(dmp|dir\.tar)(\.gz|\.zst|\.chunks)?$ ]] || continue
 
     # Strip extension
-    base="${fname%.dmp.gz}"
-    base="${base%.dir.tar.gz}"
+    base="$(strip_archive_extension "${fname}")"
 
     datetime_part="${base##*.}"   # DD-Month-YYYY-HH-MM
 
@@ -84,8 +92,7 @@ resolve_backup_from_date() {
   for path in "${candidates[@]}"; do
     fname="$(basename "$path")"
 
-    base="${fname%.dmp.gz}"
-    base="${base%.dir.tar.gz}"
+    base="$(strip_archive_extension "${fname}")"
     datetime_part="${base##*.}"
 
     IFS='-' read -r day month year hour min <<< "$datetime_part" || continue
@@ -99,6 +106,190 @@ resolve_backup_from_date() {
 
   [[ -n "$best_key" ]] && echo "${best_key#s3://${BUCKET}/}"
 }
+############################################
+# Stream an S3 object through a command
+# Usage: s3_stream_object <key> <meta_file> <command> [args...]
+# The object is downloaded and piped into <command>. With checksum
+# validation on, a chunk manifest in <meta_file> verifies every part
+# before it is written, and a corrupt part is fetched again. Older
+# archives fall back to hashing the stream on the side against the
+# metadata checksum, which can only fail once the stream has ended.
+# Logs go to stderr, stdout belongs to <command>.
+############################################
+s3_stream_object() {
+  local key="$1"
+  local meta="$2"
+  shift 2
+  local expected="" rc=0
+
+  if [[ "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    if has_hash_manifest "${meta}"; then
+      s3_transfer download "s3://${BUCKET}/${key}" - "${meta}" | "$@" || rc=$?
+      (( rc == 0 )) && restore_s3log "Checksum validation PASSED for ${key} (chunk manifest)" >&2
+      return "${rc}"
+    fi
+    expected="$(jq -r '.checksum // empty' "${meta}" | awk '{print $1}')"
+  fi
+
+  if [[ -z "${expected}" ]]; then
+    s3_transfer download "s3://${BUCKET}/${key}" - | "$@" || rc=$?
+    return "${rc}"
+  fi
+
+  local workdir hash_pid actual
+  workdir="$(mktemp -d /tmp/s3-stream.XXXXXX)"
+  mkfifo "${workdir}/hash.fifo"
+
+  sha256sum < "${workdir}/hash.fifo" > "${workdir}/hash" &
+  hash_pid=$!
+
+  s3_transfer download "s3://${BUCKET}/${key}" - \
+    | tee "${workdir}/hash.fifo" \
+    | "$@" || rc=$?
+  wait "${hash_pid}" || rc=$?
+
+  read -r actual _ < "${workdir}/hash" || true
+  rm -rf "${workdir}"
+
+  if (( rc == 0 )) && [[ "${actual}" != "${expected}" ]]; then
+    restore_s3log "ERROR: Checksum mismatch for ${key}" >&2
+    return 1
+  fi
+
+  (( rc == 0 )) && restore_s3log "Checksum validation PASSED for ${key}" >&2
+  return "${rc}"
+}
+
+extract_tar_stream() {
+  decode_directory_stream "$1" "$3" | tar -xf - -C "$2"
+}
+
+############################################
+# Stream an S3 tar archive into a directory
+# Usage: s3_stream_extract <key> <dest_dir> <codec> <meta_file> [encrypted]
+# The object is downloaded, verified, decrypted, decompressed and
+# unpacked in one pass (see s3_stream_object).
+############################################
+s3_stream_extract() {
+  s3_stream_object "$1" "$4" extract_tar_stream "$3" "$2" "${5:-false}"
+}
+
+s3_streaming_restore_enabled() {
+  [[ "${S3_STREAMING_RESTORE:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+############################################
+# Restore a custom-format S3 archive without staging it
+# Usage: s3_stream_restore <archive_key> <meta_path> <target_db>
+# Download, checksum, decryption and decompression all happen in the
+# pipe into pg_restore. A parallel restore (see restore_wants_parallel)
+# needs a seekable file, so the decoded dump is spooled once and
+# verified before the restore starts.
+############################################
+s3_stream_restore() {
+  local archive_key="$1"
+  local meta_path="$2"
+  local target_db="$3"
+  local archive_path="${meta_path%.meta.json}"
+  local codec into rc=0
+
+  load_restore_metadata "${archive_path}" || return 1
+  codec="$(detect_compression "${archive_key}" "${meta_path}")"
+  into="$(restore_shadow_name "${target_db}")"
+
+  restore_s3log "Streaming restore of s3://${BUCKET}/${archive_key} into ${target_db}"
+  restore_s3log "Encrypted=${RESTORE_META_ENCRYPTED} Compression=${codec}"
+
+  if is_dry_run; then
+    restore_s3log "[DRY-RUN] Would recreate DB ${target_db}"
+    restore_s3log "[DRY-RUN] Would stream archive ${archive_key}"
+    return 0
+  fi
+
+  check_pg_major_compatibility "${RESTORE_META_PG_MAJOR}" || return 1
+
+  if restore_wants_parallel; then
+    local spool
+    spool="$(mktemp "$(dirname "${meta_path}")/restore.XXXXXX.dmp")"
+    restore_s3log "Spooling decoded dump to ${spool} for parallel restore"
+
+    # The spool is verified before the target database is touched
+    metrics_begin
+    s3_stream_object "${archive_key}" "${meta_path}" \
+      decode_dump_stream "${codec}" "${RESTORE_META_ENCRYPTED}" > "${spool}" || rc=$?
+    metrics_end "${target_db}" download transfer "${spool}" "${rc}"
+    (( rc == 0 )) && { restore_recreate_db "${into}" || rc=$?; }
+    if (( rc == 0 )); then
+      metrics_begin
+      restore_dump "${spool}" "${into}" || rc=$?
+      metrics_end "${target_db}" restore "${spool}" 0 "${rc}"
+      restore_shadow_finish "${target_db}" "${into}" "${rc}" || rc=$?
+    fi
+    rm -f "${spool}"
+  else
+    restore_recreate_db "${into}" || return 1
+    # Download, decode and pg_restore overlap, so they are timed together
+    metrics_begin
+    s3_stream_object "${archive_key}" "${meta_path}" \
+      restore_dump_stream "${into}" "${codec}" "${RESTORE_META_ENCRYPTED}" \
+      "$(dirname "${meta_path}")" || rc=$?
+    metrics_end "${target_db}" stream transfer 0 "${rc}"
+    if [[ "${into}" == "${target_db}" ]]; then
+      (( rc != 0 )) && restore_s3log "ERROR: Streaming restore failed, ${target_db} may be partially restored"
+    else
+      restore_shadow_finish "${target_db}" "${into}" "${rc}" || rc=$?
+    fi
+  fi
+
+  return "${rc}"
+}
+
+############################################
+# Restore part of a seekable S3 archive
+# Usage: s3_seekable_restore <archive_key> <meta_path> <target_db>
+# Only the blocks holding the TOC and the entries RESTORE_ARGS selects
+# are fetched, with ranged GETs (see seekable.sh).
+############################################
+s3_seekable_restore() {
+  local archive_key="$1"
+  local meta_path="$2"
+  local target_db="$3"
+  local archive_path="${meta_path%.meta.json}"
+  local index_path="${archive_path}.index.json"
+  local codec into rc=0
+
+  load_restore_metadata "${archive_path}" || return 1
+  codec="$(detect_compression "${archive_key}" "${meta_path}")"
+
+  restore_s3log "Selective restore of s3://${BUCKET}/${archive_key} into ${target_db} (${RESTORE_ARGS})"
+
+  if is_dry_run; then
+    restore_s3log "[DRY-RUN] Would recreate DB ${target_db}"
+    restore_s3log "[DRY-RUN] Would read the selected blocks of ${archive_key}"
+    return 0
+  fi
+
+  check_pg_major_compatibility "${RESTORE_META_PG_MAJOR}" || return 1
+
+  s3cmd get --force "s3://${BUCKET}/${archive_key}.index.json" "${index_path}" >/dev/null || {
+    restore_s3log "ERROR: Unable to download ${archive_key}.index.json"
+    return 1
+  }
+
+  into="$(restore_shadow_name "${target_db}")"
+  restore_recreate_db "${into}" || rc=$?
+  if (( rc == 0 )); then
+    metrics_begin
+    seekable_extract "s3://${BUCKET}/${archive_key}" "${index_path}" "${codec}" \
+      | restore_dump_stream "${into}" none false "$(dirname "${meta_path}")" || rc=$?
+    metrics_end "${target_db}" stream transfer 0 "${rc}"
+    restore_shadow_finish "${target_db}" "${into}" "${rc}" || rc=$?
+  fi
+
+  rm -f "${index_path}"
+  return "${rc}"
+}
+
 ############################################
 # S3 restore
 ############################################
@@ -115,6 +306,7 @@ s3_restore() {
 
   local backup_key=""
   local workdir="/data/dump"
+  local rc=0
 
   create_non_existing_directory "${workdir}"
 
@@ -122,7 +314,10 @@ s3_restore() {
   ############################################
   # 1. Resolve archive key (NO normalization)
   ############################################
-  if [[ -n "${TARGET_ARCHIVE:-}" ]]; then
+  if [[ -n "${TARGET_ARCHIVE_KEY:-}" ]]; then
+    backup_key="${TARGET_ARCHIVE_KEY}"
+    restore_s3log "Using archive key ${backup_key}"
+  elif [[ -n "${TARGET_ARCHIVE:-}" ]]; then
     backup_key="$(basename "${TARGET_ARCHIVE}")"
     restore_s3log "Using TARGET_ARCHIVE override: ${backup_key}"
   else
@@ -163,14 +358,17 @@ s3_restore() {
 
   restore_s3log "Resolving metadata for ${base_key}"
 
-  if s3cmd info "s3://${BUCKET}/${base_key}.meta.json" >/dev/null 2>&1; then
-    meta_key="${base_key}.meta.json"
-    archive_key="${base_key}"
-  elif s3cmd info "s3://${BUCKET}/${base_key}.gz.meta.json" >/dev/null 2>&1; then
-    meta_key="${base_key}.gz.meta.json"
-    archive_key="${base_key}.gz"
-  else
-    restore_s3log "ERROR: No metadata found for ${base_key} (.meta.json or .gz.meta.json)"
+  local suffix
+  for suffix in "" ".gz" ".zst"; do
+    if s3cmd info "s3://${BUCKET}/${base_key}${suffix}.meta.json" >/dev/null 2>&1; then
+      meta_key="${base_key}${suffix}.meta.json"
+      archive_key="${base_key}${suffix}"
+      break
+    fi
+  done
+
+  if [[ -z "${meta_key}" ]]; then
+    restore_s3log "ERROR: No metadata found for ${base_key} (.meta.json, .gz.meta.json or .zst.meta.json)"
     return 1
   fi
 
@@ -181,13 +379,121 @@ s3_restore() {
   local meta_path="${archive_path}.meta.json"
 
   restore_s3log "Downloading metadata to destination ${meta_path}"
-  s3cmd get "s3://${BUCKET}/${meta_key}" "${meta_path}" || return 1
+  s3cmd get --force "s3://${BUCKET}/${meta_key}" "${meta_path}" || return 1
+
+  # Without its chunk manifest the archive is checked as a whole
+  if [[ "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && jq -e '.manifest.file' "${meta_path}" >/dev/null 2>&1; then
+    s3cmd get --force "s3://${BUCKET}/${archive_key}.manifest.json" "${archive_path}.manifest.json" >/dev/null \
+      || restore_s3log "WARNING: Unable to download ${archive_key}.manifest.json, using the archive checksum"
+  fi
+
+  ############################################
+  # 3a. Directory dumps: extract while downloading
+  ############################################
+  if [[ "${archive_key}" == *.dir.tar* ]]; then
+    local codec extract_dir encrypted
+    codec="$(detect_compression "${archive_key}" "${meta_path}")"
+    encrypted="$(jq -r '.encrypted // false' "${meta_path}")"
+    extract_dir="${workdir}/$(basename "${archive_key%.tar*}")"
+
+    rm -rf "${extract_dir}"
+    check_unpack_space "${meta_path}" "${workdir}" || { rm -f "${meta_path}" "${archive_path}.manifest.json"; return 1; }
+    restore_s3log "Streaming archive into ${extract_dir} (compression=${codec})"
+    metrics_begin
+    s3_stream_extract "${archive_key}" "${workdir}" "${codec}" "${meta_path}" "${encrypted}" || rc=$?
+    metrics_end "${target_db}" extract transfer "${extract_dir}" "${rc}"
+    if (( rc != 0 )); then
+      rm -rf "${extract_dir}" "${meta_path}" "${archive_path}.manifest.json"
+      return 1
+    fi
+
+    mv "${meta_path}" "${extract_dir}.meta.json"
+    rm -f "${archive_path}.manifest.json"
+
+    TARGET_DB="${target_db}" \
+    TARGET_ARCHIVE="${extract_dir}" \
+    RESTORE_CHECKSUM_VERIFIED=true \
+    RESTORE_SLICE_SOURCE="s3://${BUCKET}/${archive_key}" \
+      file_restore || rc=$?
+
+    rm -rf "${extract_dir}" "${extract_dir}.meta.json"
+    return "${rc}"
+  fi
+
+  # A fan-out restore (several target databases) fetches the archive once
+  local fan_out=false
+  [[ "${target_db}" =~ [[:space:],] ]] && fan_out=true
+
+  ############################################
+  # 3b. Selective restores read only the ranges they need
+  ############################################
+  if [[ "${fan_out}" == "false" && "${archive_key}" != *.chunks ]] && seekable_restore_wanted "${meta_path}"; then
+    s3_seekable_restore "${archive_key}" "${meta_path}" "${target_db}" || rc=$?
+    rm -f "${meta_path}" "${archive_path}.manifest.json"
+    return "${rc}"
+  fi
+
+  ############################################
+  # 3c. Custom dumps: optionally restore while downloading
+  ############################################
+  # A deduplicated dump's object is only its manifest, file_restore
+  # streams the chunks
+  if s3_streaming_restore_enabled && [[ "${fan_out}" == "false" && "${archive_key}" != *.chunks ]]; then
+    RESTORE_SLICE_SOURCE="s3://${BUCKET}/${archive_key}" \
+      s3_stream_restore "${archive_key}" "${meta_path}" "${target_db}" || rc=$?
+    rm -f "${meta_path}" "${archive_path}.manifest.json"
+    return "${rc}"
+  fi
+
+  ############################################
+  # 3d. Archives already in the local cache are not downloaded again
+  ############################################
+  # A deduplicated dump's object is only its manifest
+  if restore_cache_enabled && [[ "${archive_key}" != *.chunks ]]; then
+    restore_cache_fetch "${archive_key}" "${meta_path}" "${target_db}" || rc=$?
+    if (( rc == 0 )); then
+      TARGET_DB="${target_db}" \
+      TARGET_ARCHIVE="${RESTORE_CACHE_ARCHIVE}" \
+      RESTORE_CHECKSUM_VERIFIED=true \
+      RESTORE_SLICE_SOURCE="s3://${BUCKET}/${archive_key}" \
+        file_restore || rc=$?
+      restore_cache_release
+      rm -f "${meta_path}" "${archive_path}.manifest.json"
+      return "${rc}"
+    elif (( rc != 1 )); then
+      rm -f "${meta_path}" "${archive_path}.manifest.json"
+      return 1
+    fi
+    rc=0
+  fi
 
   ############################################
   # 3. Download archive
   ############################################
+  # With a chunk manifest every part is verified as it lands, corrupt
+  # parts are fetched again and a damaged local copy is repaired in place
+  if [[ "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && has_hash_manifest "${meta_path}"; then
+    restore_s3log "Downloading archive to destination ${archive_path} (chunk verified)"
+    metrics_begin
+    s3_transfer download "s3://${BUCKET}/${archive_key}" "${archive_path}" "${meta_path}" || rc=$?
+    metrics_end "${target_db}" download transfer "${archive_path}" "${rc}"
+    (( rc == 0 )) || return 1
+    restore_s3log "Checksum validation PASSED for ${archive_key} (chunk manifest)"
+
+    restore_s3log "Delegating restore to file_restore using ${target_db} and ${archive_path}"
+    TARGET_DB="${target_db}" \
+    TARGET_ARCHIVE="${archive_path}" \
+    RESTORE_CHECKSUM_VERIFIED=true \
+    RESTORE_SLICE_SOURCE="s3://${BUCKET}/${archive_key}" \
+      file_restore
+    return
+  fi
+
   restore_s3log "Downloading archive to destination ${archive_path}"
-  s3cmd get "s3://${BUCKET}/${archive_key}" "${archive_path}" || return 1
+  metrics_begin
+  s3_transfer download "s3://${BUCKET}/${archive_key}" "${archive_path}" || rc=$?
+  metrics_end "${target_db}" download transfer "${archive_path}" "${rc}"
+  (( rc == 0 )) || return 1
 
   ############################################
   # 4. Optional checksum (metadata-driven)
@@ -200,7 +506,7 @@ s3_restore() {
     local checksum_path="${archive_path}.sha256"
 
     restore_s3log "Downloading checksum to destination ${checksum_path}"
-    s3cmd get "s3://${BUCKET}/${checksum_key}" "${checksum_path}" || return 1
+    s3cmd get --force "s3://${BUCKET}/${checksum_key}" "${checksum_path}" || return 1
   fi
 
   ############################################
@@ -210,5 +516,6 @@ s3_restore() {
 
   TARGET_DB="${target_db}" \
   TARGET_ARCHIVE="${archive_path}" \
+  RESTORE_SLICE_SOURCE="s3://${BUCKET}/${archive_key}" \
     file_restore
 }
\ No newline at end of file
@@ -0,0 +1,212 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+shopt -s inherit_errexit
+
+############################################
+# Helpers
+############################################
+restore_shadowlog() {
+  log "[DB Shadow Restore] $*"
+}
+
+restore_shadow_enabled() {
+  [[ "${RESTORE_SHADOW:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+# Comment set on the previous copies a swap keeps
+restore_shadow_marker() {
+  echo "Previous copy kept by a shadow restore"
+}
+
+############################################
+# Shadow restores
+# A restore normally drops TARGET_DB first, so the database is gone for
+# the whole pg_restore and a failed restore leaves nothing behind. With
+# RESTORE_SHADOW, the archive is restored into <db>__shadow while <db>
+# keeps serving. RESTORE_VALIDATION_QUERY then runs against the shadow.
+# Only when the restore and the query succeed is the shadow renamed over
+# <db>, in one transaction bounded by RESTORE_SWAP_LOCK_TIMEOUT. The
+# previous <db> is kept as <db>__old_<epoch> for RESTORE_KEEP_OLD_HOURS,
+# tagged with restore_shadow_marker as its database comment so that
+# only copies made here are ever expired.
+#
+# The swap is the only downtime, recorded as the "swap" metrics phase
+# (pg_backup_phase_duration_seconds{phase="swap"}).
+#
+# Usage: into="$(restore_shadow_name <db>)"
+#        restore_recreate_db "${into}"; <restore into "${into}">
+#        restore_shadow_finish <db> "${into}" <restore_exit_code>
+############################################
+
+############################################
+# First <bytes> bytes of a database name
+# Usage: restore_shadow_prefix <name> <bytes>
+# PostgreSQL limits names to 63 bytes, not characters. A multibyte
+# character cut in half is dropped.
+############################################
+restore_shadow_prefix() {
+  printf '%s' "$1" | head -c "$2" | iconv -c -f UTF-8 -t UTF-8 2>/dev/null || true
+}
+
+############################################
+# Database a restore of <db> writes to
+############################################
+restore_shadow_name() {
+  local db="$1"
+
+  if restore_shadow_enabled; then
+    echo "$(restore_shadow_prefix "${db}" 55)__shadow"
+  else
+    echo "${db}"
+  fi
+}
+
+############################################
+# Validate and swap in a restored shadow database
+# Usage: restore_shadow_finish <db> <into> <restore_exit_code>
+# A failed restore or validation drops the shadow and leaves <db> as it
+# was. Does nothing when <into> is <db>.
+############################################
+restore_shadow_finish() {
+  local db="$1"
+  local into="$2"
+  local rc="$3"
+
+  [[ "${into}" != "${db}" ]] || return "${rc}"
+
+  if (( rc == 0 )) && [[ -n "${RESTORE_VALIDATION_QUERY:-}" ]]; then
+    metrics_begin
+    restore_shadow_validate "${into}" || rc=$?
+    metrics_end "${db}" validate 0 0 "${rc}"
+  fi
+
+  if (( rc != 0 )); then
+    restore_shadowlog "ERROR: Restore into ${into} failed, ${db} is left untouched"
+    restore_shadow_drop "${into}"
+    return "${rc}"
+  fi
+
+  retry 3 restore_shadow_swap "${db}" "${into}" || rc=$?
+
+  if (( rc != 0 )); then
+    restore_shadowlog "ERROR: Unable to swap ${into} in for ${db}, ${db} is left untouched"
+    restore_shadow_drop "${into}"
+    return "${rc}"
+  fi
+
+  restore_shadow_expire
+}
+
+############################################
+# Run RESTORE_VALIDATION_QUERY against a shadow database
+# Fails when the query errors, returns no row, or its first value is
+# false, 0 or empty.
+############################################
+restore_shadow_validate() {
+  local into="$1"
+  local result
+
+  restore_shadowlog "Validating ${into}"
+  validate_postgres_pass
+  result="$(psql ${PG_CONN_PARAMETERS} -d "${into}" -At -v ON_ERROR_STOP=1 \
+    -c "${RESTORE_VALIDATION_QUERY}" | head -n 1 | cut -d '|' -f 1)" || {
+    restore_shadowlog "ERROR: Validation query failed on ${into}"
+    return 1
+  }
+
+  if [[ -z "${result}" || "${result}" =~ ^(f|false|0)$ ]]; then
+    restore_shadowlog "ERROR: Validation query returned '${result}' on ${into}"
+    return 1
+  fi
+
+  restore_shadowlog "Validation passed on ${into} (${result})"
+}
+
+############################################
+# Rename the shadow over the target
+# Usage: restore_shadow_swap <db> <into>
+# New connections to <db> are refused and existing ones terminated, then
+# both renames commit together. On failure <db> accepts connections
+# again and keeps its name; sessions still exiting make the rename fail,
+# so the caller retries.
+############################################
+restore_shadow_swap() {
+  local db="$1"
+  local into="$2"
+  local old
+  local timeout="${RESTORE_SWAP_LOCK_TIMEOUT:-10}"
+  local started="${EPOCHREALTIME/,/.}"
+  local rc=0
+
+  old="$(restore_shadow_prefix "${db}" 47)__old_${EPOCHSECONDS}"
+
+  validate_postgres_pass
+  restore_shadowlog "Swapping ${into} in for ${db}"
+
+  # Each attempt is timed on its own, retries wait with <db> online
+  metrics_begin
+  psql ${PG_CONN_PARAMETERS} -d postgres -v ON_ERROR_STOP=1 -q \
+    -v db="${db}" -v into="${into}" -v old="${old}" -v timeout="${timeout}s" \
+    -v marker="$(restore_shadow_marker)" <<'SQL' || rc=$?
+SELECT EXISTS (SELECT 1 FROM pg_database WHERE datname = :'db') AS has_target \gset
+SET lock_timeout = :'timeout';
+SET statement_timeout = :'timeout';
+\if :has_target
+ALTER DATABASE :"db" WITH ALLOW_CONNECTIONS false;
+SELECT count(pg_terminate_backend(pid)) AS terminated FROM pg_stat_activity
+ WHERE datname = :'db' AND pid <> pg_backend_pid() \gset
+BEGIN;
+ALTER DATABASE :"db" RENAME TO :"old";
+ALTER DATABASE :"into" RENAME TO :"db";
+ALTER DATABASE :"old" WITH ALLOW_CONNECTIONS true;
+COMMENT ON DATABASE :"old" IS :'marker';
+COMMIT;
+\else
+ALTER DATABASE :"into" RENAME TO :"db";
+\endif
+SQL
+
+  if (( rc != 0 )); then
+    psql ${PG_CONN_PARAMETERS} -d postgres -q -v db="${db}" >/dev/null 2>&1 <<'SQL' || true
+SELECT EXISTS (SELECT 1 FROM pg_database WHERE datname = :'db') AS has_target \gset
+\if :has_target
+ALTER DATABASE :"db" WITH ALLOW_CONNECTIONS true;
+\endif
+SQL
+    metrics_end "${db}" swap 0 0 "${rc}"
+    return "${rc}"
+  fi
+  metrics_end "${db}" swap 0 0 success
+
+  restore_shadowlog "Swapped ${into} in for ${db} in $(awk -v s="${started}" -v e="${EPOCHREALTIME/,/.}" 'BEGIN { printf "%.3f", e - s }')s, previous copy kept as ${old}"
+}
+
+restore_shadow_drop() {
+  validate_postgres_pass
+  dropdb ${PG_CONN_PARAMETERS} --if-exists --force "$1" || true
+}
+
+############################################
+# Drop previous copies older than RESTORE_KEEP_OLD_HOURS
+# Only databases carrying restore_shadow_marker are considered, other
+# names that happen to end in __old_<epoch> are left alone.
+############################################
+restore_shadow_expire() {
+  local cutoff=$(( EPOCHSECONDS - ${RESTORE_KEEP_OLD_HOURS:-24} * 3600 ))
+  local name
+
+  validate_postgres_pass
+  while read -r name; do
+    [[ -n "${name}" ]] || continue
+    (( ${name##*__old_} <= cutoff )) || continue
+    restore_shadowlog "Dropping previous copy ${name}"
+    dropdb ${PG_CONN_PARAMETERS} --if-exists --force "${name}" \
+      || restore_shadowlog "WARNING: Unable to drop ${name}"
+  done < <(psql ${PG_CONN_PARAMETERS} -d postgres -At \
+    -v marker="$(restore_shadow_marker)" 2>/dev/null <<'SQL' || true
+SELECT datname FROM pg_database
+ WHERE datname ~ '__old_[0-9]{10}$'
+   AND shobj_description(oid, 'pg_database') = :'marker';
+SQL
+  )
+}
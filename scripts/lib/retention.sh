@@ -25,7 +25,10 @@ run_retention() {
   retention_log \
     "REMOVE_BEFORE=${REMOVE_BEFORE}d MIN_SAVED_FILE=${MIN_SAVED_FILE} CONSOLIDATE_AFTER=${CONSOLIDATE_AFTER}d"
 
-
+  local started="${SECONDS}"
+  RETENTION_DELETED_COUNT=0
+  RETENTION_FREED_BYTES=0
+  metrics_begin
 
   if [[ "${STORAGE_BACKEND}" == 'S3' ]]; then
 
@@ -34,7 +37,12 @@ run_retention() {
     run_local_retention
   fi
 
-  retention_log "Retention finished"
+  local verb="Deleted"
+  [[ "${CLEANUP_DRY_RUN:-false}" == "true" ]] && verb="[DRY-RUN] Would delete"
+  retention_log \
+    "Retention finished: ${verb} ${RETENTION_DELETED_COUNT} objects, ${RETENTION_FREED_BYTES} bytes in $(( SECONDS - started ))s"
+  # Freed bytes are reported as the phase input
+  metrics_end "" retention "${RETENTION_FREED_BYTES}" 0
 }
 
 ############################################
@@ -43,6 +51,10 @@ run_retention() {
 run_local_retention() {
   (( CONSOLIDATE_AFTER > 0 )) && consolidate_backups
   expire_old_backups
+
+  [[ "${CLEANUP_DRY_RUN:-false}" == "true" ]] || catalog_prune_missing
+  chunk_gc
+  wal_retention
 }
 
 ############################################
@@ -57,6 +69,8 @@ consolidate_backups() {
     find "${MYBASEDIR}" -type f \
       -mmin "+${consolidate_minutes}" \
       ! -name "globals.sql" \
+      ! -path "${MYBASEDIR}/.fingerprints/*" ! -name "catalog.jsonl*" \
+      ! -path "${MYBASEDIR}/chunks/*" ! -path "${MYBASEDIR}/wal/*" ! -path "$(wal_spool_dir)/*" \
       -printf "%T@ %p\n" | sort -n
   )
 
@@ -92,11 +106,15 @@ expire_old_backups() {
 
   mapfile -t all_files < <(
     find "${MYBASEDIR}" -type f ! -name "globals.sql" \
+      ! -path "${MYBASEDIR}/.fingerprints/*" ! -name "catalog.jsonl*" \
+      ! -path "${MYBASEDIR}/chunks/*" ! -path "${MYBASEDIR}/wal/*" ! -path "$(wal_spool_dir)/*" \
       -printf "%T@ %p\n" | sort -nr | cut -d' ' -f2-
   )
 
   mapfile -t old_files < <(
     find "${MYBASEDIR}" -type f ! -name "globals.sql" \
+      ! -path "${MYBASEDIR}/.fingerprints/*" ! -name "catalog.jsonl*" \
+      ! -path "${MYBASEDIR}/chunks/*" ! -path "${MYBASEDIR}/wal/*" ! -path "$(wal_spool_dir)/*" \
       -mmin "+${minutes}" \
       -printf "%T@ %p\n" | sort -n | cut -d' ' -f2-
   )
@@ -124,6 +142,9 @@ delete_file() {
   local file="$1"
   local reason="$2"
 
+  RETENTION_DELETED_COUNT=$(( ${RETENTION_DELETED_COUNT:-0} + 1 ))
+  RETENTION_FREED_BYTES=$(( ${RETENTION_FREED_BYTES:-0} + $(stat -c %s "${file}" 2>/dev/null || echo 0) ))
+
   if [[ "${CLEANUP_DRY_RUN:-false}" == "true" ]]; then
     retention_log "[DRY-RUN] Would delete ${file} (${reason})"
   else
@@ -150,81 +171,100 @@ run_s3_retention() {
     return 0
   fi
 
+  # Backups the catalog misses would never expire
+  catalog_reconcile
+
   s3_expire_objects
 
   if (( CONSOLIDATE_AFTER > 0 )); then
     s3_consolidate_objects
   fi
+
+  chunk_gc
+  wal_retention
 }
 
 ############################################
-# S3 expiry
+# S3 expiry (catalog lookup)
 ############################################
 s3_expire_objects() {
-  local cutoff
-  cutoff=$(date -d "${REMOVE_BEFORE} days ago" +%s)
+  local cutoff expired
+  cutoff="$(date -d "${REMOVE_BEFORE} days ago" +%Y-%m-%dT%H:%M)"
 
   retention_log "Expiring S3 backups older than ${REMOVE_BEFORE} days"
 
-  while read -r _ _ _ path; do
-    [[ -z "${path:-}" || "$path" == *"globals.sql"* ]] && continue
-
-    fname="$(basename "$path")"
-    ts=$(extract_ts_from_filename "$fname")
-
-    (( ts == 0 || ts >= cutoff )) && continue
-
-    if [[ "${CLEANUP_DRY_RUN:-false}" == "true" ]]; then
-      retention_log "[DRY-RUN] Would delete S3 object ${path}"
-    else
-      retention_log "Deleting S3 object ${path} (expiry)"
-      s3cmd del "${path}"
-    fi
-  done < <(s3cmd ls "s3://${BUCKET}" --recursive || true)
+  expired="$(mktemp /tmp/retention-expired.XXXXXX)"
+  catalog_expired_objects "${cutoff}" "${MIN_SAVED_FILE:-0}" > "${expired}"
+  s3_delete_objects "${expired}" "expiry"
+  rm -f "${expired}"
 }
 
 ############################################
-# S3 consolidation
+# S3 consolidation (catalog lookup)
 ############################################
 s3_consolidate_objects() {
-  local cutoff
-  cutoff=$(date -d "${CONSOLIDATE_AFTER} days ago" +%s)
+  local cutoff consolidated
+  cutoff="$(date -d "${CONSOLIDATE_AFTER} days ago" +%Y-%m-%dT%H:%M)"
 
   retention_log "Consolidating S3 backups older than ${CONSOLIDATE_AFTER} days"
 
-  declare -A keep_map
+  consolidated="$(mktemp /tmp/retention-consolidated.XXXXXX)"
+  catalog_consolidated_objects "${cutoff}" "${MIN_SAVED_FILE:-0}" > "${consolidated}"
+  s3_delete_objects "${consolidated}" "consolidation"
+  rm -f "${consolidated}"
+}
 
-  # First pass: decide what to keep
-  while read -r _ date _ path; do
-    [[ -z "${path}" || "$path" == *"globals.sql"* ]] && continue
+############################################
+# Delete S3 objects and their catalog records
+# Usage: s3_delete_objects <selection_file> <reason>
+# <selection_file> holds "<size>\t<key>" lines. Keys are sent to the
+# endpoint as multi-object delete requests (up to 1000 keys each); keys
+# a batch could not remove are retried one by one with s3cmd del.
+############################################
+s3_delete_objects() {
+  local selection="$1"
+  local reason="$2"
+  local count bytes deleted key
 
-    ts=$(date -d "${date}" +%s 2>/dev/null || echo 0)
-    (( ts == 0 || ts >= cutoff )) && continue
+  count="$(wc -l < "${selection}")"
+  if (( count == 0 )); then
+    retention_log "No S3 objects to delete (${reason})"
+    return 0
+  fi
 
-    fname="$(basename "${path}")"
-    key="$(sed -n 's/\(.*\)-[0-9]\{2\}-[0-9]\{2\}\.\(dmp\|sql\|gz\).*/\1/p' <<< "${fname}")"
-    [[ -z "${key}" || -n "${keep_map[$key]:-}" ]] && continue
+  if [[ "${CLEANUP_DRY_RUN:-false}" == "true" ]]; then
+    while IFS=$'\t' read -r _ key; do
+      retention_log "[DRY-RUN] Would delete S3 object s3://${BUCKET}/${key} (${reason})"
+    done < "${selection}"
+    bytes="$(awk -F'\t' '{ s += $1 } END { print s + 0 }' "${selection}")"
+    RETENTION_DELETED_COUNT=$(( RETENTION_DELETED_COUNT + count ))
+    RETENTION_FREED_BYTES=$(( RETENTION_FREED_BYTES + bytes ))
+    return 0
+  fi
 
-    keep_map["$key"]="${path}"
-  done < <(s3cmd ls "s3://${BUCKET}" --recursive | sort || true)
+  retention_log "Deleting ${count} S3 objects (${reason})"
 
-  # Second pass: delete everything else
-  while read -r _ date _ path; do
-    [[ -z "${path}" || "$path" == *"globals.sql"* ]] && continue
+  deleted="$(mktemp /tmp/retention-deleted.XXXXXX)"
+  cut -f2- "${selection}" \
+    | python3 "${LIB_DIR}/tools/s3_batch_delete.py" "${BUCKET}" > "${deleted}" \
+    || retention_log "WARNING: Batch delete did not remove every object, retrying one by one"
 
-    ts=$(date -d "${date}" +%s 2>/dev/null || echo 0)
-    (( ts == 0 || ts >= cutoff )) && continue
+  # Endpoints without multi-object delete support end up here as well
+  while read -r key; do
+    if s3cmd del "s3://${BUCKET}/${key}" >/dev/null; then
+      printf '%s\n' "${key}" >> "${deleted}"
+    else
+      retention_log "ERROR: Failed to delete S3 object s3://${BUCKET}/${key}"
+    fi
+  done < <(awk -F'\t' 'FILENAME == ARGV[1] { done[$0] = 1; next } !($2 in done) { print $2 }' "${deleted}" "${selection}")
 
-    fname="$(basename "${path}")"
-    key="$(sed -n 's/\(.*\)-[0-9]\{2\}-[0-9]\{2\}\.\(dmp\|sql\|gz\).*/\1/p' <<< "${fname}")"
+  count="$(wc -l < "${deleted}")"
+  bytes="$(awk -F'\t' 'FILENAME == ARGV[1] { done[$0] = 1; next } ($2 in done) { s += $1 } END { print s + 0 }' "${deleted}" "${selection}")"
+  RETENTION_DELETED_COUNT=$(( RETENTION_DELETED_COUNT + count ))
+  RETENTION_FREED_BYTES=$(( RETENTION_FREED_BYTES + bytes ))
 
-    [[ -z "${key}" || "${keep_map[$key]:-}" == "${path}" ]] && continue
+  retention_log "Deleted ${count} S3 objects, ${bytes} bytes (${reason})"
 
-    if [[ "${CLEANUP_DRY_RUN:-false}" == "true" ]]; then
-      retention_log "[DRY-RUN] Would delete S3 object ${path} (consolidation)"
-    else
-      retention_log "Deleting S3 object ${path} (consolidation)"
-      s3cmd del "${path}"
-    fi
-  done < <(s3cmd ls "s3://${BUCKET}" --recursive || true)
-}
\ No newline at end of file
+  catalog_remove "${deleted}"
+  rm -f "${deleted}"
+}
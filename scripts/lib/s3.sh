@@ -40,6 +40,45 @@ s3_init() {
 
 
 
+############################################
+# Map a local artifact path to its S3 key
+# Usage: s3_object_key <local_path>
+############################################
+s3_object_key() {
+  local path="${1#/}"
+  echo "${path#${BUCKET}/}"
+}
+
+############################################
+# Parallel multipart transfers
+# Usage: s3_transfer upload <file|-> <s3_uri>
+#        s3_transfer download <s3_uri> <file|->
+#        s3_transfer abort-stale <s3://bucket> <hours>
+# Parts of S3_PART_SIZE_MB move S3_TRANSFER_CONCURRENCY at a time and
+# are retried individually. File transfers keep resume state next to
+# the file, so running the same transfer again picks up where it failed.
+############################################
+s3_transfer() {
+  python3 "${LIB_DIR}/tools/s3_transfer.py" "$@"
+}
+
+############################################
+# Abort multipart uploads left behind by interrupted runs
+############################################
+s3_abort_stale_uploads() {
+  local hours="${S3_ABORT_INCOMPLETE_HOURS:-24}"
+  local aborted
+
+  (( hours > 0 )) || return 0
+
+  if aborted="$(s3_transfer abort-stale "s3://${BUCKET}" "${hours}")"; then
+    [[ -n "${aborted}" ]] && s3_log "Aborted $(wc -l <<< "${aborted}") incomplete multipart uploads older than ${hours}h"
+  else
+    s3_log "WARNING: Unable to clean up incomplete multipart uploads"
+  fi
+  return 0
+}
+
 s3_upload() {
   s3_log "Initializing S3 uploads"
 
@@ -51,21 +90,36 @@ s3_upload() {
   }
 
   # Normalize path → S3 key
-  local path="${gz_file#/}"
-  local gz_key="${path#${BUCKET}/}"
-  local checksum_file="${gz_file}.sha256"
-  local checksum_key="${gz_key}.sha256"
-  local metadata_file="${gz_file}.meta.json"
-  local metadata_key="${gz_key}.meta.json"
+  local gz_key
+  gz_key="$(s3_object_key "${gz_file}")"
 
   s3_log "Uploading $(basename "${gz_file}") to s3://${BUCKET}/${gz_key}"
 
   # Upload gzip
-  if ! retry 3 s3cmd put "${gz_file}" "s3://${BUCKET}/${gz_key}"; then
+  if ! retry 3 s3_transfer upload "${gz_file}" "s3://${BUCKET}/${gz_key}"; then
     s3_log "ERROR: Failed to upload ${gz_file}"
     return 1
   fi
 
+  s3_upload_sidecars "${gz_file}" || return 1
+
+  s3_log "S3 uploads completed"
+}
+
+############################################
+# Upload .meta.json, .sha256, .manifest.json and .index.json sidecars
+# Usage: s3_upload_sidecars <artifact>
+############################################
+s3_upload_sidecars() {
+  local artifact="$1"
+  local key
+  key="$(s3_object_key "${artifact}")"
+
+  local checksum_file="${artifact}.sha256"
+  local checksum_key="${key}.sha256"
+  local metadata_file="${artifact}.meta.json"
+  local metadata_key="${key}.meta.json"
+
    # Upload metadata file
   if ! retry 3 s3cmd put "${metadata_file}" "s3://${BUCKET}/${metadata_key}"; then
     s3_log "ERROR: Failed to upload ${metadata_file}"
@@ -84,6 +138,62 @@ s3_upload() {
     fi
   fi
 
-  s3_log "S3 uploads completed"
+  # Chunk manifest, referenced from the metadata
+  if [[ -f "${artifact}.manifest.json" ]]; then
+    if ! retry 3 s3cmd put "${artifact}.manifest.json" "s3://${BUCKET}/${key}.manifest.json"; then
+      s3_log "ERROR: Failed to upload ${artifact}.manifest.json"
+      return 1
+    fi
+  fi
+
+  # Block index of a seekable archive (see seekable.sh)
+  if [[ -f "${artifact}.index.json" ]]; then
+    if ! retry 3 s3cmd put "${artifact}.index.json" "s3://${BUCKET}/${key}.index.json"; then
+      s3_log "ERROR: Failed to upload ${artifact}.index.json"
+      return 1
+    fi
+  fi
 }
 
+############################################
+# Streaming upload (no local staging)
+# Usage: <producer> | s3_stream_upload <artifact>
+# Uploads stdin as the S3 object for <artifact>. When checksum
+# validation is enabled the same stream is hashed on the way through
+# into <artifact>.sha256 and a chunk manifest for the metadata.
+# Sidecars are uploaded separately once the stream is complete (see
+# s3_upload_sidecars).
+############################################
+s3_stream_upload() {
+  local artifact="$1"
+  local key
+  key="$(s3_object_key "${artifact}")"
+
+  s3_log "Streaming $(basename "${artifact}") to s3://${BUCKET}/${key}"
+
+  if [[ ! "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    s3_transfer upload - "s3://${BUCKET}/${key}"
+    return
+  fi
+
+  local workdir hash_pid
+  local rc=0
+  workdir="$(mktemp -d /tmp/s3-stream.XXXXXX)"
+  mkfifo "${workdir}/hash.fifo"
+
+  python3 "${LIB_DIR}/tools/hash_manifest.py" create - \
+    < "${workdir}/hash.fifo" > "${artifact}.manifest.json" &
+  hash_pid=$!
+
+  tee "${workdir}/hash.fifo" | s3_transfer upload - "s3://${BUCKET}/${key}" || rc=$?
+  wait "${hash_pid}" || rc=$?
+
+  if (( rc == 0 )); then
+    write_checksum_sidecar "${artifact}"
+  else
+    rm -f "${artifact}.manifest.json"
+  fi
+
+  rm -rf "${workdir}"
+  return "${rc}"
+}
@@ -0,0 +1,349 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+scheduler_log() {
+  log "[SCHEDULER] $*"
+}
+
+############################################
+# Cron expression matching
+# Usage: cron_matches <expression> <epoch>
+# Supports the five standard fields with *, lists, ranges and steps,
+# month and weekday names (JAN-DEC, SUN-SAT, any case), and the
+# @hourly, @daily, @weekly, @monthly and @yearly macros. As in cron, a
+# day matches either the day of month or the day of week when neither
+# field starts with "*". Returns 2 for an invalid expression.
+############################################
+cron_matches() {
+  local expression="$1"
+  local epoch="$2"
+  local fields minute hour dom month dow
+
+  case "${expression}" in
+    @hourly) expression="0 * * * *" ;;
+    @daily|@midnight) expression="0 0 * * *" ;;
+    @weekly) expression="0 0 * * 0" ;;
+    @monthly) expression="0 0 1 * *" ;;
+    @yearly|@annually) expression="0 0 1 1 *" ;;
+  esac
+
+  read -ra fields <<< "${expression}"
+  (( ${#fields[@]} == 5 )) || return 2
+  fields[3]="$(cron_field_names "${fields[3]}" 1 jan feb mar apr may jun jul aug sep oct nov dec)"
+  fields[4]="$(cron_field_names "${fields[4]}" 0 sun mon tue wed thu fri sat)"
+
+  read -r minute hour dom month dow < <(date -d "@${epoch}" '+%M %H %d %m %w')
+
+  local rc=0
+  cron_field_matches "${fields[0]}" "${minute}" 0 59 || rc=$?
+  (( rc == 0 )) || return "${rc}"
+  cron_field_matches "${fields[1]}" "${hour}" 0 23 || rc=$?
+  (( rc == 0 )) || return "${rc}"
+  cron_field_matches "${fields[3]}" "${month}" 1 12 || rc=$?
+  (( rc == 0 )) || return "${rc}"
+
+  local dom_rc=0 dow_rc=0
+  cron_field_matches "${fields[2]}" "${dom}" 1 31 || dom_rc=$?
+  cron_field_matches "${fields[4]}" "${dow}" 0 7 || dow_rc=$?
+  # Sunday is both 0 and 7
+  if (( dow_rc == 1 && dow == 0 )); then
+    dow_rc=0
+    cron_field_matches "${fields[4]}" 7 0 7 || dow_rc=$?
+  fi
+  (( dom_rc == 2 || dow_rc == 2 )) && return 2
+
+  # A field starting with "*" (such as "*/2") counts as unrestricted
+  if [[ "${fields[2]}" != \** && "${fields[4]}" != \** ]]; then
+    (( dom_rc == 0 || dow_rc == 0 ))
+  else
+    (( dom_rc == 0 && dow_rc == 0 ))
+  fi
+}
+
+############################################
+# Replace month or weekday names in a cron field by their numbers
+# Usage: cron_field_names <field> <first number> <name>...
+############################################
+cron_field_names() {
+  local field="${1,,}"
+  local number="$2"
+  local name
+  shift 2
+
+  for name in "$@"; do
+    field="${field//${name}/${number}}"
+    number=$(( number + 1 ))
+  done
+  echo "${field}"
+}
+
+############################################
+# Match one cron field
+# Usage: cron_field_matches <field> <value> <min> <max>
+############################################
+cron_field_matches() {
+  local field="$1"
+  local value=$(( 10#$2 ))
+  local min="$3"
+  local max="$4"
+  local parts part range step lo hi
+
+  IFS=',' read -ra parts <<< "${field}"
+  (( ${#parts[@]} > 0 )) || return 2
+
+  for part in "${parts[@]}"; do
+    range="${part%%/*}"
+    step=1
+    [[ "${part}" == */* ]] && step="${part#*/}"
+
+    if [[ "${range}" == "*" ]]; then
+      lo="${min}"
+      hi="${max}"
+    elif [[ "${range}" == *-* ]]; then
+      lo="${range%-*}"
+      hi="${range#*-}"
+    else
+      lo="${range}"
+      # "5/15" runs from 5 to the end of the range
+      [[ "${part}" == */* ]] && hi="${max}" || hi="${range}"
+    fi
+
+    [[ "${lo}" =~ ^[0-9]+$ && "${hi}" =~ ^[0-9]+$ && "${step}" =~ ^[0-9]+$ ]] || return 2
+    lo=$(( 10#${lo} ))
+    hi=$(( 10#${hi} ))
+    step=$(( 10#${step} ))
+    (( step > 0 && lo >= min && hi <= max && lo <= hi )) || return 2
+
+    if (( value >= lo && value <= hi && (value - lo) % step == 0 )); then
+      return 0
+    fi
+  done
+
+  return 1
+}
+
+############################################
+# Load the schedules
+# Each schedule is a cron expression followed by the databases it backs
+# up, comma separated. No databases (or "*") means every database.
+# Schedules come from ${EXTRA_CONF_DIR}/backup-schedules (one per line,
+# # comments allowed), else BACKUP_SCHEDULES (separated by ";" or new
+# lines), else CRON_SCHEDULE for every database.
+############################################
+scheduler_load() {
+  local source lines line fields expression targets rc
+
+  SCHEDULE_EXPRESSIONS=()
+  SCHEDULE_TARGETS=()
+
+  if [[ -f "${EXTRA_CONF_DIR:-}/backup-schedules" ]]; then
+    source="${EXTRA_CONF_DIR}/backup-schedules"
+    mapfile -t lines < "${source}"
+  elif [[ -n "${BACKUP_SCHEDULES:-}" ]]; then
+    source="BACKUP_SCHEDULES"
+    mapfile -t lines <<< "${BACKUP_SCHEDULES//;/$'\n'}"
+  else
+    source="CRON_SCHEDULE"
+    lines=("${CRON_SCHEDULE:-0 23 * * *}")
+  fi
+
+  for line in "${lines[@]}"; do
+    line="${line%%#*}"
+    read -ra fields <<< "${line}"
+    (( ${#fields[@]} > 0 )) || continue
+
+    if [[ "${fields[0]}" == @* ]]; then
+      expression="${fields[0]}"
+      targets="${fields[*]:1}"
+    else
+      expression="${fields[*]:0:5}"
+      targets="${fields[*]:5}"
+    fi
+
+    rc=0
+    cron_matches "${expression}" "${EPOCHSECONDS}" || rc=$?
+    if (( rc == 2 )); then
+      scheduler_log "ERROR: Invalid schedule '${line}' in ${source}"
+      return 1
+    fi
+
+    [[ -n "${targets}" ]] || targets="*"
+    SCHEDULE_EXPRESSIONS+=("${expression}")
+    SCHEDULE_TARGETS+=("${targets}")
+    if [[ "${targets}" == "*" ]]; then
+      scheduler_log "Schedule ${#SCHEDULE_EXPRESSIONS[@]}: '${expression}' for all databases"
+    else
+      scheduler_log "Schedule ${#SCHEDULE_EXPRESSIONS[@]}: '${expression}' for ${targets}"
+    fi
+  done
+
+  if (( ${#SCHEDULE_EXPRESSIONS[@]} == 0 )); then
+    scheduler_log "ERROR: No schedules in ${source}"
+    return 1
+  fi
+}
+
+############################################
+# Run setup once and keep it for later runs
+# Sets SCHEDULER_WARM, which backups.sh reads to skip its own setup.
+############################################
+scheduler_warm_up() {
+  SCHEDULER_WARM=false
+  SCHEDULER_DBLIST=""
+  SCHEDULER_DBLIST_LOADED=0
+
+  check_db_ready || return 1
+  if [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ ]]; then
+    s3_init || return 1
+  fi
+
+  SCHEDULER_WARM=true
+  scheduler_log "Setup done, later runs reuse it"
+}
+
+############################################
+# Databases of a schedule, space separated
+# Usage: scheduler_databases <targets>
+# The list of all databases is cached for SCHEDULER_REFRESH_MINUTES.
+############################################
+scheduler_databases() {
+  local targets="$1"
+
+  if [[ "${targets}" != "*" ]]; then
+    echo "${targets//,/ }"
+    return 0
+  fi
+
+  if [[ -n "${DBLIST:-}" ]]; then
+    echo "${DBLIST}"
+    return 0
+  fi
+
+  if (( EPOCHSECONDS - SCHEDULER_DBLIST_LOADED >= ${SCHEDULER_REFRESH_MINUTES:-60} * 60 )) \
+      || [[ -z "${SCHEDULER_DBLIST}" ]]; then
+    SCHEDULER_DBLIST="$(discover_databases | xargs)"
+    SCHEDULER_DBLIST_LOADED="${EPOCHSECONDS}"
+  fi
+  echo "${SCHEDULER_DBLIST}"
+}
+
+############################################
+# Job queue
+# A schedule is queued when its expression matches, SCHEDULER_JITTER_SECONDS
+# at most after the minute. Jobs run one at a time in queue order, and a
+# schedule that is still queued or running is not queued again, so a slow
+# run delays or skips the next one instead of overlapping it.
+############################################
+scheduler_enqueue() {
+  local index="$1"
+  local queued
+
+  if [[ "${SCHEDULER_RUNNING_INDEX:-}" == "${index}" ]]; then
+    scheduler_log "Schedule $(( index + 1 )) is still running, skipping this run"
+    return 0
+  fi
+  for queued in "${SCHEDULER_QUEUE[@]}"; do
+    if [[ "${queued}" == "${index}" ]]; then
+      scheduler_log "Schedule $(( index + 1 )) is already queued, skipping this run"
+      return 0
+    fi
+  done
+
+  SCHEDULER_QUEUE+=("${index}")
+  SCHEDULER_DUE+=("$(( EPOCHSECONDS + RANDOM % (${SCHEDULER_JITTER_SECONDS:-0} + 1) ))")
+}
+
+scheduler_dispatch() {
+  [[ -z "${SCHEDULER_RUNNING_PID:-}" ]] || return 0
+
+  local position
+  for position in "${!SCHEDULER_QUEUE[@]}"; do
+    if (( SCHEDULER_DUE[position] <= EPOCHSECONDS )); then
+      scheduler_run "${SCHEDULER_QUEUE[position]}"
+      SCHEDULER_QUEUE=("${SCHEDULER_QUEUE[@]:0:position}" "${SCHEDULER_QUEUE[@]:position+1}")
+      SCHEDULER_DUE=("${SCHEDULER_DUE[@]:0:position}" "${SCHEDULER_DUE[@]:position+1}")
+      return 0
+    fi
+  done
+}
+
+scheduler_run() {
+  local index="$1"
+  local databases
+
+  if ! databases="$(scheduler_databases "${SCHEDULE_TARGETS[index]}")" || [[ -z "${databases}" ]]; then
+    scheduler_log "ERROR: No databases to back up for schedule $(( index + 1 ))"
+    return 0
+  fi
+
+  scheduler_log "Starting schedule $(( index + 1 )) for ${databases}"
+  DBLIST="${databases}" SCHEDULER_WARM="${SCHEDULER_WARM}" \
+    /bin/bash "${SCRIPT_DIR}/backups.sh" &
+  SCHEDULER_RUNNING_PID=$!
+  SCHEDULER_RUNNING_INDEX="${index}"
+  SCHEDULER_RUNNING_STARTED="${EPOCHSECONDS}"
+}
+
+############################################
+# Collect the running job once it has exited
+# A failed run redoes the setup on the next run, in case the database or
+# the bucket is what failed.
+############################################
+scheduler_reap() {
+  [[ -n "${SCHEDULER_RUNNING_PID:-}" ]] || return 0
+  kill -0 "${SCHEDULER_RUNNING_PID}" 2>/dev/null && return 0
+
+  local rc=0
+  wait "${SCHEDULER_RUNNING_PID}" || rc=$?
+
+  if (( rc == 0 )); then
+    scheduler_log "Schedule $(( SCHEDULER_RUNNING_INDEX + 1 )) finished in $(( EPOCHSECONDS - SCHEDULER_RUNNING_STARTED ))s"
+    SCHEDULER_WARM=true
+  else
+    scheduler_log "ERROR: Schedule $(( SCHEDULER_RUNNING_INDEX + 1 )) failed with exit code ${rc}"
+    SCHEDULER_WARM=false
+    SCHEDULER_DBLIST=""
+  fi
+
+  SCHEDULER_RUNNING_PID=""
+  SCHEDULER_RUNNING_INDEX=""
+}
+
+############################################
+# Main loop
+# Usage: scheduler_loop
+############################################
+scheduler_loop() {
+  local last_minute=$(( EPOCHSECONDS / 60 ))
+  local minute index
+
+  SCHEDULER_QUEUE=()
+  SCHEDULER_DUE=()
+  SCHEDULER_RUNNING_PID=""
+  SCHEDULER_RUNNING_INDEX=""
+
+  while true; do
+    # Catch up on minutes missed while the host was suspended, at most an hour
+    if (( EPOCHSECONDS / 60 - last_minute > 60 )); then
+      last_minute=$(( EPOCHSECONDS / 60 - 60 ))
+    fi
+    for (( minute = last_minute + 1; minute <= EPOCHSECONDS / 60; minute++ )); do
+      for index in "${!SCHEDULE_EXPRESSIONS[@]}"; do
+        if cron_matches "${SCHEDULE_EXPRESSIONS[index]}" "$(( minute * 60 ))"; then
+          scheduler_enqueue "${index}"
+        fi
+      done
+      last_minute="${minute}"
+    done
+
+    scheduler_reap
+    scheduler_dispatch
+
+    # Waiting on a background sleep lets SIGTERM interrupt it right away
+    sleep 1 &
+    wait $! || true
+  done
+}
@@ -0,0 +1,103 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+seekable_log() {
+  log "[Seekable] $*"
+}
+
+seekable_archive() {
+  python3 "${LIB_DIR}/tools/seekable_archive.py" "$@"
+}
+
+############################################
+# Seekable archives
+# A compressed dump can only be read from the start, so restoring one
+# table from S3 means downloading the whole archive. With
+# SEEKABLE_ARCHIVES, custom-format dumps uploaded to S3 are compressed
+# in independent blocks of SEEKABLE_BLOCK_MB. An <archive>.index.json
+# sidecar maps every block, and the data of every TOC entry, to byte
+# ranges (see tools/seekable_archive.py). The archive stays a regular
+# .dmp.gz/.dmp.zst. A restore whose RESTORE_ARGS selects tables,
+# schemas or a TOC list (-t, -n, -L) then fetches only the blocks it
+# needs with ranged GETs and streams them into pg_restore.
+############################################
+seekable_enabled() {
+  [[ "${SEEKABLE_ARCHIVES:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]] || return 1
+
+  # The whole encrypted stream would have to be decrypted from the start
+  if [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    seekable_log "WARNING: SEEKABLE_ARCHIVES does not apply to encrypted dumps"
+    return 1
+  fi
+}
+
+############################################
+# Compress a custom-format dump into a seekable archive
+# Usage: seekable_compress <codec> <dump> <archive>
+# Writes <archive> and <archive>.index.json. With codec none the dump
+# is the archive and is only indexed. A dump that cannot be indexed is
+# stored as a regular archive.
+############################################
+seekable_compress() {
+  local codec="$1"
+  local dump="$2"
+  local archive="$3"
+  local index="${archive}.index.json"
+
+  if [[ "${codec}" == "none" ]]; then
+    seekable_archive build "${dump}" "${index}" && return 0
+  else
+    # shellcheck disable=SC2046
+    seekable_archive build "${dump}" "${index}" "${archive}" $(compression_command "${codec}") && return 0
+  fi
+
+  seekable_log "WARNING: Unable to index $(basename "${dump}"), storing a regular archive"
+  rm -f "${index}"
+  [[ "${codec}" == "none" ]] && return 0
+  compress_stream "${codec}" < "${dump}" > "${archive}"
+}
+
+############################################
+# Does a restore only need part of a seekable archive?
+# Usage: seekable_restore_wanted <meta_file>
+# Sliced tables are loaded outside pg_restore, so those archives are
+# always restored whole.
+############################################
+seekable_restore_wanted() {
+  local meta="$1"
+
+  [[ " ${RESTORE_ARGS:-}" =~ [[:space:]](-[tnL]|--(table|schema|use-list)([=[:space:]]|$)) ]] || return 1
+  jq -e '.seekable and (.slices | not) and (.encrypted != true)' "${meta}" >/dev/null 2>&1
+}
+
+############################################
+# Stream the selected part of a seekable archive
+# Usage: seekable_extract <archive> <index> <codec>
+# <archive> is a path or an s3:// URI. pg_restore picks the TOC entries
+# that RESTORE_ARGS selects, and only their data is read and written to
+# stdout, after the archive's header and TOC.
+############################################
+seekable_extract() {
+  local archive="$1"
+  local index="$2"
+  local codec="$3"
+  local list rc=0
+
+  list="$(mktemp /tmp/seekable-list.XXXXXX)"
+
+  # shellcheck disable=SC2086
+  seekable_archive extract "${archive}" "${index}" /dev/null $(decompression_command "${codec}") \
+    | pg_restore -l ${RESTORE_ARGS} > "${list}" || rc=$?
+
+  if (( rc == 0 )); then
+    seekable_log "Selected $(grep -cE '^[0-9]+;' "${list}" || true) TOC entries of $(basename "${archive}")" >&2
+    # shellcheck disable=SC2086
+    seekable_archive extract "${archive}" "${index}" "${list}" $(decompression_command "${codec}") || rc=$?
+  fi
+
+  rm -f "${list}"
+  return "${rc}"
+}
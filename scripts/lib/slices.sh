@@ -0,0 +1,368 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+slice_log() {
+  log "[Slices] $*"
+}
+
+# Slices planned for the database being dumped (see plan_table_slices)
+TABLE_SLICES=()
+TABLE_SLICE_TABLES=()
+
+table_slicing_enabled() {
+  (( ${TABLE_SLICE_MB:-0} > 0 ))
+}
+
+############################################
+# Sliced table exports
+# pg_dump -j only runs tables in parallel, so one very large table is
+# still read by a single process. Tables over TABLE_SLICE_MB have their
+# data left out of the dump and exported instead as block ranges (ctid)
+# of about TABLE_SLICE_MB each, TABLE_SLICE_JOBS at a time. The dump and
+# every slice read the same exported snapshot. Slices are stored next
+# to the archive as <archive>.slice-NNNN.copy[.gz|.zst] and the plan is
+# recorded under "slices" in its .meta.json.
+############################################
+
+# Slices only make sense when DUMP_ARGS dumps whole tables with data
+table_slicing_supported() {
+  [[ ! "${DUMP_ARGS}" =~ (^|[[:space:]])(-t|-T|-n|-N|-a|-s|--table|--exclude-table|--schema|--exclude-schema|--data-only|--schema-only|--exclude-table-data|--snapshot)([=[:space:]]|$) ]]
+}
+
+table_slice_suffix() {
+  printf '.slice-%04d.copy%s' "$1" "$(compression_extension "${2:-none}")"
+}
+
+############################################
+# Plan the slices of a database
+# Usage: plan_table_slices <db>
+# Fills TABLE_SLICES with one "<n>\t<schema>\t<table>\t<columns>\t
+# <start_block>\t<end_block>" item per slice (the last slice of a table
+# has no end) and opens the snapshot session the dump and the slices
+# share. Tables owned by extensions, and tables whose names need quoting
+# in pg_dump patterns, are dumped whole. On any error the database is
+# dumped without slices.
+############################################
+plan_table_slices() {
+  local db="$1"
+  local slice_bytes=$(( TABLE_SLICE_MB * 1024 * 1024 ))
+  local entry schema table columns size blocks
+  local count per start n=0
+  local tables=()
+
+  TABLE_SLICES=()
+  TABLE_SLICE_TABLES=()
+
+  if ! table_slicing_supported; then
+    slice_log "WARNING: DUMP_ARGS selects tables or sections, ${db} is dumped without slices"
+    return 0
+  fi
+
+  if ! mapfile -t tables < <(
+    psql ${PG_CONN_PARAMETERS} -d "${db}" -At -F $'\t' -v ON_ERROR_STOP=1 \
+      -c "SELECT n.nspname, c.relname,
+                 string_agg(quote_ident(a.attname), ',' ORDER BY a.attnum),
+                 pg_table_size(c.oid),
+                 pg_relation_size(c.oid) / current_setting('block_size')::int
+          FROM pg_class c
+          JOIN pg_namespace n ON n.oid = c.relnamespace
+          JOIN pg_attribute a ON a.attrelid = c.oid
+               AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = ''
+          WHERE c.relkind = 'r'
+            AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+            AND n.nspname ~ '^[A-Za-z0-9_]+\$' AND c.relname ~ '^[A-Za-z0-9_]+\$'
+            AND pg_table_size(c.oid) > ${slice_bytes}
+            AND NOT EXISTS (SELECT 1 FROM pg_depend d
+                            WHERE d.classid = 'pg_class'::regclass AND d.objid = c.oid
+                              AND d.deptype = 'e')
+          GROUP BY n.nspname, c.relname, c.oid
+          ORDER BY pg_table_size(c.oid) DESC"
+  ); then
+    slice_log "WARNING: Unable to list large tables of ${db}, dumping without slices"
+    return 0
+  fi
+
+  for entry in "${tables[@]}"; do
+    IFS=$'\t' read -r schema table columns size blocks <<< "${entry}"
+    (( blocks > 0 )) || continue
+
+    # TOAST data counts towards the size, the ranges split the heap
+    count=$(( (size + slice_bytes - 1) / slice_bytes ))
+    (( count > blocks )) && count="${blocks}"
+    per=$(( (blocks + count - 1) / count ))
+
+    for (( start = 0; start < blocks; start += per )); do
+      n=$(( n + 1 ))
+      if (( start + per >= blocks )); then
+        TABLE_SLICES+=("${n}"$'\t'"${schema}"$'\t'"${table}"$'\t'"${columns}"$'\t'"${start}"$'\t')
+      else
+        TABLE_SLICES+=("${n}"$'\t'"${schema}"$'\t'"${table}"$'\t'"${columns}"$'\t'"${start}"$'\t'"$(( start + per ))")
+      fi
+    done
+    TABLE_SLICE_TABLES+=("${entry}")
+  done
+
+  (( ${#TABLE_SLICES[@]} > 0 )) || return 0
+
+  if ! open_snapshot_session "${db}"; then
+    slice_log "WARNING: Dumping ${db} without slices"
+    TABLE_SLICES=()
+    TABLE_SLICE_TABLES=()
+    return 0
+  fi
+
+  slice_log "Slicing ${#TABLE_SLICE_TABLES[@]} tables of ${db} over ${TABLE_SLICE_MB} MB into ${#TABLE_SLICES[@]} slices"
+}
+
+############################################
+# Extra pg_dump args for a sliced database
+# The dump reads the shared snapshot and leaves out the sliced data.
+############################################
+table_slice_dump_args() {
+  local entry schema table _
+  local args=()
+
+  (( ${#TABLE_SLICES[@]} > 0 )) || return 0
+
+  args+=("--snapshot=${SNAPSHOT_ID}")
+  for entry in "${TABLE_SLICE_TABLES[@]}"; do
+    IFS=$'\t' read -r schema table _ <<< "${entry}"
+    args+=("--exclude-table-data=\"${schema}\".\"${table}\"")
+  done
+
+  echo "${args[*]}"
+}
+
+close_table_slices() {
+  (( ${#TABLE_SLICES[@]} > 0 )) && close_snapshot_session
+  TABLE_SLICES=()
+  TABLE_SLICE_TABLES=()
+}
+
+############################################
+# Export the planned slices next to an archive
+# Usage: export_table_slices <db> <artifact>
+# Runs before the main dump, while the snapshot is held. Each slice is
+# compressed, encrypted and checksummed like the archive; on S3 it is
+# uploaded as soon as it is written. The plan is left in
+# <artifact>.slices.json for setup_metadata.
+############################################
+export_table_slices() {
+  local DB="$1"
+  local artifact="$2"
+  local status_file bytes
+  local failed=()
+
+  (( ${#TABLE_SLICES[@]} > 0 )) || return 0
+
+  SLICE_DATABASE="${DB}"
+  SLICE_ARTIFACT="${artifact}"
+  SLICE_CODEC="$(resolve_compression slices)"
+  : > "${artifact}.slices.tsv"
+
+  [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && require_encryption_key
+
+  slice_log "Exporting ${#TABLE_SLICES[@]} slices of ${DB} with TABLE_SLICE_JOBS=${TABLE_SLICE_JOBS:-2}"
+
+  metrics_begin
+  status_file="$(mktemp /tmp/slice-status.XXXXXX)"
+  run_job_pool "${TABLE_SLICE_JOBS:-2}" "${status_file}" export_table_slice_job "${TABLE_SLICES[@]}"
+  mapfile -t failed < <(job_pool_failures "${status_file}")
+  rm -f "${status_file}"
+
+  bytes="$(awk -F '\t' '{ b += $2 } END { print b + 0 }' "${artifact}.slices.tsv")"
+  metrics_end "${DB}" slices 0 "${bytes}" "${#failed[@]}"
+
+  if (( ${#failed[@]} > 0 )); then
+    slice_log "ERROR: ${#failed[@]} slices of ${DB} failed"
+    rm -f "${artifact}.slices.tsv"
+    return 1
+  fi
+
+  write_slice_plan "${artifact}"
+  rm -f "${artifact}.slices.tsv"
+  slice_log "Exported ${#TABLE_SLICES[@]} slices of ${DB}, ${bytes} bytes"
+}
+
+############################################
+# Export one slice (job pool worker)
+# Usage: export_table_slice_job "<n>\t<schema>\t<table>\t<columns>\t<start>\t<end>"
+# The COPY runs in a transaction that imports the shared snapshot.
+# Failures are returned explicitly: the pool may run where errexit is
+# off (export_table_slices ... || status="failure").
+############################################
+export_table_slice_job() {
+  local n schema table columns start end out where
+  local checksum="" size rc=0
+  IFS=$'\t' read -r n schema table columns start end <<< "$1"
+
+  out="${SLICE_ARTIFACT}$(table_slice_suffix "${n}" "${SLICE_CODEC}")"
+  where="ctid >= '(${start},0)'::tid"
+  [[ -n "${end}" ]] && where+=" AND ctid < '(${end},0)'::tid"
+
+  set -o pipefail
+  psql ${PG_CONN_PARAMETERS} -d "${SLICE_DATABASE}" -q -v ON_ERROR_STOP=1 \
+    -c "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY" \
+    -c "SET TRANSACTION SNAPSHOT '${SNAPSHOT_ID}'" \
+    -c "COPY (SELECT ${columns} FROM ONLY \"${schema}\".\"${table}\" WHERE ${where}) TO STDOUT" \
+    -c "COMMIT" \
+    | throttle_stream \
+    | compress_stream "${SLICE_CODEC}" \
+    | encode_directory_stream > "${out}" || rc=$?
+  if (( rc != 0 )); then
+    slice_log "ERROR: Unable to export slice ${n} of ${schema}.${table}"
+    rm -f "${out}"
+    return "${rc}"
+  fi
+
+  if [[ "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    checksum="$(sha256sum "${out}" | cut -d' ' -f1)"
+  fi
+  size="$(stat -c %s "${out}")"
+
+  if [[ "${STORAGE_BACKEND}" == "S3" ]]; then
+    retry 3 s3_transfer upload "${out}" "s3://${BUCKET}/$(s3_object_key "${out}")" >/dev/null || {
+      slice_log "ERROR: Unable to upload slice ${n} of ${schema}.${table}"
+      return 1
+    }
+    if [[ "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
+      rm -f "${out}"
+    fi
+  fi
+
+  printf '%s\t%s\t%s\t%s\n' "${n}" "${size}" "${out#"${SLICE_ARTIFACT}"}" "${checksum}" \
+    >> "${SLICE_ARTIFACT}.slices.tsv"
+}
+
+############################################
+# Write the slicing plan of an archive
+# Usage: write_slice_plan <artifact>
+############################################
+write_slice_plan() {
+  local artifact="$1"
+  local encrypted="false"
+
+  [[ "${DB_DUMP_ENCRYPTION:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && encrypted="true"
+
+  jq -n -c \
+    --arg snapshot "${SNAPSHOT_ID}" \
+    --arg compression "${SLICE_CODEC}" \
+    --argjson encrypted "${encrypted}" \
+    --arg tables "$(printf '%s\n' "${TABLE_SLICE_TABLES[@]}")" \
+    --arg slices "$(printf '%s\n' "${TABLE_SLICES[@]}")" \
+    --rawfile results "${artifact}.slices.tsv" \
+    'def rows($s): $s | split("\n") | map(select(length > 0) | split("\t"));
+     (rows($results) | map({(.[0]): {suffix: .[2], size: (.[1] | tonumber), checksum: (if (.[3] // "") == "" then null else .[3] end)}}) | add) as $done
+     | {
+         snapshot: $snapshot,
+         compression: $compression,
+         encrypted: $encrypted,
+         tables: [
+           rows($tables)[] as $t
+           | {
+               schema: $t[0], table: $t[1], columns: $t[2],
+               size: ($t[3] | tonumber), blocks: ($t[4] | tonumber),
+               slices: [
+                 rows($slices)[] | select(.[1] == $t[0] and .[2] == $t[1])
+                 | $done[.[0]] + {
+                     start_block: (.[4] | tonumber),
+                     end_block: (if (.[5] // "") == "" then null else (.[5] | tonumber) end)
+                   }
+               ]
+             }
+         ]
+       }' > "${artifact}.slices.json"
+}
+
+############################################
+# Does the archive being restored have slices?
+# Set by load_restore_metadata.
+############################################
+restore_has_slices() {
+  [[ -n "${RESTORE_META_SLICES:-}" ]]
+}
+
+############################################
+# Load the slices of the archive being restored
+# Usage: restore_table_slices <db> <spool_dir>
+# Runs between the data and post-data sections of pg_restore, so the
+# sliced tables are loaded without their indexes and constraints.
+# TABLE_SLICE_JOBS slices load at once; on S3 each one is downloaded to
+# <spool_dir> first. Slices are verified against the plan checksums.
+############################################
+restore_table_slices() {
+  local db="$1"
+  local spool_dir="$2"
+  local meta="${RESTORE_META_SLICES}"
+  local status_file
+  local items=()
+  local failed=()
+
+  SLICE_DATABASE="${db}"
+  SLICE_SOURCE="${RESTORE_META_SLICE_SOURCE}"
+  SLICE_SPOOL="${spool_dir}"
+  SLICE_CODEC="$(jq -r '.slices.compression // "none"' "${meta}")"
+  SLICE_ENCRYPTED="$(jq -r '.slices.encrypted // false' "${meta}")"
+
+  mapfile -t items < <(jq -r '.slices.tables[] | . as $t | .slices[]
+    | [$t.schema, $t.table, $t.columns, .suffix, (.checksum // "")] | join("\t")' "${meta}")
+
+  slice_log "Loading ${#items[@]} slices into ${db} with TABLE_SLICE_JOBS=${TABLE_SLICE_JOBS:-2}"
+
+  status_file="$(mktemp /tmp/slice-status.XXXXXX)"
+  run_job_pool "${TABLE_SLICE_JOBS:-2}" "${status_file}" restore_table_slice_job "${items[@]}"
+  mapfile -t failed < <(job_pool_failures "${status_file}")
+  rm -f "${status_file}"
+
+  if (( ${#failed[@]} > 0 )); then
+    slice_log "ERROR: ${#failed[@]} slices failed to load into ${db}"
+    return 1
+  fi
+
+  slice_log "Loaded ${#items[@]} slices into ${db}"
+}
+
+############################################
+# Load one slice (job pool worker)
+# Usage: restore_table_slice_job "<schema>\t<table>\t<columns>\t<suffix>\t<checksum>"
+############################################
+restore_table_slice_job() {
+  local schema table columns suffix checksum file actual
+  local source downloaded="" rc=0
+  IFS=$'\t' read -r schema table columns suffix checksum <<< "$1"
+
+  source="${SLICE_SOURCE}${suffix}"
+  if [[ "${source}" == s3://* ]]; then
+    file="$(mktemp "${SLICE_SPOOL}/slice.XXXXXX")"
+    downloaded="${file}"
+    retry 3 s3_transfer download "${source}" "${file}" >/dev/null || {
+      slice_log "ERROR: Unable to download slice ${source}"
+      rm -f "${file}"
+      return 1
+    }
+  else
+    file="${source}"
+  fi
+
+  if [[ -n "${checksum}" && "${CHECKSUM_VALIDATION}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+    actual="$(sha256sum "${file}" | cut -d' ' -f1)"
+    if [[ "${actual}" != "${checksum}" ]]; then
+      slice_log "ERROR: Checksum mismatch for slice ${source}"
+      [[ -n "${downloaded}" ]] && rm -f "${downloaded}"
+      return 1
+    fi
+  fi
+
+  validate_postgres_pass
+  set -o pipefail
+  decode_directory_stream "${SLICE_CODEC}" "${SLICE_ENCRYPTED}" < "${file}" \
+    | PGOPTIONS="$(restore_pgoptions)" psql ${PG_CONN_PARAMETERS} -d "${SLICE_DATABASE}" -q -v ON_ERROR_STOP=1 \
+        -c "COPY \"${schema}\".\"${table}\" (${columns}) FROM STDIN" || rc=$?
+
+  [[ -n "${downloaded}" ]] && rm -f "${downloaded}"
+  (( rc == 0 )) || slice_log "ERROR: Unable to load slice ${source} into ${schema}.${table}"
+  return "${rc}"
+}
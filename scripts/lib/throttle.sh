@@ -0,0 +1,240 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+throttle_log() {
+  log "[Throttle] $*"
+}
+
+throttle_adaptive() {
+  [[ "${THROTTLE_ADAPTIVE:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+throttle_configured() {
+  (( ${THROTTLE_NICE:-0} > 0 )) || [[ -n "${THROTTLE_IO_CLASS:-}" ]] \
+    || [[ "${THROTTLE_DUMP_MBPS:-0}" != "0" || "${THROTTLE_UPLOAD_MBPS:-0}" != "0" ]] \
+    || throttle_adaptive
+}
+
+# "<n> MB/s", or "unlimited", scaled by the current factor
+throttle_rate_label() {
+  local mbps="${1:-0}"
+  local factor="${2:-1}"
+
+  if [[ "${mbps}" == "0" ]]; then
+    echo "unlimited"
+  else
+    awk -v m="${mbps}" -v f="${factor}" 'BEGIN { printf "%g MB/s\n", m * f }'
+  fi
+}
+
+############################################
+# Backup throttling
+# Backups run next to production traffic. The backup process and
+# everything it starts (pg_dump, compression, uploads) can be given a
+# lower CPU priority (THROTTLE_NICE) and I/O class (THROTTLE_IO_CLASS).
+# The dump stream is limited to THROTTLE_DUMP_MBPS, which also slows
+# the reads pg_dump causes on the server, and uploads to
+# THROTTLE_UPLOAD_MBPS (see tools/throttle.py).
+#
+# With THROTTLE_ADAPTIVE, a monitor samples the database every
+# THROTTLE_INTERVAL seconds. Each signal over its threshold halves the
+# throttle factor: more than THROTTLE_MAX_ACTIVE active backends,
+# replication lag over THROTTLE_MAX_LAG seconds, and requested
+# checkpoints (WAL pressure). The factor scales both rate limits and
+# the number of parallel jobs started from then on.
+#
+# Usage: throttle_start / throttle_stop
+############################################
+throttle_start() {
+  throttle_configured || return 0
+
+  throttle_apply_priority
+
+  throttle_log "Limits: nice ${THROTTLE_NICE:-0}, I/O class ${THROTTLE_IO_CLASS:-default}," \
+    "dump $(throttle_rate_label "${THROTTLE_DUMP_MBPS:-0}")," \
+    "upload $(throttle_rate_label "${THROTTLE_UPLOAD_MBPS:-0}")," \
+    "adaptive ${THROTTLE_ADAPTIVE:-false}"
+
+  throttle_adaptive || return 0
+
+  # Backup sessions carry this name, so the monitor can leave them out
+  export PGAPPNAME="${PGAPPNAME:-pg_backup}"
+  export THROTTLE_STATE="$(mktemp /tmp/throttle.XXXXXX)"
+  echo 1 > "${THROTTLE_STATE}"
+
+  throttle_monitor "$$" &
+  THROTTLE_MONITOR_PID=$!
+}
+
+throttle_stop() {
+  if [[ -n "${THROTTLE_MONITOR_PID:-}" ]]; then
+    kill "${THROTTLE_MONITOR_PID}" 2>/dev/null || true
+    wait "${THROTTLE_MONITOR_PID}" 2>/dev/null || true
+    unset THROTTLE_MONITOR_PID
+  fi
+
+  if [[ -n "${THROTTLE_STATE:-}" ]]; then
+    rm -f "${THROTTLE_STATE}"
+    unset THROTTLE_STATE
+  fi
+}
+
+############################################
+# Lower the CPU and I/O priority of the backup process
+# Child processes inherit both. ionice only has an effect with I/O
+# schedulers that support priorities (BFQ).
+############################################
+throttle_apply_priority() {
+  local nice="${THROTTLE_NICE:-0}"
+  local class="${THROTTLE_IO_CLASS:-}"
+
+  if (( nice > 0 )); then
+    renice -n "${nice}" -p "$$" >/dev/null 2>&1 \
+      || throttle_log "WARNING: Unable to set CPU priority ${nice}"
+  fi
+
+  case "${class}" in
+    "") ;;
+    idle)
+      ionice -c 3 -p "$$" >/dev/null 2>&1 \
+        || throttle_log "WARNING: Unable to set I/O class ${class}"
+      ;;
+    best-effort)
+      ionice -c 2 -n "${THROTTLE_IO_LEVEL:-7}" -p "$$" >/dev/null 2>&1 \
+        || throttle_log "WARNING: Unable to set I/O class ${class}"
+      ;;
+    *)
+      throttle_log "WARNING: Unknown THROTTLE_IO_CLASS=${class}, expected idle or best-effort"
+      ;;
+  esac
+}
+
+############################################
+# Rate limit a dump stream (pipeline stage)
+# Usage: <producer> | throttle_stream | <consumer>
+############################################
+throttle_stream() {
+  if [[ "${THROTTLE_DUMP_MBPS:-0}" != "0" ]]; then
+    python3 "${LIB_DIR}/tools/throttle.py" "${THROTTLE_DUMP_MBPS}"
+  else
+    cat
+  fi
+}
+
+############################################
+# pg_basebackup args for THROTTLE_DUMP_MBPS
+# pg_basebackup limits its own transfer rate (--max-rate, at least
+# 32 kB/s). The factor in effect when the base backup starts applies.
+############################################
+throttle_basebackup_args() {
+  [[ "${THROTTLE_DUMP_MBPS:-0}" != "0" ]] || return 0
+
+  awk -v m="${THROTTLE_DUMP_MBPS}" -v f="$(throttle_factor)" \
+    'BEGIN { k = int(m * f * 1024); printf "--max-rate=%dk\n", (k < 32 ? 32 : k) }'
+}
+
+############################################
+# Current throttle factor (1 when not adaptive)
+############################################
+throttle_factor() {
+  if [[ -n "${THROTTLE_STATE:-}" && -s "${THROTTLE_STATE}" ]]; then
+    head -n 1 "${THROTTLE_STATE}"
+  else
+    echo 1
+  fi
+}
+
+############################################
+# Scale a job count by the throttle factor
+# Usage: throttle_jobs <jobs>
+# Never goes below one job.
+############################################
+throttle_jobs() {
+  awk -v j="$1" -v f="$(throttle_factor)" \
+    'BEGIN { n = int(j * f); print (n < 1 ? 1 : n) }'
+}
+
+############################################
+# Sample the load signals
+# Prints "<active_backends> <replication_lag_seconds> <requested_checkpoints>".
+# Lag is the worst replay lag of the standbys, or this server's own
+# replay delay when it is a standby.
+############################################
+throttle_sample() {
+  local checkpoints="(SELECT checkpoints_req FROM pg_stat_bgwriter)"
+
+  if (( $(psql ${PG_CONN_PARAMETERS} -d postgres -Atc 'show server_version_num') >= 170000 )); then
+    checkpoints="(SELECT num_requested FROM pg_stat_checkpointer)"
+  fi
+
+  psql ${PG_CONN_PARAMETERS} -d postgres -At -F ' ' -v ON_ERROR_STOP=1 -c "
+    SELECT
+      (SELECT count(*) FROM pg_stat_activity
+       WHERE state = 'active' AND backend_type = 'client backend'
+         AND pid <> pg_backend_pid()
+         AND application_name IS DISTINCT FROM current_setting('application_name')),
+      CASE WHEN pg_is_in_recovery() THEN
+        CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+             ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)::int END
+      ELSE
+        COALESCE((SELECT max(EXTRACT(EPOCH FROM replay_lag)) FROM pg_stat_replication), 0)::int
+      END,
+      ${checkpoints}"
+}
+
+############################################
+# Adaptive throttle loop (background)
+# Usage: throttle_monitor <parent_pid> &
+# Writes the factor to THROTTLE_STATE and logs every change. Exits
+# with the backup process.
+############################################
+throttle_monitor() {
+  local parent="$1"
+  local interval="${THROTTLE_INTERVAL:-10}"
+  local max_active="${THROTTLE_MAX_ACTIVE:-20}"
+  local max_lag="${THROTTLE_MAX_LAG:-30}"
+  local factor=1
+  local sampled=true
+  local last_checkpoints="" sample active lag checkpoints next summary
+  local reasons=()
+
+  trap - ERR SIGTERM SIGINT
+  validate_postgres_pass
+
+  while kill -0 "${parent}" 2>/dev/null; do
+    if sample="$(throttle_sample 2>/dev/null)" && [[ -n "${sample}" ]]; then
+      read -r active lag checkpoints <<< "${sample}"
+      reasons=()
+
+      (( active > max_active )) && reasons+=("${active} active backends")
+      (( lag > max_lag )) && reasons+=("replication lag ${lag}s")
+      if [[ -n "${last_checkpoints}" ]] && (( checkpoints > last_checkpoints )); then
+        reasons+=("$(( checkpoints - last_checkpoints )) requested checkpoints")
+      fi
+      last_checkpoints="${checkpoints}"
+
+      next="$(awk -v n="${#reasons[@]}" 'BEGIN { printf "%g\n", 1 / 2 ^ n }')"
+      if [[ "${next}" != "${factor}" ]]; then
+        factor="${next}"
+        echo "${factor}" > "${THROTTLE_STATE}.tmp"
+        mv -f "${THROTTLE_STATE}.tmp" "${THROTTLE_STATE}"
+
+        summary="$(printf '%s, ' "${reasons[@]}")"
+        summary="${summary%, }"
+        throttle_log "Factor ${factor} (${summary:-load back to normal}):" \
+          "dump $(throttle_rate_label "${THROTTLE_DUMP_MBPS:-0}" "${factor}")," \
+          "upload $(throttle_rate_label "${THROTTLE_UPLOAD_MBPS:-0}" "${factor}")," \
+          "jobs x${factor}"
+      fi
+      sampled=true
+    elif [[ "${sampled}" == "true" ]]; then
+      throttle_log "WARNING: Unable to sample database load, keeping factor ${factor}"
+      sampled=false
+    fi
+
+    sleep "${interval}"
+  done
+}
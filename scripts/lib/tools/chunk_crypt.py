@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Chunked authenticated encryption for dump streams.
+
+Usage: chunk_crypt.py encrypt|decrypt [threads] < input > output
+
+The passphrase is read from DB_DUMP_ENCRYPTION_PASS_PHRASE.
+
+Streams are cut into 1 MiB chunks, and each chunk is sealed with
+AES-256-GCM. Chunks are encrypted and decrypted on a thread pool. The
+output order is unchanged. A chunk's nonce and associated data bind
+its position and whether it is the last chunk, so corruption,
+reordering and truncation are all detected at the chunk where they
+happen.
+
+Layout:
+    header  MAGIC | version | chunk size | PBKDF2 iterations | salt | nonce prefix
+    chunk   ciphertext length (uint32) | ciphertext + 16 byte tag
+
+decrypt also accepts the legacy `openssl enc -aes-256-cbc -pbkdf2
+-iter 10000 -md sha256` format ("Salted__" header), so archives made
+before the switch remain restorable.
+"""
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+MAGIC = b"PGBKGCM1"
+VERSION = 1
+CHUNK_SIZE = 1 << 20
+ITERATIONS = 200000
+# Upper bounds for header fields, so a damaged or hostile header cannot
+# make decrypt allocate huge buffers or spin on key derivation
+MAX_CHUNK_SIZE = 64 << 20
+MAX_ITERATIONS = 10000000
+HEADER = struct.Struct(">8sBII16s8s")
+LENGTH = struct.Struct(">I")
+TAG_SIZE = 16
+
+LEGACY_MAGIC = b"Salted__"
+LEGACY_ITERATIONS = 10000
+
+
+class CryptError(Exception):
+    pass
+
+
+def derive_key(passphrase, salt, iterations, length=32):
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=length, salt=salt,
+                     iterations=iterations)
+    return kdf.derive(passphrase)
+
+
+def read_exact(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            break
+        data += block
+    return bytes(data)
+
+
+def chunk_nonce(prefix, index):
+    return prefix + struct.pack(">I", index)
+
+
+def chunk_aad(header, index, final):
+    return header + struct.pack(">QB", index, 1 if final else 0)
+
+
+def plaintext_chunks(stream):
+    """Yield (index, data, final), reading one chunk ahead to spot the end."""
+    index = 0
+    current = read_exact(stream, CHUNK_SIZE)
+    while True:
+        following = read_exact(stream, CHUNK_SIZE) if len(current) == CHUNK_SIZE else b""
+        final = not following
+        yield index, current, final
+        if final:
+            return
+        index += 1
+        current = following
+
+
+def ordered_map(pool, fn, items, window):
+    """pool.map with at most `window` chunks in flight."""
+    pending = []
+    for item in items:
+        pending.append(pool.submit(fn, *item))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+def encrypt(source, sink, passphrase, threads):
+    salt = os.urandom(16)
+    prefix = os.urandom(8)
+    header = HEADER.pack(MAGIC, VERSION, CHUNK_SIZE, ITERATIONS, salt, prefix)
+    aead = AESGCM(derive_key(passphrase, salt, ITERATIONS))
+
+    def seal(index, data, final):
+        return aead.encrypt(chunk_nonce(prefix, index), data, chunk_aad(header, index, final))
+
+    sink.write(header)
+    with ThreadPoolExecutor(threads) as pool:
+        for sealed in ordered_map(pool, seal, plaintext_chunks(source), threads * 2):
+            sink.write(LENGTH.pack(len(sealed)))
+            sink.write(sealed)
+
+
+def sealed_chunks(source, chunk_size):
+    """Yield (index, ciphertext, final) from an encrypted stream."""
+    index = 0
+    current = source.read(LENGTH.size)
+    while True:
+        if len(current) != LENGTH.size:
+            raise CryptError("Encrypted stream is truncated before chunk %d" % index)
+        (length,) = LENGTH.unpack(current)
+        if length < TAG_SIZE or length > chunk_size + TAG_SIZE:
+            raise CryptError("Invalid length %d for chunk %d" % (length, index))
+        data = read_exact(source, length)
+        if len(data) != length:
+            raise CryptError("Encrypted stream is truncated in chunk %d" % index)
+        current = source.read(LENGTH.size)
+        final = not current
+        yield index, data, final
+        if final:
+            return
+        index += 1
+
+
+def decrypt(source, sink, passphrase, threads):
+    magic = read_exact(source, len(MAGIC))
+    if magic == LEGACY_MAGIC:
+        decrypt_legacy(source, sink, passphrase)
+        return
+    if magic != MAGIC:
+        raise CryptError("Not an encrypted dump stream")
+
+    header = magic + read_exact(source, HEADER.size - len(MAGIC))
+    if len(header) != HEADER.size:
+        raise CryptError("Encrypted stream header is truncated")
+    _, version, chunk_size, iterations, salt, prefix = HEADER.unpack(header)
+    if version != VERSION:
+        raise CryptError("Unsupported encryption format version %d" % version)
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise CryptError("Invalid chunk size %d in encrypted stream header" % chunk_size)
+    if not 0 < iterations <= MAX_ITERATIONS:
+        raise CryptError("Invalid PBKDF2 iterations %d in encrypted stream header" % iterations)
+    aead = AESGCM(derive_key(passphrase, salt, iterations))
+
+    def open_chunk(index, data, final):
+        try:
+            return aead.decrypt(chunk_nonce(prefix, index), data, chunk_aad(header, index, final))
+        except InvalidTag:
+            raise CryptError("Authentication failed for chunk %d" % index)
+
+    with ThreadPoolExecutor(threads) as pool:
+        for plain in ordered_map(pool, open_chunk, sealed_chunks(source, chunk_size), threads * 2):
+            sink.write(plain)
+
+
+def decrypt_legacy(source, sink, passphrase):
+    salt = read_exact(source, 8)
+    material = derive_key(passphrase, salt, LEGACY_ITERATIONS, 48)
+    decryptor = Cipher(algorithms.AES(material[:32]), modes.CBC(material[32:])).decryptor()
+    unpadder = padding.PKCS7(128).unpadder()
+
+    while True:
+        block = source.read(CHUNK_SIZE)
+        if not block:
+            break
+        sink.write(unpadder.update(decryptor.update(block)))
+    try:
+        sink.write(unpadder.update(decryptor.finalize()) + unpadder.finalize())
+    except ValueError:
+        raise CryptError("Bad decrypt (wrong passphrase or corrupted archive)")
+
+
+def main(argv):
+    if len(argv) not in (2, 3) or argv[1] not in ("encrypt", "decrypt"):
+        sys.stderr.write(__doc__)
+        return 2
+
+    passphrase = os.environ.get("DB_DUMP_ENCRYPTION_PASS_PHRASE", "")
+    if not passphrase:
+        sys.stderr.write("DB_DUMP_ENCRYPTION_PASS_PHRASE is not set\n")
+        return 2
+
+    threads = int(argv[2]) if len(argv) == 3 else 0
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+
+    action = encrypt if argv[1] == "encrypt" else decrypt
+    try:
+        action(sys.stdin.buffer, sys.stdout.buffer, passphrase.encode(), threads)
+        sys.stdout.buffer.flush()
+    except CryptError as exc:
+        sys.stderr.write("%s\n" % exc)
+        return 1
+    except BrokenPipeError:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+"""Deduplicated chunk repository for dump streams.
+
+Usage:
+    chunk_store.py init <repository>
+    chunk_store.py store <repository> <manifest> < dump
+    chunk_store.py restore <repository> <manifest> > dump
+    chunk_store.py gc <repository> <manifests> [--dry-run]
+
+<repository> is a directory or an s3://bucket/prefix URI. Chunks are
+kept once under their content hash, as <repository>/<xx>/<hash>.
+
+store cuts stdin into content-defined chunks and writes the chunks the
+repository does not hold yet. It then writes <manifest>, which lists
+the chunks of the stream in order. Cut points fall on line ends chosen
+by a hash of the line, so an unchanged part of a dump (COPY data in
+plain pg_dump output) is cut into the same chunks every time, even
+when data before it has grown or shrunk. Chunks average DEDUP_CHUNK_KB
+kilobytes. They are hashed, compressed (zlib at COMPRESSION_LEVEL,
+3 by default, unless COMPRESSION=none) and written on a thread pool.
+Every stored blob starts with a byte naming its format, so a chunk
+written with or without compression restores whatever COMPRESSION is
+set to when it is read again.
+
+When DB_DUMP_ENCRYPTION_PASS_PHRASE is set, store seals every chunk
+with AES-256-GCM. Chunk ids are then an HMAC of the content, so equal
+chunks still deduplicate without the ids revealing their plain
+hashes. The key salt is kept in <repository>/config.json, which init
+creates. Run init once before concurrent stores, so that they all
+share one salt.
+
+restore fetches the chunks of <manifest> in parallel and writes the
+stream to stdout in order, verifying every chunk and the whole stream.
+
+gc lists the manifests under <manifests> (a directory or an
+s3://bucket URI, searched for *.chunks) and counts the references to
+each chunk. Chunks no manifest references are deleted. A manifest that
+cannot be read stops gc before anything is deleted. gc prints
+"<deleted chunks> <deleted bytes> <kept chunks>".
+
+Local repositories are written with S3_TRANSFER_CONCURRENCY threads
+too. S3 repositories use the s3cmd library and ~/.s3cfg (or
+S3CMD_CONFIG), like s3_transfer.py.
+"""
+import hashlib
+import hmac
+import json
+import os
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+KB = 1024
+READ_SIZE = 8 * 1024 * KB
+MANIFEST_VERSION = 1
+ITERATIONS = 200000
+# First byte of a stored blob
+FORMAT_RAW = b"\x00"
+FORMAT_ZLIB = b"\x01"
+
+
+class StoreError(Exception):
+    pass
+
+
+def env_int(name, default, minimum=1):
+    try:
+        return max(int(os.environ.get(name, default)), minimum)
+    except ValueError:
+        return default
+
+
+AVERAGE = env_int("DEDUP_CHUNK_KB", 1024, 16) * KB
+MIN_SIZE = AVERAGE // 4
+MAX_SIZE = AVERAGE * 4
+CONCURRENCY = env_int("S3_TRANSFER_CONCURRENCY", 4)
+LEVEL = min(env_int("COMPRESSION_LEVEL", 3, 0), 9)
+
+
+def log(message):
+    sys.stderr.write("%s\n" % message)
+    sys.stderr.flush()
+
+
+def ordered_map(pool, fn, items, window):
+    """pool.map with at most `window` items in flight."""
+    pending = []
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+############################################
+# Content-defined chunking
+############################################
+def cut_points(data):
+    """Offsets just past the line ends of `data` that may end a chunk.
+
+    A line qualifies with a probability proportional to its length, so
+    candidates are AVERAGE bytes apart on average whatever the line
+    lengths. The incomplete last line is left for the next read.
+    """
+    offset = 0
+    for line in data.split(b"\n")[:-1]:
+        offset += len(line) + 1
+        if zlib.crc32(line) % AVERAGE < len(line):
+            yield offset
+
+
+def chunks(stream):
+    """Yield the chunks of a stream, between MIN_SIZE and MAX_SIZE bytes."""
+    buffer = b""
+    eof = False
+
+    while not eof:
+        block = stream.read(READ_SIZE)
+        eof = not block
+        buffer += block
+
+        start = 0
+        for point in cut_points(buffer):
+            if point - start < MIN_SIZE:
+                continue
+            while point - start > MAX_SIZE:
+                yield buffer[start:start + MAX_SIZE]
+                start += MAX_SIZE
+            yield buffer[start:point]
+            start = point
+        # No line end left to cut at, long lines are cut at MAX_SIZE
+        while len(buffer) - start > MAX_SIZE:
+            yield buffer[start:start + MAX_SIZE]
+            start += MAX_SIZE
+        buffer = buffer[start:]
+
+    if buffer:
+        yield buffer
+
+
+############################################
+# Chunk encoding
+############################################
+class Codec(object):
+    """Turns chunks into stored blobs and back."""
+
+    def __init__(self, compress=True, key=None):
+        self.compress = compress
+        self.key = key
+        if key:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+            self.aead = AESGCM(key[:32])
+
+    def chunk_id(self, data):
+        if self.key:
+            return hmac.new(self.key[32:], data, hashlib.sha256).hexdigest()
+        return hashlib.sha256(data).hexdigest()
+
+    def encode(self, chunk_id, data):
+        if self.compress:
+            blob = FORMAT_ZLIB + zlib.compress(data, LEVEL)
+        else:
+            blob = FORMAT_RAW + data
+        if self.key:
+            # The id is unique per content, so it serves as the nonce
+            ident = bytes.fromhex(chunk_id)
+            blob = self.aead.encrypt(ident[:12], blob, ident)
+        return blob
+
+    def decode(self, chunk_id, blob):
+        if self.key:
+            from cryptography.exceptions import InvalidTag
+            ident = bytes.fromhex(chunk_id)
+            try:
+                blob = self.aead.decrypt(ident[:12], blob, ident)
+            except InvalidTag:
+                raise StoreError("Authentication failed for chunk %s" % chunk_id)
+        for data in self.candidates(blob):
+            if data is not None and self.chunk_id(data) == chunk_id:
+                return data
+        raise StoreError("Chunk %s is corrupt" % chunk_id)
+
+    @staticmethod
+    def candidates(blob):
+        """Possible contents of a blob, checked against the chunk id.
+
+        Chunks stored before blobs had a format byte are plain zlib or
+        raw data; the id tells which reading is right.
+        """
+        head, body = blob[:1], blob[1:]
+        if head == FORMAT_ZLIB:
+            yield inflate(body)
+        elif head == FORMAT_RAW:
+            yield body
+        yield inflate(blob)
+        yield blob
+
+
+def inflate(data):
+    try:
+        return zlib.decompress(data)
+    except zlib.error:
+        return None
+
+
+def repository_key(repository, passphrase):
+    """AES and HMAC keys of an encrypted repository."""
+    from chunk_crypt import derive_key
+
+    config = repository.read_config()
+    if config is None:
+        raise StoreError("Repository has no config.json, run init first")
+    return derive_key(passphrase, bytes.fromhex(config["salt"]), config["iterations"], 64)
+
+
+def passphrase():
+    value = os.environ.get("DB_DUMP_ENCRYPTION_PASS_PHRASE", "")
+    return value.encode() if value else None
+
+
+############################################
+# Repositories
+############################################
+def chunk_path(chunk_id):
+    return "%s/%s" % (chunk_id[:2], chunk_id)
+
+
+class LocalRepository(object):
+    def __init__(self, root):
+        self.root = root
+
+    def read_config(self):
+        try:
+            with open(os.path.join(self.root, "config.json")) as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+
+    def write_config(self, config):
+        os.makedirs(self.root, exist_ok=True)
+        write_atomic(os.path.join(self.root, "config.json"), json.dumps(config).encode())
+
+    def chunks(self):
+        """Map of chunk id -> stored size."""
+        found = {}
+        if not os.path.isdir(self.root):
+            return found
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and len(entry.name) == 2:
+                for item in os.scandir(entry.path):
+                    if not item.name.endswith(".tmp"):
+                        found[item.name] = item.stat().st_size
+        return found
+
+    def put(self, chunk_id, blob):
+        path = os.path.join(self.root, chunk_path(chunk_id))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, blob)
+
+    def get(self, chunk_id):
+        try:
+            with open(os.path.join(self.root, chunk_path(chunk_id)), "rb") as handle:
+                return handle.read()
+        except FileNotFoundError:
+            raise StoreError("Chunk %s is missing from %s" % (chunk_id, self.root))
+
+    def delete(self, chunk_ids):
+        deleted = []
+        for chunk_id in chunk_ids:
+            try:
+                os.remove(os.path.join(self.root, chunk_path(chunk_id)))
+                deleted.append(chunk_id)
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    def manifests(self, location):
+        for folder, dirs, files in os.walk(location):
+            # The repository may live below the backups it serves
+            dirs[:] = [d for d in dirs if os.path.join(folder, d) != self.root]
+            for name in files:
+                if name.endswith(".chunks"):
+                    yield os.path.join(folder, name)
+
+    def read_manifest(self, location):
+        with open(location, "rb") as handle:
+            return handle.read()
+
+
+class S3Repository(object):
+    def __init__(self, uri):
+        from S3.Config import Config
+        from S3.S3 import S3
+        from S3.S3Uri import S3Uri
+
+        import s3_transfer
+
+        self.transfer = s3_transfer
+        self.uri_class = S3Uri
+        self.s3 = S3(Config(os.environ.get("S3CMD_CONFIG", os.path.expanduser("~/.s3cfg"))))
+        bucket_uri = S3Uri(uri)
+        self.bucket = bucket_uri.bucket()
+        self.prefix = bucket_uri.object().strip("/")
+
+    def uri(self, name):
+        return self.uri_class("s3://%s/%s/%s" % (self.bucket, self.prefix, name))
+
+    def get_object(self, uri):
+        response = self.s3.send_request(self.s3.create_request("OBJECT_GET", uri=uri), retries=0)
+        self.transfer.count("bytes", len(response["data"]))
+        return response["data"]
+
+    def read_config(self):
+        from S3.Exceptions import S3Error
+
+        def fetch():
+            try:
+                return self.get_object(self.uri("config.json"))
+            except S3Error as exc:
+                if exc.status == 404:
+                    return None
+                raise
+
+        data = self.transfer.with_retries("Repository config", fetch)
+        return None if data is None else json.loads(data)
+
+    def write_config(self, config):
+        self.transfer.put_object(self.s3, self.uri("config.json"), json.dumps(config).encode())
+
+    def chunks(self):
+        found = {}
+        for _, _, objects in self.s3.bucket_list_streaming(self.bucket, prefix=self.prefix + "/",
+                                                           recursive=True):
+            for item in objects:
+                name = item["Key"][len(self.prefix) + 1:]
+                if "/" in name:
+                    found[name.split("/")[-1]] = int(item["Size"])
+        return found
+
+    def put(self, chunk_id, blob):
+        self.transfer.with_retries("Upload of chunk %s" % chunk_id, self.transfer.put_object,
+                                   self.s3, self.uri(chunk_path(chunk_id)), blob)
+
+    def get(self, chunk_id):
+        return self.transfer.with_retries("Chunk %s" % chunk_id, self.get_object,
+                                          self.uri(chunk_path(chunk_id)))
+
+    def delete(self, chunk_ids):
+        from s3_batch_delete import batches, failed_keys
+
+        deleted = []
+        keys = ["%s/%s" % (self.prefix, chunk_path(c)) for c in chunk_ids]
+        for batch in batches(keys):
+            response = self.s3.object_batch_delete_uri_strs(
+                ["s3://%s/%s" % (self.bucket, key) for key in batch])
+            errors = failed_keys(response.get("data"))
+            deleted.extend(key.split("/")[-1] for key in batch if key not in errors)
+        return deleted
+
+    def manifests(self, location):
+        bucket = self.uri_class(location).bucket()
+        for _, _, objects in self.s3.bucket_list_streaming(bucket, recursive=True):
+            for item in objects:
+                if item["Key"].endswith(".chunks") and not item["Key"].startswith(self.prefix + "/"):
+                    yield "s3://%s/%s" % (bucket, item["Key"])
+
+    def read_manifest(self, location):
+        return self.transfer.with_retries("Manifest %s" % location, self.get_object,
+                                          self.uri_class(location))
+
+
+def open_repository(location):
+    if location.startswith("s3://"):
+        return S3Repository(location)
+    return LocalRepository(location)
+
+
+def write_atomic(path, data):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp, path)
+
+
+############################################
+# Commands
+############################################
+def init(repository):
+    if repository.read_config() is None:
+        repository.write_config({"salt": os.urandom(16).hex(), "iterations": ITERATIONS})
+
+
+def store(repository, stream, manifest_path):
+    key = None
+    secret = passphrase()
+    if secret:
+        key = repository_key(repository, secret)
+    codec = Codec(os.environ.get("COMPRESSION", "").lower() != "none", key)
+
+    known = repository.chunks()
+    whole = hashlib.sha256()
+    entries = []
+    written = {"chunks": 0, "bytes": 0}
+    claimed = set()
+
+    def save(data):
+        chunk_id = codec.chunk_id(data)
+        # Equal chunks in one stream are written once
+        if chunk_id in known or chunk_id in claimed:
+            return chunk_id, len(data), 0
+        claimed.add(chunk_id)
+        blob = codec.encode(chunk_id, data)
+        repository.put(chunk_id, blob)
+        return chunk_id, len(data), len(blob)
+
+    def hashed(stream):
+        for data in chunks(stream):
+            whole.update(data)
+            yield data
+
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        for chunk_id, length, stored in ordered_map(pool, save, hashed(stream), CONCURRENCY * 2):
+            entries.append([chunk_id, length])
+            if stored:
+                written["chunks"] += 1
+                written["bytes"] += stored
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "chunker": "lines",
+        "average": AVERAGE,
+        "compression": "zlib" if codec.compress else "none",
+        "encrypted": bool(key),
+        "size": sum(length for _, length in entries),
+        "sha256": whole.hexdigest(),
+        "chunks": entries,
+    }
+    # A partial manifest would stop gc, so it only appears once complete
+    write_atomic(manifest_path, (json.dumps(manifest, separators=(",", ":")) + "\n").encode())
+
+    log("Stored %d bytes as %d chunks, %d new (%d bytes written)"
+        % (manifest["size"], len(entries), written["chunks"], written["bytes"]))
+
+
+def restore(repository, manifest_path, sink):
+    with open(manifest_path) as handle:
+        manifest = json.load(handle)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise StoreError("Unsupported chunk manifest version %s" % manifest.get("version"))
+
+    key = None
+    if manifest["encrypted"]:
+        secret = passphrase()
+        if not secret:
+            raise StoreError("Chunks are encrypted, DB_DUMP_ENCRYPTION_PASS_PHRASE is not set")
+        key = repository_key(repository, secret)
+    codec = Codec(manifest["compression"] != "none", key)
+    whole = hashlib.sha256()
+
+    def fetch(entry):
+        chunk_id, length = entry
+        data = codec.decode(chunk_id, repository.get(chunk_id))
+        if len(data) != length:
+            raise StoreError("Chunk %s is %d bytes, expected %d" % (chunk_id, len(data), length))
+        return data
+
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        for data in ordered_map(pool, fetch, manifest["chunks"], CONCURRENCY * 2):
+            whole.update(data)
+            sink.write(data)
+    sink.flush()
+
+    if whole.hexdigest() != manifest["sha256"]:
+        raise StoreError("Restored stream does not match the manifest checksum")
+
+
+def gc(repository, location, dry_run):
+    references = {}
+    manifests = list(repository.manifests(location))
+
+    def read(path):
+        try:
+            return json.loads(repository.read_manifest(path))
+        except Exception as exc:
+            raise StoreError("Unable to read manifest %s: %s" % (path, exc))
+
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        for manifest in pool.map(read, manifests):
+            for chunk_id, _ in manifest["chunks"]:
+                references[chunk_id] = references.get(chunk_id, 0) + 1
+
+    stored = repository.chunks()
+    unreferenced = [c for c in stored if references.get(c, 0) == 0]
+    log("%d manifests reference %d of %d chunks, %d unreferenced"
+        % (len(manifests), len(stored) - len(unreferenced), len(stored), len(unreferenced)))
+
+    deleted = unreferenced if dry_run else repository.delete(unreferenced)
+    sys.stdout.write("%d %d %d\n" % (len(deleted), sum(stored[c] for c in deleted),
+                                     len(stored) - len(deleted)))
+    if len(deleted) != len(unreferenced):
+        raise StoreError("%d unreferenced chunks could not be deleted"
+                         % (len(unreferenced) - len(deleted)))
+
+
+def main(argv):
+    if len(argv) == 3 and argv[1] == "init":
+        argv = argv + [argv[2]]
+    if len(argv) < 4 or argv[1] not in ("init", "store", "restore", "gc") \
+            or (len(argv) > 4 and argv[1:] != ["gc", argv[2], argv[3], "--dry-run"]):
+        sys.stderr.write(__doc__)
+        return 2
+
+    action, location, target = argv[1:4]
+    try:
+        repository = open_repository(location)
+        if action == "init":
+            init(repository)
+        elif action == "store":
+            store(repository, sys.stdin.buffer, target)
+        elif action == "restore":
+            restore(repository, target, sys.stdout.buffer)
+        else:
+            gc(repository, target, len(argv) == 5)
+    except BrokenPipeError:
+        return 1
+    except Exception as exc:
+        log("%s %s failed: %s" % (action, target, exc))
+        return 1
+    finally:
+        if location.startswith("s3://") and "s3_transfer" in sys.modules:
+            sys.modules["s3_transfer"].write_stats()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Chunked SHA-256 manifests for archives.
+
+Usage:
+    hash_manifest.py create <file|->
+    hash_manifest.py verify <file> <meta.json>
+
+create hashes the input in CHECKSUM_CHUNK_MB chunks. It prints a JSON
+manifest with the size, the chunk size, the per-chunk digests, a root
+hash over those digests, and the whole-file SHA-256 that the legacy
+.sha256 sidecar holds. Files are read once. Chunks are hashed on a
+thread pool while the whole-file digest is computed as the data
+streams past.
+
+verify checks a file against the manifest its .meta.json points to,
+the <file>.manifest.json sidecar (older metadata holds the manifest
+itself), with all chunks checked in parallel. Each corrupt chunk is printed as
+"<offset> <length>" and the exit status is 1, so callers can re-fetch
+only those byte ranges.
+"""
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+MB = 1024 * 1024
+
+
+def chunk_size_setting():
+    try:
+        return max(int(os.environ.get("CHECKSUM_CHUNK_MB", 16)), 1) * MB
+    except ValueError:
+        return 16 * MB
+
+
+def threads_setting():
+    return os.cpu_count() or 1
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def root_hash(chunks):
+    return hashlib.sha256(b"".join(bytes.fromhex(c) for c in chunks)).hexdigest()
+
+
+def read_exact(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            break
+        data += block
+    return bytes(data)
+
+
+def create(stream, chunk_size=None):
+    """Build a manifest from a binary stream in a single pass."""
+    chunk_size = chunk_size or chunk_size_setting()
+    threads = threads_setting()
+    whole = hashlib.sha256()
+    futures = []
+    size = 0
+
+    # hashlib releases the GIL on large buffers, so chunks hash in parallel
+    with ThreadPoolExecutor(threads) as pool:
+        while True:
+            data = read_exact(stream, chunk_size)
+            if not data:
+                break
+            whole.update(data)
+            size += len(data)
+            futures.append(pool.submit(digest, data))
+            # Bound the data held by queued chunks
+            if len(futures) > threads * 2:
+                futures[-threads * 2 - 1].result()
+        chunks = [f.result() for f in futures]
+
+    return {
+        "algorithm": "sha256",
+        "chunk_size": chunk_size,
+        "size": size,
+        "sha256": whole.hexdigest(),
+        "root": root_hash(chunks),
+        "chunks": chunks,
+    }
+
+
+def load_manifest(meta_path):
+    with open(meta_path) as handle:
+        manifest = json.load(handle).get("manifest")
+    if not manifest:
+        return None
+    if "chunks" not in manifest:
+        summary = manifest
+        sidecar = meta_path[:-len(".meta.json")] + summary["file"]
+        with open(sidecar) as handle:
+            manifest = json.load(handle)
+        if manifest["root"] != summary["root"]:
+            raise ValueError("Manifest %s does not match %s" % (sidecar, meta_path))
+    if root_hash(manifest["chunks"]) != manifest["root"]:
+        raise ValueError("Manifest root hash does not match its chunks")
+    return manifest
+
+
+def chunk_range(manifest, index):
+    offset = index * manifest["chunk_size"]
+    return offset, min(manifest["chunk_size"], manifest["size"] - offset)
+
+
+def corrupt_chunks(path, manifest):
+    """Indexes of the chunks of <path> that do not match the manifest."""
+    if os.path.getsize(path) != manifest["size"]:
+        return list(range(len(manifest["chunks"])))
+
+    fd = os.open(path, os.O_RDONLY)
+
+    def check(index):
+        offset, length = chunk_range(manifest, index)
+        return digest(os.pread(fd, length, offset)) == manifest["chunks"][index]
+
+    try:
+        with ThreadPoolExecutor(threads_setting()) as pool:
+            results = pool.map(check, range(len(manifest["chunks"])))
+            return [index for index, ok in enumerate(results) if not ok]
+    finally:
+        os.close(fd)
+
+
+def main(argv):
+    if len(argv) == 3 and argv[1] == "create":
+        if argv[2] == "-":
+            manifest = create(sys.stdin.buffer)
+        else:
+            with open(argv[2], "rb") as handle:
+                manifest = create(handle)
+        json.dump(manifest, sys.stdout)
+        sys.stdout.write("\n")
+        return 0
+
+    if len(argv) == 4 and argv[1] == "verify":
+        try:
+            manifest = load_manifest(argv[3])
+        except (OSError, ValueError, KeyError) as exc:
+            sys.stderr.write("Invalid manifest in %s: %s\n" % (argv[3], exc))
+            return 2
+        if manifest is None:
+            sys.stderr.write("No manifest in %s\n" % argv[3])
+            return 2
+        bad = corrupt_chunks(argv[2], manifest)
+        for index in bad:
+            sys.stdout.write("%d %d\n" % chunk_range(manifest, index))
+        return 1 if bad else 0
+
+    sys.stderr.write(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
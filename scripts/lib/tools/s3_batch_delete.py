@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Delete S3 objects with multi-object delete requests.
+
+Usage: s3_batch_delete.py <bucket> < keys
+
+Keys are read from stdin, one per line, and removed in batches of up to
+1000 keys per request using the s3cmd library and ~/.s3cfg. Each key
+that was deleted is printed on stdout. Failures go to stderr and make
+the exit status non-zero.
+"""
+import os
+import sys
+from xml.etree import ElementTree
+
+from S3.Config import Config
+from S3.S3 import S3
+
+BATCH_SIZE = 1000
+
+
+def batches(keys, size=BATCH_SIZE):
+    for start in range(0, len(keys), size):
+        yield keys[start:start + size]
+
+
+def failed_keys(data):
+    """Map key -> error code from a DeleteResult response body."""
+    if not data:
+        return {}
+
+    errors = {}
+    for element in ElementTree.fromstring(data).iter():
+        if not element.tag.endswith("Error"):
+            continue
+        fields = {child.tag.split("}")[-1]: child.text for child in element}
+        errors[fields.get("Key")] = fields.get("Code", "Unknown")
+    return errors
+
+
+def main(argv):
+    if len(argv) != 2:
+        sys.stderr.write(__doc__)
+        return 2
+
+    bucket = argv[1]
+    keys = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+    if not keys:
+        return 0
+
+    s3 = S3(Config(os.environ.get("S3CMD_CONFIG", os.path.expanduser("~/.s3cfg"))))
+    failures = 0
+
+    for batch in batches(keys):
+        uris = ["s3://%s/%s" % (bucket, key) for key in batch]
+        try:
+            response = s3.object_batch_delete_uri_strs(uris)
+        except Exception as exc:
+            sys.stderr.write("Batch delete of %d objects failed: %s\n" % (len(batch), exc))
+            failures += len(batch)
+            continue
+
+        errors = failed_keys(response.get("data"))
+        for key in batch:
+            if key in errors:
+                sys.stderr.write("Failed to delete %s: %s\n" % (key, errors[key]))
+                failures += 1
+            else:
+                sys.stdout.write(key + "\n")
+        sys.stdout.flush()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""Parallel, resumable multipart transfers to and from S3.
+
+Usage:
+    s3_transfer.py upload <file|-> <s3://bucket/key>
+    s3_transfer.py download <s3://bucket/key> <file|-> [meta.json]
+    s3_transfer.py abort-stale <s3://bucket> <hours>
+
+Objects move in parts of S3_PART_SIZE_MB megabytes, with
+S3_TRANSFER_CONCURRENCY parts in flight at once. When a part fails,
+only that part is retried, up to S3_PART_RETRIES times. Only server
+errors (5xx), throttling, timeouts and connection errors are retried;
+other client errors such as 403 or 404 fail right away. Requests are
+sent with s3cmd's own retries turned off, so a part is sent at most
+S3_PART_RETRIES times.
+
+S3 accepts at most 10,000 parts per upload. File uploads use larger
+parts when the file would need more. Stream uploads double their part
+size every 1,000 parts, up to 5 GB, and keep no more than
+S3_TRANSFER_CONCURRENCY * S3_PART_SIZE_MB megabytes in flight.
+
+Transfers of regular files record their progress in a state file next
+to the file: <file>.upload.json or <file>.download.json. Running the
+same command again after an interruption resumes from the parts that
+already completed. Streams ("-") cannot be resumed, but they still
+retry each part.
+
+When download is given a .meta.json with a chunk manifest (see
+hash_manifest.py), parts follow the manifest chunks, and each part is
+verified as soon as it arrives. A corrupt part is fetched again on its
+own. If <file> already exists, only its corrupt chunks are re-fetched.
+
+abort-stale aborts the multipart uploads in the bucket that were
+started more than <hours> ago and never completed.
+
+When S3_TRANSFER_STATS names a file, upload and download append a
+"<bytes> <retries>" line to it. The line holds the bytes sent or
+received, re-fetched parts included, and the number of retried
+requests. Backup metrics read these lines.
+
+When THROTTLE_UPLOAD_MBPS is set, uploads are paced to that many
+megabytes per second across all parts in flight (see throttle.py).
+
+Uses the s3cmd library and ~/.s3cfg (or S3CMD_CONFIG).
+"""
+import base64
+import hashlib
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+
+from S3.BaseUtils import getTextFromXml
+from S3.Config import Config
+from S3.Exceptions import S3Error, S3RequestError
+from S3.S3 import S3
+from S3.S3Uri import S3Uri
+
+import hash_manifest
+from throttle import env_limiter
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * 1024 * MB
+MAX_PARTS = 10000
+# Stream uploads double their part size after this many parts
+STREAM_PARTS_PER_STEP = 1000
+
+
+class TransferError(Exception):
+    pass
+
+
+def env_int(name, default, minimum=1):
+    try:
+        return max(int(os.environ.get(name, default)), minimum)
+    except ValueError:
+        return default
+
+
+PART_SIZE = max(env_int("S3_PART_SIZE_MB", 64) * MB, MIN_PART_SIZE)
+CONCURRENCY = env_int("S3_TRANSFER_CONCURRENCY", 4)
+RETRIES = env_int("S3_PART_RETRIES", 5)
+UPLOAD_LIMIT = env_limiter("THROTTLE_UPLOAD_MBPS")
+
+STATS = {"bytes": 0, "retries": 0}
+STATS_LOCK = threading.Lock()
+
+
+def log(message):
+    sys.stderr.write("%s\n" % message)
+    sys.stderr.flush()
+
+
+def count(name, amount=1):
+    with STATS_LOCK:
+        STATS[name] += amount
+
+
+def write_stats():
+    path = os.environ.get("S3_TRANSFER_STATS")
+    if not path:
+        return
+    with open(path, "a") as handle:
+        handle.write("%d %d\n" % (STATS["bytes"], STATS["retries"]))
+
+
+def retryable(exc):
+    """Whether a failed request may succeed when sent again."""
+    if isinstance(exc, S3Error):
+        return exc.status >= 500 or exc.status in (408, 429)
+    # Short reads and corrupt chunks are raised as TransferError
+    return isinstance(exc, (TransferError, S3RequestError, OSError, http.client.HTTPException))
+
+
+def with_retries(label, fn, *args):
+    """Run fn(*args) with exponential backoff between failed attempts."""
+    for attempt in range(1, RETRIES + 1):
+        try:
+            return fn(*args)
+        except Exception as exc:
+            if not retryable(exc):
+                raise TransferError("%s failed: %s" % (label, exc))
+            if attempt == RETRIES:
+                raise TransferError("%s failed after %d attempts: %s" % (label, attempt, exc))
+            delay = min(2 ** attempt, 30)
+            count("retries")
+            log("%s failed (attempt %d/%d): %s, retrying in %ds" % (label, attempt, RETRIES, exc, delay))
+            time.sleep(delay)
+
+
+def read_exact(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            break
+        data += block
+    return bytes(data)
+
+
+def part_count(size, part_size):
+    return max((size + part_size - 1) // part_size, 1)
+
+
+def file_part_size(size):
+    """Part size that keeps an upload of <size> bytes within MAX_PARTS."""
+    needed = (size + MAX_PARTS - 1) // MAX_PARTS
+    # Whole megabytes keep part boundaries easy to read in logs
+    return max(PART_SIZE, (needed + MB - 1) // MB * MB)
+
+
+def stream_part_size(number):
+    """Size of part <number> of a stream upload."""
+    return min(PART_SIZE << ((number - 1) // STREAM_PARTS_PER_STEP), MAX_PART_SIZE)
+
+
+def load_manifest(meta_path):
+    if not meta_path:
+        return None
+    try:
+        return hash_manifest.load_manifest(meta_path)
+    except (OSError, ValueError, KeyError) as exc:
+        raise TransferError("Unusable manifest in %s: %s" % (meta_path, exc))
+
+
+############################################
+# State files
+############################################
+class State(object):
+    """JSON progress file, rewritten atomically after every part."""
+
+    def __init__(self, path, identity):
+        self.path = path
+        self.identity = identity
+        self.lock = threading.Lock()
+        self.data = None
+
+    def load(self):
+        try:
+            with open(self.path) as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if data.get("identity") != self.identity:
+            return None
+        self.data = data
+        return data
+
+    def start(self, **fields):
+        self.data = dict(fields, identity=self.identity)
+        self.save()
+
+    def record(self, field, key, value):
+        with self.lock:
+            self.data[field][str(key)] = value
+            self.save()
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as handle:
+            json.dump(self.data, handle)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        for path in (self.path, self.path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+############################################
+# S3 requests
+############################################
+def content_md5(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+def put_object(s3, uri, data):
+    UPLOAD_LIMIT.consume(len(data))
+    headers = {"content-length": str(len(data)), "content-md5": content_md5(data)}
+    s3.send_request(s3.create_request("OBJECT_PUT", uri=uri, headers=headers, body=data),
+                    retries=0)
+    count("bytes", len(data))
+
+
+def initiate_upload(s3, uri):
+    request = s3.create_request("OBJECT_POST", uri=uri,
+                                headers={"content-type": "application/octet-stream"},
+                                uri_params={"uploads": None})
+    upload_id = getTextFromXml(s3.send_request(request, retries=0)["data"], "UploadId")
+    if not upload_id:
+        raise TransferError("No UploadId returned for %s" % uri.uri())
+    return upload_id
+
+
+def put_part(s3, uri, upload_id, number, data):
+    UPLOAD_LIMIT.consume(len(data))
+    headers = {"content-length": str(len(data)), "content-md5": content_md5(data)}
+    request = s3.create_request("OBJECT_PUT", uri=uri, headers=headers, body=data,
+                                uri_params={"partNumber": str(number), "uploadId": upload_id})
+    etag = s3.send_request(request, retries=0)["headers"].get("etag", "").strip('"')
+    count("bytes", len(data))
+    return etag
+
+
+def complete_upload(s3, uri, upload_id, etags):
+    parts = "".join(
+        "<Part><PartNumber>%d</PartNumber><ETag>\"%s\"</ETag></Part>" % (number, etags[number])
+        for number in sorted(etags)
+    )
+    body = "<CompleteMultipartUpload>%s</CompleteMultipartUpload>" % parts
+    request = s3.create_request("OBJECT_POST", uri=uri,
+                                headers={"content-length": str(len(body))}, body=body,
+                                uri_params={"uploadId": upload_id})
+    data = s3.send_request(request, retries=0)["data"]
+    # S3 reports late failures as an <Error> document in a 200 response
+    if b"<Error>" in (data or b""):
+        raise TransferError("Completing %s failed: %s" % (uri.uri(), data.decode(errors="replace")))
+
+
+def abort_upload(s3, uri, upload_id):
+    try:
+        s3.abort_multipart(uri, upload_id)
+    except Exception as exc:
+        log("Unable to abort upload %s of %s: %s" % (upload_id, uri.uri(), exc))
+
+
+def get_range(s3, uri, start, length):
+    request = s3.create_request("OBJECT_GET", uri=uri,
+                                headers={"range": "bytes=%d-%d" % (start, start + length - 1)})
+    data = s3.send_request(request, retries=0)["data"]
+    if len(data) != length:
+        raise TransferError("Short read at offset %d (%d of %d bytes)" % (start, len(data), length))
+    count("bytes", length)
+    return data
+
+
+############################################
+# Uploads
+############################################
+def remote_parts(s3, uri, upload_id):
+    """Parts S3 already holds for an upload, or None if it is gone."""
+    try:
+        parts = s3.list_multipart(uri, upload_id)
+    except S3Error:
+        return None
+    return {int(p["PartNumber"]): p["ETag"].strip('"') for p in parts if "PartNumber" in p}
+
+
+def upload_file(s3, path, uri):
+    stat = os.stat(path)
+    size = stat.st_size
+
+    if size <= PART_SIZE:
+        with open(path, "rb") as handle:
+            data = handle.read()
+        with_retries("Upload of %s" % uri.uri(), put_object, s3, uri, data)
+        return
+
+    part_size = file_part_size(size)
+    if part_size > MAX_PART_SIZE:
+        raise TransferError("%s is too large for a multipart upload (%d bytes)" % (path, size))
+    if part_size != PART_SIZE:
+        log("Uploading %s in %d MB parts to stay within %d parts"
+            % (uri.uri(), part_size // MB, MAX_PARTS))
+
+    # The part size is part of the identity, so a resume uses the same parts
+    state = State(path + ".upload.json",
+                  [uri.uri(), size, int(stat.st_mtime), part_size])
+    done = {}
+    upload_id = None
+    if state.load():
+        upload_id = state.data["upload_id"]
+        present = remote_parts(s3, uri, upload_id)
+        if present is None:
+            upload_id = None
+        else:
+            done = {int(n): etag for n, etag in state.data["parts"].items()
+                    if present.get(int(n)) == etag}
+            log("Resuming upload of %s: %d of %d parts already stored"
+                % (uri.uri(), len(done), part_count(size, part_size)))
+
+    if upload_id is None:
+        upload_id = initiate_upload(s3, uri)
+    state.start(upload_id=upload_id, parts={str(n): e for n, e in done.items()})
+
+    fd = os.open(path, os.O_RDONLY)
+
+    def send(number):
+        data = os.pread(fd, part_size, (number - 1) * part_size)
+        etag = with_retries("Part %d of %s" % (number, uri.uri()),
+                            put_part, s3, uri, upload_id, number, data)
+        state.record("parts", number, etag)
+        return number, etag
+
+    failures = []
+    try:
+        with ThreadPoolExecutor(CONCURRENCY) as pool:
+            todo = [n for n in range(1, part_count(size, part_size) + 1) if n not in done]
+            for future in as_completed([pool.submit(send, n) for n in todo]):
+                try:
+                    number, etag = future.result()
+                    done[number] = etag
+                except TransferError as exc:
+                    failures.append(str(exc))
+    finally:
+        os.close(fd)
+
+    if failures:
+        raise TransferError("; ".join(failures) + " (state kept in %s)" % state.path)
+
+    complete_upload(s3, uri, upload_id, done)
+    state.remove()
+
+
+def upload_stream(s3, stream, uri):
+    data = read_exact(stream, PART_SIZE)
+    if len(data) < PART_SIZE:
+        with_retries("Upload of %s" % uri.uri(), put_object, s3, uri, data)
+        return
+
+    upload_id = initiate_upload(s3, uri)
+    etags = {}
+
+    def send(number, data):
+        return number, with_retries("Part %d of %s" % (number, uri.uri()),
+                                    put_part, s3, uri, upload_id, number, data)
+
+    try:
+        with ThreadPoolExecutor(CONCURRENCY) as pool:
+            pending = {}
+            number = 1
+            while data:
+                if number > MAX_PARTS:
+                    raise TransferError("%s exceeds %d parts" % (uri.uri(), MAX_PARTS))
+                pending[pool.submit(send, number, data)] = len(data)
+                # Bound memory to CONCURRENCY * PART_SIZE bytes in flight,
+                # or one part once parts have grown larger than that
+                while pending and sum(pending.values()) >= CONCURRENCY * PART_SIZE:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        etags.update([future.result()])
+                        del pending[future]
+                number += 1
+                if number % STREAM_PARTS_PER_STEP == 1 and number > 1:
+                    log("Upload of %s reached %d parts, continuing in %d MB parts"
+                        % (uri.uri(), number - 1, stream_part_size(number) // MB))
+                data = read_exact(stream, stream_part_size(number))
+            etags.update(f.result() for f in pending)
+        complete_upload(s3, uri, upload_id, etags)
+    except BaseException:
+        abort_upload(s3, uri, upload_id)
+        raise
+
+
+############################################
+# Downloads
+############################################
+def object_identity(s3, uri):
+    headers = s3.object_info(uri)["headers"]
+    return int(headers["content-length"]), headers.get("etag", "").strip('"')
+
+
+class Ranges(object):
+    """Byte ranges of an object, checked against a hash manifest if given.
+
+    With a manifest, parts line up with its chunks, and a part whose
+    digest does not match is treated as a failed transfer and fetched
+    again.
+    """
+
+    def __init__(self, s3, uri, size, manifest=None):
+        self.s3 = s3
+        self.uri = uri
+        self.size = size
+        self.manifest = manifest
+        self.part_size = manifest["chunk_size"] if manifest else PART_SIZE
+        if manifest and manifest["size"] != size:
+            raise TransferError("%s is %d bytes, its manifest expects %d"
+                                % (uri.uri(), size, manifest["size"]))
+
+    def count(self):
+        return max((self.size + self.part_size - 1) // self.part_size, 1) if self.size else 0
+
+    def span(self, number):
+        offset = (number - 1) * self.part_size
+        return offset, min(self.part_size, self.size - offset)
+
+    def get_verified(self, number):
+        offset, length = self.span(number)
+        data = get_range(self.s3, self.uri, offset, length)
+        if self.manifest and hash_manifest.digest(data) != self.manifest["chunks"][number - 1]:
+            raise TransferError("Chunk %d (bytes %d-%d) is corrupt"
+                                % (number, offset, offset + length - 1))
+        return data
+
+    def fetch(self, number):
+        return with_retries("Part %d of %s" % (number, self.uri.uri()), self.get_verified, number)
+
+
+def download_file(s3, uri, path, manifest=None):
+    size, etag = object_identity(s3, uri)
+    ranges = Ranges(s3, uri, size, manifest)
+    partial = path + ".part"
+    state = State(path + ".download.json", [uri.uri(), size, etag, ranges.part_size])
+    all_parts = range(1, ranges.count() + 1)
+
+    if state.load() and os.path.exists(partial) and os.path.getsize(partial) == size:
+        todo = [n for n in all_parts if str(n) not in state.data["parts"]]
+        log("Resuming download of %s: %d of %d parts already local"
+            % (uri.uri(), ranges.count() - len(todo), ranges.count()))
+        state.start(parts=dict(state.data["parts"]))
+    elif manifest and os.path.exists(path) and not os.path.exists(partial):
+        # Repair an existing copy in place by re-fetching only corrupt chunks
+        os.replace(path, partial)
+        if os.path.getsize(partial) != size:
+            os.truncate(partial, size)
+        todo = [index + 1 for index in hash_manifest.corrupt_chunks(partial, manifest)]
+        log("Repairing %s: %d of %d chunks are corrupt" % (path, len(todo), ranges.count()))
+        state.start(parts={})
+    else:
+        with open(partial, "wb") as handle:
+            handle.truncate(size)
+        todo = list(all_parts)
+        state.start(parts={})
+
+    fd = os.open(partial, os.O_WRONLY)
+
+    def fetch(number):
+        os.pwrite(fd, ranges.fetch(number), ranges.span(number)[0])
+        state.record("parts", number, True)
+
+    failures = []
+    try:
+        with ThreadPoolExecutor(CONCURRENCY) as pool:
+            for future in as_completed([pool.submit(fetch, n) for n in todo]):
+                try:
+                    future.result()
+                except TransferError as exc:
+                    failures.append(str(exc))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    if failures:
+        raise TransferError("; ".join(failures) + " (state kept in %s)" % state.path)
+
+    os.replace(partial, path)
+    state.remove()
+
+
+def download_stream(s3, uri, sink, manifest=None):
+    size, _ = object_identity(s3, uri)
+    ranges = Ranges(s3, uri, size, manifest)
+
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        # Parts are fetched (and verified) ahead but written strictly in order
+        pending = []
+        for number in range(1, ranges.count() + 1):
+            pending.append(pool.submit(ranges.fetch, number))
+            if len(pending) >= CONCURRENCY:
+                sink.write(pending.pop(0).result())
+        for future in pending:
+            sink.write(future.result())
+    sink.flush()
+
+
+############################################
+# Abandoned uploads
+############################################
+def abort_stale(s3, bucket_uri, hours):
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=hours)
+    aborted = 0
+    for upload in s3.get_multipart(bucket_uri):
+        started = datetime.strptime(upload["Initiated"][:19], "%Y-%m-%dT%H:%M:%S")
+        if started.replace(tzinfo=timezone.utc) > cutoff:
+            continue
+        uri = S3Uri("s3://%s/%s" % (bucket_uri.bucket(), upload["Key"]))
+        abort_upload(s3, uri, upload["UploadId"])
+        sys.stdout.write("%s\n" % upload["Key"])
+        aborted += 1
+    return aborted
+
+
+def main(argv):
+    if len(argv) not in (4, 5) or argv[1] not in ("upload", "download", "abort-stale") \
+            or (len(argv) == 5 and argv[1] != "download"):
+        sys.stderr.write(__doc__)
+        return 2
+
+    s3 = S3(Config(os.environ.get("S3CMD_CONFIG", os.path.expanduser("~/.s3cfg"))))
+    action, source, target = argv[1:4]
+
+    try:
+        if action == "upload" and source == "-":
+            upload_stream(s3, sys.stdin.buffer, S3Uri(target))
+        elif action == "upload":
+            upload_file(s3, source, S3Uri(target))
+        elif action == "download":
+            manifest = load_manifest(argv[4] if len(argv) == 5 else None)
+            if target == "-":
+                download_stream(s3, S3Uri(source), sys.stdout.buffer, manifest)
+            else:
+                download_file(s3, S3Uri(source), target, manifest)
+        else:
+            abort_stale(s3, S3Uri(source), float(target))
+    except (TransferError, S3Error, OSError) as exc:
+        log("%s %s failed: %s" % (action, source, exc))
+        return 1
+    finally:
+        if action != "abort-stale":
+            write_stats()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
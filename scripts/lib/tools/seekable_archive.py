@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""Seekable custom-format archives for selective restores.
+
+Usage:
+    seekable_archive.py build <dump> <index.json> [<archive> <command>...]
+    seekable_archive.py extract <archive> <index.json> <list> [<command>...]
+
+build reads a pg_dump custom-format file and writes <index.json>. Given
+<archive> and a compression command, it also compresses the dump into
+<archive> in independent blocks of SEEKABLE_BLOCK_MB megabytes, one run
+of <command> per block. Concatenated gzip members and zstd frames are
+still one valid stream, so the archive restores like any other.
+Without <archive>, the dump is stored as it is and indexed in place.
+
+The index records where each block sits in the archive, with its
+SHA-256. It also records the byte range in the dump of the header and
+TOC, and of the data of every TOC entry that has data (TABLE DATA,
+BLOBS, ...). The ranges are found by walking the archive format, as
+pg_restore does (pg_backup_archiver.c, pg_backup_custom.c).
+
+extract writes a dump holding the header and TOC plus the data of the
+entries in <list>, in archive order, with the data offsets in the TOC
+pointing at their new positions. <list> is pg_restore -l output,
+usually narrowed by pg_restore's own -t/-n/-L options. pg_restore can
+read the result from a pipe or from a file, in parallel. Only the blocks covering those ranges are
+read: with ranged GETs when <archive> is an s3:// URI, with
+S3_TRANSFER_CONCURRENCY blocks in flight. Each block is checked against
+its SHA-256 and decompressed with <command>. An empty <list> gives
+just the header and TOC, which is all pg_restore -l needs.
+
+S3 archives use the s3cmd library and ~/.s3cfg (or S3CMD_CONFIG), like
+s3_transfer.py.
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+MB = 1024 * 1024
+
+ARCH_CUSTOM = 1
+BLK_DATA = 1
+BLK_BLOBS = 3
+K_OFFSET_POS_NOT_SET = 1
+K_OFFSET_POS_SET = 2
+K_OFFSET_NO_DATA = 3
+
+
+class FormatError(Exception):
+    pass
+
+
+def log(message):
+    sys.stderr.write("%s\n" % message)
+    sys.stderr.flush()
+
+
+def env_int(name, default, minimum=1):
+    try:
+        return max(int(os.environ.get(name, default)), minimum)
+    except ValueError:
+        return default
+
+
+def archive_version(major, minor, revision=0):
+    return (major << 16) | (minor << 8) | revision
+
+
+############################################
+# Custom-format parsing
+############################################
+class DumpReader(object):
+    """Reads the integers and strings of a custom-format archive."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.int_size = 4
+        self.off_size = 8
+
+    def read(self, size):
+        data = self.handle.read(size)
+        if len(data) != size:
+            raise FormatError("unexpected end of archive at offset %d" % self.tell())
+        return data
+
+    def byte(self):
+        return self.read(1)[0]
+
+    def int(self):
+        negative = self.byte()
+        value = int.from_bytes(self.read(self.int_size), "little")
+        return -value if negative else value
+
+    def str(self):
+        length = self.int()
+        if length < 0:
+            return None
+        return self.read(length).decode("utf-8", "replace")
+
+    def skip(self, size):
+        self.handle.seek(size, os.SEEK_CUR)
+
+    def tell(self):
+        return self.handle.tell()
+
+
+def read_header(reader):
+    if reader.read(5) != b"PGDMP":
+        raise FormatError("not a pg_dump archive")
+    version = archive_version(reader.byte(), reader.byte(), reader.byte())
+    if version < archive_version(1, 12):
+        raise FormatError("archive version %d.%d is not supported" % (version >> 16, (version >> 8) & 255))
+
+    reader.int_size = reader.byte()
+    reader.off_size = reader.byte()
+    if reader.byte() != ARCH_CUSTOM:
+        raise FormatError("not a custom-format archive")
+
+    if version >= archive_version(1, 15):
+        reader.byte()  # compression algorithm
+    else:
+        reader.int()  # compression level
+    for _ in range(7):
+        reader.int()  # creation time
+    reader.str()  # database name
+    reader.str()  # server version
+    reader.str()  # pg_dump version
+    return version
+
+
+def read_toc(reader, version):
+    entries = []
+    for _ in range(reader.int()):
+        entry = {"id": reader.int()}
+        reader.int()  # has data dumper
+        reader.str()  # table oid
+        reader.str()  # oid
+        entry["tag"] = reader.str()
+        entry["desc"] = reader.str()
+        reader.int()  # section
+        reader.str()  # definition
+        reader.str()  # drop statement
+        reader.str()  # copy statement
+        entry["namespace"] = reader.str()
+        reader.str()  # tablespace
+        if version >= archive_version(1, 14):
+            reader.str()  # table access method
+        if version >= archive_version(1, 16):
+            reader.int()  # relkind
+        reader.str()  # owner
+        reader.str()  # "with oids", always false
+        while reader.str() is not None:
+            pass  # dependencies
+        entry["toc_offset"] = reader.tell()
+        state = reader.byte()
+        reader.read(reader.off_size)  # data offset, rewritten by extract
+        if state != K_OFFSET_NO_DATA:
+            entries.append(entry)
+    return entries
+
+
+def skip_chunks(reader):
+    length = reader.int()
+    while length != 0:
+        reader.skip(length)
+        length = reader.int()
+
+
+def read_data_ranges(reader, size):
+    """Map dump ids to the [start, end) byte range of their data block."""
+    ranges = {}
+    while reader.tell() < size:
+        start = reader.tell()
+        kind = reader.byte()
+        dump_id = reader.int()
+        if kind == BLK_DATA:
+            skip_chunks(reader)
+        elif kind == BLK_BLOBS:
+            while reader.int() != 0:
+                skip_chunks(reader)
+        else:
+            raise FormatError("unknown block type %d at offset %d" % (kind, start))
+        ranges[dump_id] = (start, reader.tell())
+    if reader.tell() != size:
+        raise FormatError("data block runs past the end of the archive")
+    return ranges
+
+
+def parse_dump(path):
+    size = os.path.getsize(path)
+    with open(path, "rb") as handle:
+        reader = DumpReader(handle)
+        version = read_header(reader)
+        entries = read_toc(reader, version)
+        toc_end = reader.tell()
+        ranges = read_data_ranges(reader, size)
+        off_size = reader.off_size
+
+    indexed = []
+    for entry in entries:
+        if entry["id"] in ranges:
+            entry["start"], entry["end"] = ranges[entry["id"]]
+            indexed.append(entry)
+    return size, toc_end, off_size, indexed
+
+
+############################################
+# Build
+############################################
+def run_command(command, data):
+    return subprocess.run(command, input=data, stdout=subprocess.PIPE, check=True).stdout
+
+
+def read_blocks(path, block_size):
+    with open(path, "rb") as handle:
+        while True:
+            data = handle.read(block_size)
+            if not data:
+                return
+            yield data
+
+
+def ordered(pool, fn, items, window):
+    """pool.map with at most <window> results held in memory."""
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def build(dump, index_path, archive=None, command=None):
+    block_size = env_int("SEEKABLE_BLOCK_MB", 16) * MB
+    size, toc_end, off_size, entries = parse_dump(dump)
+    threads = os.cpu_count() or 1
+
+    if archive:
+        encode = lambda data: run_command(command, data)
+    else:
+        encode = lambda data: data
+
+    blocks = []
+    offset = 0
+    sink = open(archive + ".tmp", "wb") if archive else None
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            for data in ordered(pool, encode, read_blocks(dump, block_size), threads * 2):
+                if sink:
+                    sink.write(data)
+                blocks.append([offset, len(data), hashlib.sha256(data).hexdigest()])
+                offset += len(data)
+        if sink:
+            sink.close()
+            os.replace(archive + ".tmp", archive)
+    except BaseException:
+        if sink:
+            sink.close()
+            os.unlink(archive + ".tmp")
+        raise
+
+    index = {
+        "version": 1,
+        "compressed": bool(archive),
+        "block_size": block_size,
+        "size": size,
+        "toc_end": toc_end,
+        "offset_size": off_size,
+        "blocks": blocks,
+        "entries": entries,
+    }
+    with open(index_path + ".tmp", "w") as handle:
+        json.dump(index, handle, separators=(",", ":"))
+    os.replace(index_path + ".tmp", index_path)
+    log("Indexed %d data entries in %d blocks" % (len(entries), len(blocks)))
+
+
+############################################
+# Extract
+############################################
+class LocalSource(object):
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, offset, length):
+        with open(self.path, "rb") as handle:
+            handle.seek(offset)
+            return handle.read(length)
+
+
+class S3Source(object):
+    def __init__(self, uri):
+        from S3.Config import Config
+        from S3.S3 import S3
+        from S3.S3Uri import S3Uri
+
+        import s3_transfer
+
+        self.transfer = s3_transfer
+        self.s3 = S3(Config(os.environ.get("S3CMD_CONFIG", os.path.expanduser("~/.s3cfg"))))
+        self.uri = S3Uri(uri)
+
+    def read(self, offset, length):
+        return self.transfer.get_range(self.s3, self.uri, offset, length)
+
+
+def wanted_ids(list_path):
+    ids = set()
+    with open(list_path) as handle:
+        for line in handle:
+            match = re.match(r"\s*(\d+);", line)
+            if match:
+                ids.add(int(match.group(1)))
+    return ids
+
+
+def rewrite_offsets(toc, index, wanted):
+    """Point the TOC at where extract writes each entry's data.
+
+    The offsets pg_dump wrote are positions in the full dump. Entries
+    that are left out are marked as having no known position, so a
+    restore that asks for them fails instead of reading the wrong data.
+    """
+    size = index["offset_size"]
+    position = index["toc_end"]
+    for entry in sorted(index["entries"], key=lambda e: e["start"]):
+        at = entry["toc_offset"]
+        if entry["id"] in wanted:
+            toc[at] = K_OFFSET_POS_SET
+            toc[at + 1:at + 1 + size] = position.to_bytes(size, "little")
+            position += entry["end"] - entry["start"]
+        else:
+            toc[at] = K_OFFSET_POS_NOT_SET
+            toc[at + 1:at + 1 + size] = bytes(size)
+
+
+def extract(location, index_path, list_path, command, sink):
+    with open(index_path) as handle:
+        index = json.load(handle)
+    wanted = wanted_ids(list_path)
+    block_size = index["block_size"]
+    size = index["size"]
+
+    spans = [(0, index["toc_end"])]
+    spans += sorted((e["start"], e["end"]) for e in index["entries"] if e["id"] in wanted)
+
+    needed = []
+    for start, end in spans:
+        for number in range(start // block_size, (end - 1) // block_size + 1):
+            if not needed or needed[-1] != number:
+                needed.append(number)
+
+    source = S3Source(location) if location.startswith("s3://") else LocalSource(location)
+    label = os.path.basename(location)
+
+    def fetch_once(number):
+        offset, length, digest = index["blocks"][number]
+        data = source.read(offset, length)
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise FormatError("block %d of %s is corrupt" % (number, label))
+        return data
+
+    def fetch(number):
+        if isinstance(source, S3Source):
+            data = source.transfer.with_retries("Block %d of %s" % (number, label), fetch_once, number)
+        else:
+            data = fetch_once(number)
+        if index["compressed"]:
+            data = run_command(command, data)
+        expected = min(block_size, size - number * block_size)
+        if len(data) != expected:
+            raise FormatError("block %d of %s holds %d bytes, expected %d" % (number, label, len(data), expected))
+        return number, data
+
+    # The header and TOC are held until the offsets are rewritten
+    toc = bytearray()
+
+    def write(span, data):
+        if span > 0:
+            sink.write(data)
+            return
+        toc.extend(data)
+        if len(toc) == index["toc_end"]:
+            rewrite_offsets(toc, index, wanted)
+            sink.write(toc)
+
+    concurrency = env_int("S3_TRANSFER_CONCURRENCY", 4)
+    span = 0
+    with ThreadPoolExecutor(concurrency) as pool:
+        for number, data in ordered(pool, fetch, needed, concurrency):
+            block_start = number * block_size
+            block_end = block_start + len(data)
+            while span < len(spans) and spans[span][0] < block_end:
+                start, end = spans[span]
+                write(span, data[max(start, block_start) - block_start:min(end, block_end) - block_start])
+                if end > block_end:
+                    break
+                span += 1
+    sink.flush()
+
+    fetched = sum(index["blocks"][n][1] for n in needed)
+    stored = sum(block[1] for block in index["blocks"])
+    log("Read %d of %d blocks (%d of %d bytes) for %d entries"
+        % (len(needed), len(index["blocks"]), fetched, stored, len(spans) - 1))
+
+
+def main(argv):
+    if len(argv) < 4 or argv[1] not in ("build", "extract") \
+            or (argv[1] == "build" and len(argv) == 5) \
+            or (argv[1] == "extract" and len(argv) < 5):
+        sys.stderr.write(__doc__)
+        return 2
+
+    action = argv[1]
+    location = argv[2]
+    try:
+        if action == "build":
+            build(location, argv[3], argv[4] if len(argv) > 4 else None, argv[5:])
+        else:
+            extract(location, argv[3], argv[4], argv[5:], sys.stdout.buffer)
+    except BrokenPipeError:
+        return 1
+    except Exception as exc:
+        log("%s %s failed: %s" % (action, location, exc))
+        return 1
+    finally:
+        if location.startswith("s3://") and "s3_transfer" in sys.modules:
+            sys.modules["s3_transfer"].write_stats()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Bandwidth limits for backup streams and uploads.
+
+Usage:
+    throttle.py <MB/s>
+
+Copies stdin to stdout at no more than <MB/s> megabytes per second.
+A slow reader makes pg_dump block on its connection, so limiting the
+dump stream also limits the I/O the dump causes on the server.
+
+When THROTTLE_STATE names a file, the limit is multiplied by the
+factor held in that file (see throttle.sh). The file is read again
+every second, so a long transfer slows down and speeds up with the
+load on the database.
+
+s3_transfer.py paces uploads with the same Limiter, set from
+THROTTLE_UPLOAD_MBPS.
+"""
+import os
+import sys
+import threading
+import time
+
+MB = 1024 * 1024
+BLOCK = 256 * 1024
+STATE_POLL = 1.0
+
+
+def read_factor(path):
+    try:
+        with open(path) as handle:
+            return min(max(float(handle.read().split()[0]), 0.01), 1.0)
+    except (OSError, ValueError, IndexError):
+        return 1.0
+
+
+class Limiter:
+    """Paces callers so that the bytes they consume keep to a rate.
+
+    Thread safe: parts uploaded in parallel share one limit.
+    """
+
+    def __init__(self, mbps):
+        self.rate = mbps * MB
+        self.state = os.environ.get("THROTTLE_STATE")
+        self.factor = 1.0
+        self.checked = 0.0
+        self.next_free = time.monotonic()
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return self.rate > 0
+
+    def current_rate(self, now):
+        if self.state and now - self.checked >= STATE_POLL:
+            self.factor = read_factor(self.state)
+            self.checked = now
+        return self.rate * self.factor
+
+    def consume(self, size):
+        if not self.enabled():
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_free = max(self.next_free, now) + size / self.current_rate(now)
+            ready = self.next_free
+        # Released once the bytes fit the rate, so whole parts average out
+        if ready > now:
+            time.sleep(ready - now)
+
+
+def env_limiter(name):
+    try:
+        return Limiter(max(float(os.environ.get(name, 0)), 0))
+    except ValueError:
+        return Limiter(0)
+
+
+def copy(source, sink, limiter):
+    while True:
+        block = source.read(BLOCK)
+        if not block:
+            break
+        limiter.consume(len(block))
+        sink.write(block)
+    sink.flush()
+
+
+def main(argv):
+    try:
+        mbps = float(argv[1]) if len(argv) == 2 else -1
+    except ValueError:
+        mbps = -1
+    if mbps < 0:
+        sys.stderr.write(__doc__)
+        return 2
+
+    try:
+        copy(sys.stdin.buffer, sys.stdout.buffer, Limiter(mbps))
+    except BrokenPipeError:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,276 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+
+############################################
+# Helpers
+############################################
+upload_queue_log() {
+  log "[Upload Queue] $*"
+}
+
+upload_queue_enabled() {
+  [[ "${STORAGE_BACKEND:-}" =~ ^([Ss]3)$ && "${UPLOAD_QUEUE:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+upload_queue_dir() {
+  echo "${UPLOAD_QUEUE_DIR:-${MYBASEDIR}/.upload-queue}"
+}
+
+# Held by the uploader for as long as it runs
+upload_queue_lock_file() {
+  echo "$(upload_queue_dir)/.uploader.lock"
+}
+
+############################################
+# Upload queue (S3 backend)
+# With UPLOAD_QUEUE, a finished dump stays on local disk and a job file
+# is written for it in UPLOAD_QUEUE_DIR instead of uploading it inline,
+# so the next pg_dump starts right away. The uploader (upload_queue.sh,
+# started next to cron or the scheduler) ships queued artifacts with
+# their sidecars, UPLOAD_QUEUE_CONCURRENCY at a time, every
+# UPLOAD_QUEUE_INTERVAL seconds. One job per artifact:
+#   {"artifact", "database", "queued", "bytes", "attempts", "record"}
+# "record" is the staged catalog record; it is added to the catalog once
+# the upload is confirmed, and local copies are only removed then.
+#
+# Jobs are files, so uploads interrupted by a restart are picked up
+# again, and s3_transfer resumes the parts already sent. Artifacts that
+# would take the queue over UPLOAD_QUEUE_MAX_MB are uploaded inline.
+############################################
+
+############################################
+# Queue a finished artifact
+# Usage: upload_queue_add <db> <artifact>
+# Runs once catalog_stage has staged the record of <artifact>. Returns
+# 1 when the queue is disabled or full, and the caller uploads inline.
+############################################
+upload_queue_add() {
+  local db="$1"
+  local artifact="$2"
+  local dir pending name bytes
+  local limit=$(( ${UPLOAD_QUEUE_MAX_MB:-10240} * 1024 * 1024 ))
+
+  upload_queue_enabled || return 1
+
+  dir="$(upload_queue_dir)"
+  pending="$(catalog_file).${db}.pending"
+  name="$(basename "${artifact}")"
+  bytes="$(stat -c %s "${artifact}")"
+  create_non_existing_directory "${dir}"
+
+  (
+    flock 9
+
+    local queued tmp
+    queued="$(upload_queue_bytes "${dir}")"
+    if (( limit > 0 && queued + bytes > limit )); then
+      upload_queue_log "WARNING: Queue holds $(( queued / 1024 / 1024 )) MB, uploading ${name} inline (UPLOAD_QUEUE_MAX_MB=${UPLOAD_QUEUE_MAX_MB:-10240})"
+      exit 1
+    fi
+
+    tmp="$(mktemp "${dir}/.new.XXXXXX")" || exit 1
+    jq -n -c \
+      --arg artifact "${artifact}" \
+      --arg database "${db}" \
+      --argjson queued "${EPOCHSECONDS}" \
+      --argjson bytes "${bytes}" \
+      --slurpfile record "$([[ -f "${pending}" ]] && echo "${pending}" || echo /dev/null)" \
+      '{artifact: $artifact, database: $database, queued: $queued, bytes: $bytes,
+        attempts: 0, record: ($record[0] // null)}' > "${tmp}" \
+      && mv -f "${tmp}" "${dir}/${name}.job"
+  ) 9> "${dir}/.lock" || return 1
+
+  # The record is committed by the uploader
+  rm -f "${pending}"
+  upload_queue_log "Queued ${name} ($(( bytes / 1024 / 1024 )) MB) for upload"
+}
+
+# Bytes of all queued artifacts
+upload_queue_bytes() {
+  find "$1" -maxdepth 1 -type f -name '*.job' -exec cat {} + 2>/dev/null \
+    | jq -s 'map(.bytes) | add // 0'
+}
+
+############################################
+# Upload one queued artifact
+# Usage: upload_queue_ship <job_file>
+# A failed upload stays queued and is retried on the next pass.
+############################################
+upload_queue_ship() {
+  local job="$1"
+  local artifact database name attempts record
+  local rc=0
+
+  [[ -f "${job}" ]] || return 0
+
+  artifact="$(jq -r '.artifact' "${job}")"
+  database="$(jq -r '.database' "${job}")"
+  name="$(basename "${artifact}")"
+
+  if [[ ! -f "${artifact}" ]]; then
+    upload_queue_log "ERROR: ${artifact} is gone, dropping it from the queue"
+    rm -f "${job}"
+    return 1
+  fi
+
+  metrics_begin
+  s3_upload "${artifact}" || rc=$?
+  metrics_end "${database}" upload "${artifact}" transfer "${rc}"
+
+  if (( rc != 0 )); then
+    attempts="$(jq '.attempts + 1' "${job}")"
+    jq -c --argjson attempts "${attempts}" '.attempts = $attempts' "${job}" > "${job}.tmp" \
+      && mv -f "${job}.tmp" "${job}"
+    upload_queue_log "ERROR: Upload of ${name} failed (attempt ${attempts}), keeping it queued"
+    return "${rc}"
+  fi
+
+  if jq -e '.record' "${job}" >/dev/null; then
+    record="$(mktemp /tmp/upload-queue-record.XXXXXX)"
+    jq -c '.record' "${job}" > "${record}"
+    catalog_append "${record}"
+    rm -f "${record}"
+  fi
+
+  if [[ "${S3_RETAIN_LOCAL_DUMPS:-false}" =~ ^([Ff][Aa][Ll][Ss][Ee])$ ]]; then
+    cleanup_file "${artifact}.sha256"
+    cleanup_file "${artifact}.manifest.json"
+    cleanup_file "${artifact}"
+    cleanup_file "${artifact}.meta.json"
+    cleanup_file "${artifact}.index.json"
+  fi
+
+  upload_queue_log "Uploaded ${name}, queued $(( EPOCHSECONDS - $(jq '.queued' "${job}") ))s ago"
+  rm -f "${job}"
+}
+
+############################################
+# Upload everything queued
+# Oldest jobs go first; a job that failed is moved to the back.
+############################################
+upload_queue_drain() {
+  local dir status_file failed
+  local failures=0
+  local jobs=()
+
+  dir="$(upload_queue_dir)"
+  [[ -d "${dir}" ]] || return 0
+
+  mapfile -t jobs < <(find "${dir}" -maxdepth 1 -type f -name '*.job' -printf '%T@ %p\n' \
+    | sort -n | cut -d ' ' -f 2-)
+  (( ${#jobs[@]} > 0 )) || return 0
+
+  upload_queue_log "Uploading ${#jobs[@]} queued artifacts"
+  status_file="$(mktemp /tmp/upload-queue-status.XXXXXX)"
+  run_job_pool "${UPLOAD_QUEUE_CONCURRENCY:-2}" "${status_file}" upload_queue_ship "${jobs[@]}"
+  failed="$(job_pool_failures "${status_file}")"
+  rm -f "${status_file}"
+
+  [[ -n "${failed}" ]] && failures="$(wc -l <<< "${failed}")"
+
+  # Publish the records of the uploads that went through
+  if (( failures < ${#jobs[@]} )); then
+    catalog_publish
+  fi
+
+  if (( failures > 0 )); then
+    upload_queue_log "WARNING: ${failures} uploads failed and stay queued"
+    return 1
+  fi
+}
+
+############################################
+# Drain the queue when no uploader is running
+# RUN_ONCE containers have no uploader, so the backup run uploads its
+# own artifacts before it exits.
+############################################
+upload_queue_flush() {
+  local dir fd rc=0
+
+  upload_queue_enabled || return 0
+
+  dir="$(upload_queue_dir)"
+  create_non_existing_directory "${dir}"
+
+  exec {fd}>> "$(upload_queue_lock_file)"
+  if ! flock -n "${fd}"; then
+    exec {fd}>&-
+    return 0
+  fi
+
+  upload_queue_drain || rc=$?
+  upload_queue_report
+  exec {fd}>&-
+  return "${rc}"
+}
+
+############################################
+# Queue depth and age
+# Logged while artifacts are waiting, and written to
+# METRICS_DIR/pg_backup_upload_queue.prom when metrics are enabled.
+############################################
+upload_queue_report() {
+  local dir depth bytes oldest age=0 prom
+
+  dir="$(upload_queue_dir)"
+  read -r depth bytes oldest < <(
+    find "${dir}" -maxdepth 1 -type f -name '*.job' -exec cat {} + 2>/dev/null \
+      | jq -rs '"\(length) \(map(.bytes) | add // 0) \(map(.queued) | min // 0)"'
+  )
+  (( depth > 0 )) && age=$(( EPOCHSECONDS - oldest ))
+
+  (( depth > 0 )) \
+    && upload_queue_log "${depth} artifacts ($(( bytes / 1024 / 1024 )) MB) waiting for upload, oldest queued ${age}s ago"
+
+  metrics_enabled || return 0
+
+  prom="${METRICS_DIR}/pg_backup_upload_queue.prom"
+  create_non_existing_directory "${METRICS_DIR}"
+  cat > "${prom}.tmp" <<EOF
+# HELP pg_backup_upload_queue_depth Artifacts waiting for upload.
+# TYPE pg_backup_upload_queue_depth gauge
+pg_backup_upload_queue_depth ${depth}
+# HELP pg_backup_upload_queue_bytes Bytes waiting for upload.
+# TYPE pg_backup_upload_queue_bytes gauge
+pg_backup_upload_queue_bytes ${bytes}
+# HELP pg_backup_upload_queue_oldest_seconds Age of the oldest queued artifact.
+# TYPE pg_backup_upload_queue_oldest_seconds gauge
+pg_backup_upload_queue_oldest_seconds ${age}
+EOF
+  mv -f "${prom}.tmp" "${prom}"
+}
+
+############################################
+# Main loop of the uploader
+# Usage: upload_queue_loop
+# Only one uploader runs at a time; a second one waits for the lock.
+############################################
+upload_queue_loop() {
+  local status
+
+  create_non_existing_directory "$(upload_queue_dir)"
+  exec {UPLOAD_QUEUE_LOCK_FD}>> "$(upload_queue_lock_file)"
+  flock "${UPLOAD_QUEUE_LOCK_FD}"
+
+  # Job files left half written by an interrupted backup
+  find "$(upload_queue_dir)" -maxdepth 1 -type f -name '.new.*' -mmin +1440 -delete 2>/dev/null || true
+
+  catalog_load
+
+  while true; do
+    if find "$(upload_queue_dir)" -maxdepth 1 -type f -name '*.job' -print -quit | grep -q .; then
+      metrics_init upload
+      status="success"
+      upload_queue_drain || {
+        status="failure"
+        upload_queue_log "WARNING: Retrying failed uploads in ${UPLOAD_QUEUE_INTERVAL:-30}s"
+      }
+      metrics_finish "${status}"
+    fi
+    upload_queue_report
+
+    # Waiting on a background sleep lets SIGTERM interrupt it right away
+    sleep "${UPLOAD_QUEUE_INTERVAL:-30}" &
+    wait $! || true
+  done
+}
@@ -39,6 +39,19 @@ validate_checksum() {
     checksum_file="${archive}.sha256"
   fi
 
+  # Chunk manifests are checked in parallel, .sha256 is the fallback
+  local meta="${checksum_file%.sha256}.meta.json"
+  if has_hash_manifest "${meta}"; then
+    utils_log "Validating chunk manifest for $(basename "${archive}")"
+    local corrupt
+    if ! corrupt="$(python3 "${LIB_DIR}/tools/hash_manifest.py" verify "${checksum_file%.sha256}" "${meta}")"; then
+      utils_log "ERROR: Checksum validation FAILED for $(basename "${archive}"): $(grep -c . <<< "${corrupt}") corrupt chunks"
+      return 1
+    fi
+    utils_log "Checksum validation PASSED for $(basename "${archive}")"
+    return 0
+  fi
+
   [[ ! -f "${checksum_file}" ]] && {
     utils_log "ERROR: Checksum file missing: ${checksum_file}"
     return 1
@@ -102,10 +115,34 @@ generate_gz_checksum() {
     return 1
   }
 
-  (
-    cd "$(dirname "${gz_file}")" || return 1
-    sha256sum "$(basename "${gz_file}")" > "$(basename "${gz_file}").sha256"
-  )
+  python3 "${LIB_DIR}/tools/hash_manifest.py" create "${gz_file}" > "${gz_file}.manifest.json" \
+    || return 1
+  write_checksum_sidecar "${gz_file}"
+}
+
+############################################
+# Write <artifact>.sha256 from <artifact>.manifest.json
+# The manifest is kept as a sidecar; setup_metadata records its root.
+############################################
+write_checksum_sidecar() {
+  local artifact="$1"
+
+  printf '%s  %s\n' \
+    "$(jq -r '.sha256' "${artifact}.manifest.json")" \
+    "$(basename "${artifact}")" > "${artifact}.sha256"
+}
+
+############################################
+# Is a chunk manifest available for a metadata file?
+# Usage: has_hash_manifest <meta_file>
+# The manifest is the <artifact>.manifest.json next to <meta_file>;
+# older metadata holds the chunk list itself.
+############################################
+has_hash_manifest() {
+  local meta="$1"
+
+  [[ -f "${meta}" ]] && jq -e '.manifest.root // empty' "${meta}" >/dev/null 2>&1 || return 1
+  jq -e '.manifest.chunks' "${meta}" >/dev/null 2>&1 || [[ -f "${meta%.meta.json}.manifest.json" ]]
 }
 
 ############################################
@@ -138,9 +175,97 @@ retry() {
     fi
     sleep $(( delay * n ))
     ((n++))
+    METRICS_RETRIES=$(( ${METRICS_RETRIES:-0} + 1 ))
+  done
+}
+
+############################################
+# Single-flight lock for backup runs
+# Usage: acquire_backup_lock
+# Fails when another backup holds BACKUP_LOCK_FILE. The lock is held on
+# an inherited file descriptor, so it lasts until the run and all of
+# its children have exited.
+############################################
+acquire_backup_lock() {
+  exec {BACKUP_LOCK_FD}>> "${BACKUP_LOCK_FILE:-/tmp/pg-backup.lock}"
+  flock -n "${BACKUP_LOCK_FD}"
+}
+
+############################################
+# Whether the resident scheduler has done the run setup
+# (s3cmd config, bucket and database readiness) for this run
+############################################
+setup_is_warm() {
+  [[ "${SCHEDULER_WARM:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]
+}
+
+############################################
+# Bounded job pool helper
+# Usage: run_job_pool <concurrency> <status_file> <function> <item>...
+# Runs <function> <item> in background subshells, at most <concurrency>
+# at a time, and records "<exit_code> <item>" per job in <status_file>.
+# Call it as a plain command: errexit is ignored inside conditional
+# contexts (if, ||, &&), which would let failing jobs carry on. Use
+# job_pool_failures to inspect the outcome. While adaptive throttling
+# is on, fewer jobs run at once under load (see throttle.sh).
+############################################
+run_job_pool() {
+  local concurrency="$1"
+  local status_file="$2"
+  local job="$3"
+  shift 3
+
+  local -A running=()
+  local item limit
+
+  (( concurrency < 1 )) && concurrency=1
+  : > "${status_file}"
+
+  for item in "$@"; do
+    limit="${concurrency}"
+    [[ -n "${THROTTLE_STATE:-}" ]] && limit="$(throttle_jobs "${concurrency}")"
+    while (( ${#running[@]} >= limit )); do
+      _job_pool_reap running "${status_file}"
+    done
+
+    (
+      trap 'utils_log "ERROR: job ${job} ${item} failed at line ${LINENO}"; exit 2' ERR
+      "${job}" "${item}"
+    ) &
+    running[$!]="${item}"
+  done
+
+  while (( ${#running[@]} > 0 )); do
+    _job_pool_reap running "${status_file}"
   done
 }
 
+############################################
+# List failed job pool items
+# Usage: job_pool_failures <status_file>
+############################################
+job_pool_failures() {
+  awk '$1 != 0 { sub(/^[^ ]* /, ""); print }' "$1"
+}
+
+_job_pool_reap() {
+  local -n _jobs="$1"
+  local status_file="$2"
+  local pid=""
+  local rc=0
+
+  wait -n -p pid "${!_jobs[@]}" || rc=$?
+
+  # wait returns 127 without a pid when there is nothing left to reap
+  if [[ -z "${pid}" ]]; then
+    _jobs=()
+    return 0
+  fi
+
+  printf '%s %s\n' "${rc}" "${_jobs[$pid]}" >> "${status_file}"
+  unset "_jobs[$pid]"
+}
+
 ############################################
 # get dump format Helper
 # Usage:
@@ -161,6 +286,22 @@ get_dump_format() {
    echo "${FORMAT}"
 }
 
+############################################
+# Strip archive extension Helper
+# Usage: strip_archive_extension <filename>
+# PG_gis.24-December-2025-16-46.dmp.zst → PG_gis.24-December-2025-16-46
+############################################
+strip_archive_extension() {
+  local name="$1"
+
+  case "${name}" in
+    *.dir.tar*) echo "${name%.dir.tar*}" ;;
+    *.base.tar*) echo "${name%.base.tar*}" ;;
+    *.dmp*) echo "${name%.dmp*}" ;;
+    *) echo "${name}" ;;
+  esac
+}
+
 ############################################
 # Extract timestamp  Helper
 # Usage:
@@ -201,15 +342,21 @@ resolve_local_backup_from_date() {
   local want_date="${TARGET_ARCHIVE_DATE_ONLY:-}"
 
   local files=()
+  local key
+
+  # Catalog lookup first, directory scan as the fallback
+  if key="$(catalog_resolve)" && [[ -e "${MYBASEDIR}/${key}" ]]; then
+    echo "${MYBASEDIR}/${key}"
+    return 0
+  fi
 
   shopt -s nullglob
 
-  for path in "${search_dir}"/*.{dmp,dir.tar.gz}; do
+  for path in "${search_dir}"/*.{dmp,dmp.gz,dmp.zst,dmp.chunks,dir.tar,dir.tar.gz,dir.tar.zst}; do
     fname="$(basename "$path")"
 
     # Strip extension
-    base="${fname%.dmp}"
-    base="${base%.dir.tar.gz}"
+    base="$(strip_archive_extension "${fname}")"
 
     # Expect ...DB.DD-Month-YYYY-HH-MM
     datetime_part="${base##*.}"
@@ -261,8 +408,7 @@ resolve_local_backup_from_date() {
 
   for path in "${files[@]}"; do
     fname="$(basename "$path")"
-    base="${fname%.dmp.gz}"
-    base="${base%.dir.tar.gz}"
+    base="$(strip_archive_extension "${fname}")"
     datetime_part="${base##*.}"
 
     IFS='-' read -r day month year hour min <<< "$datetime_part"
@@ -296,8 +442,16 @@ wait_for_next_minute() {
 
 setup_metadata() {
   local backup_file="$1"
+  local compression="${2:-}"
   local checksum_field=""
   local encryption_field=""
+  local compression_field=""
+  local manifest_field=""
+  local slices_field=""
+  local source_field=""
+  local seekable_field=""
+  local unpacked_field=""
+  local streamed_field=""
 
   # Conditional checksum
   if [[ "${CHECKSUM_VALIDATION,,}" =~ ^([Tt][Rr][Uu][Ee])$ ]] && [[ -f "${backup_file}.sha256" ]]; then
@@ -311,24 +465,76 @@ EOF
   if [[ "${DB_DUMP_ENCRYPTION,,}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
     encryption_field=$(cat <<EOF
   ,"encrypted": true
+  ,"encryption": "$(encryption_cipher)"
+EOF
+)
+    # Order of the layers, set by the dump path (see decode_dump_stream)
+    if [[ -n "${DUMP_ENCODING:-}" ]]; then
+      encryption_field+=$'\n'"  ,\"encoding\": \"${DUMP_ENCODING}\""
+    fi
+  fi
+
+  # Per-chunk hashes for parallel verification and partial re-fetches
+  # stay in the <artifact>.manifest.json sidecar, stored next to it
+  if [[ -n "${checksum_field}" && -f "${backup_file}.manifest.json" ]]; then
+    manifest_field=",\"manifest\": $(jq -c '{file: ".manifest.json", root, chunk_size, count: (.chunks | length)}' "${backup_file}.manifest.json")"
+  else
+    rm -f "${backup_file}.manifest.json"
+  fi
+
+  # Slicing plan of tables exported next to the archive (see slices.sh)
+  if [[ -f "${backup_file}.slices.json" ]]; then
+    slices_field=",\"slices\": $(cat "${backup_file}.slices.json")"
+    rm -f "${backup_file}.slices.json"
+  fi
+
+  # Host the dump was read from when replica routing is on (see replicas.sh)
+  if [[ -n "${DUMP_SOURCE:-}" ]]; then
+    source_field=",\"source\": ${DUMP_SOURCE}"
+  fi
+
+  # Artifacts piped straight to the bucket (S3_STREAMING_UPLOAD)
+  if [[ "${DUMP_STREAMED:-false}" == "true" ]]; then
+    streamed_field=",\"streamed\": true"
+  fi
+
+  # Size of a directory dump before it was archived, checked by restores
+  if [[ -n "${DUMP_UNPACKED_BYTES:-}" ]]; then
+    unpacked_field=",\"unpacked_size\": ${DUMP_UNPACKED_BYTES}"
+  fi
+
+  # Block index of a seekable archive, uploaded next to it (see seekable.sh)
+  if [[ -f "${backup_file}.index.json" ]]; then
+    seekable_field=",\"seekable\": $(jq -c '{index: ".index.json", block_size, blocks: (.blocks | length)}' "${backup_file}.index.json")"
+  fi
+
+  # Codec used on top of the pg_dump output, read back by restores
+  if [[ -n "${compression}" ]]; then
+    compression_field=$(cat <<EOF
+  ,"compression": "${compression}"
 EOF
 )
   fi
 
   cat > "${backup_file}.meta.json" <<EOF
 {
-  "postgres_major_version": $(cat /tmp/pg_version.txt)${encryption_field}${checksum_field}
+  "postgres_major_version": $(cat /tmp/pg_version.txt)${encryption_field}${checksum_field}${compression_field}${manifest_field}${slices_field}${source_field}${seekable_field}${unpacked_field}${streamed_field}$(metrics_meta_field)
 }
 EOF
 }
 
 sanitize_db_names(){
-  case "${TARGET_DB:-}" in
-  postgres|template0|template1)
-    utils_log "ERROR: Refusing to restore into system database ${TARGET_DB}"
-    exit 1
-    ;;
-esac
+  local db targets=()
+  read -ra targets <<< "${TARGET_DB//,/ }"
+
+  for db in "${targets[@]}"; do
+    case "${db}" in
+    postgres|template0|template1)
+      utils_log "ERROR: Refusing to restore into system database ${db}"
+      exit 1
+      ;;
+  esac
+  done
 }
 
 file_env() {
@@ -440,6 +646,31 @@ check_pg_major_compatibility() {
   fi
 }
 
+############################################
+# Make sure a directory archive fits where it is unpacked
+# Usage: check_unpack_space <meta_file> <dest_dir> [archive]
+# Uses the unpacked size recorded at backup time. Older archives are
+# checked against their own size, which is only a lower bound.
+############################################
+check_unpack_space() {
+  local meta="$1"
+  local dest="$2"
+  local archive="${3:-}"
+  local needed="" available_kb
+
+  needed="$(jq -r '.unpacked_size // .manifest.size // empty' "${meta}" 2>/dev/null)" || needed=""
+  if [[ -z "${needed}" && -f "${archive}" ]]; then
+    needed="$(stat -c %s "${archive}")"
+  fi
+  [[ -n "${needed}" ]] || return 0
+
+  available_kb="$(df -Pk "${dest}" | awk 'NR == 2 {print $4}')"
+  if (( needed > available_kb * 1024 )); then
+    restore_log "ERROR: Unpacking needs $(( needed / 1024 / 1024 )) MB in ${dest}, only $(( available_kb / 1024 )) MB are free"
+    return 1
+  fi
+}
+
 ############################################
 # Load metadata  handling
 ############################################
@@ -455,9 +686,18 @@ load_restore_metadata() {
   fi
 
   RESTORE_META_ENCRYPTED="$(jq -r '.encrypted // false' "${meta}")"
+  RESTORE_META_ENCODING="$(jq -r '.encoding // empty' "${meta}")"
   RESTORE_META_CHECKSUM="$(jq -r '.checksum // empty' "${meta}")"
   RESTORE_META_PG_MAJOR="$(jq -r '.postgres_major_version // empty' "${meta}")"
 
+  # Sliced tables are loaded from <source><suffix>, next to the archive
+  # unless RESTORE_SLICE_SOURCE points elsewhere (the S3 object)
+  RESTORE_META_SLICES=""
+  RESTORE_META_SLICE_SOURCE="${RESTORE_SLICE_SOURCE:-${archive}}"
+  if jq -e '.slices.tables | length > 0' "${meta}" >/dev/null 2>&1; then
+    RESTORE_META_SLICES="${meta}"
+  fi
+
   if [[ -z "${RESTORE_META_PG_MAJOR}" ]]; then
     restore_log "ERROR: Metadata missing postgres_major_version"
     return 1
@@ -22,13 +22,24 @@ configure_sources() {
   local libs=(
     logging
     monitoring
+    metrics
     db
+    compression
+    catalog
     encryption
+    dedup
+    slices
+    seekable
+    physical
     s3
     retention
     restore
     restore_s3
+    restore_cache
+    restore_shadow
     restore_file
+    restore_cluster
+    restore_physical
     utils
   )
 
@@ -55,14 +66,27 @@ trap 'on_terminate' SIGTERM SIGINT
 # Init
 ############################################
 init_logging
+metrics_init restore
 
 log "Restore job started"
+
+# A physical restore rebuilds a data directory, the server must be stopped
+if physical_mode_enabled; then
+  physical_restore
+  metrics_finish success
+  log "Restore job finished"
+  exit 0
+fi
+
 # Check if DB is ready Sanity check to see if the cluster is running
 check_db_ready
 
 
 
-if [[ -n "${TARGET_DB}" && -n "${TARGET_ARCHIVE:-}" ]]; then
+if [[ "${RESTORE_CLUSTER:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+  cluster_restore
+
+elif [[ -n "${TARGET_DB}" && -n "${TARGET_ARCHIVE:-}" ]]; then
   sanitize_db_names
   run_restore "${TARGET_ARCHIVE:-}" "${TARGET_DB}"
 
@@ -79,4 +103,5 @@ else
   exit 1
 fi
 
+metrics_finish success
 log "Restore job finished"
\ No newline at end of file
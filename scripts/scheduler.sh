@@ -0,0 +1,70 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+shopt -s inherit_errexit
+
+############################################
+# STDOUT redirection
+############################################
+if [[ "${CONSOLE_LOGGING:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+  exec >> /proc/1/fd/1 2>&1
+fi
+
+############################################
+# Paths
+############################################
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+LIB_DIR="${SCRIPT_DIR}/lib"
+
+############################################
+# Load libraries
+############################################
+
+configure_sources() {
+  # Always source the environment file first
+  [[ -f /backup-scripts/pgenv.sh ]] && source /backup-scripts/pgenv.sh
+
+  # List of library modules to source
+  local libs=(
+    logging
+    monitoring
+    metrics
+    db
+    s3
+    scheduler
+    utils
+  )
+
+  for lib in "${libs[@]}"; do
+    local file="${LIB_DIR}/${lib}.sh"
+    if [[ -f "$file" ]]; then
+      source "$file"
+    else
+      echo "Warning: missing library $file" >&2
+    fi
+  done
+}
+configure_sources
+
+############################################
+# Traps
+############################################
+trap 'on_error $LINENO' ERR
+trap 'on_terminate' SIGTERM SIGINT
+
+############################################
+# Init
+############################################
+init_logging
+
+log "Backup scheduler started at $(date +%d-%B-%Y-%H-%M)" true
+
+scheduler_load
+
+if ! scheduler_warm_up; then
+  scheduler_log "Setup failed, the first run will retry it"
+fi
+
+############################################
+# Run schedules until terminated
+############################################
+scheduler_loop
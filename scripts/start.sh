@@ -61,7 +61,11 @@ env_default HOST_BUCKET ""
 env_default SSL_SECURE True
 
 env_default DUMP_ARGS "-Fc"
-env_default RESTORE_ARGS "-j 4"
+env_default RESTORE_ARGS ""
+env_default COMPRESSION gzip
+env_default COMPRESSION_LEVEL ""
+env_default COMPRESSION_THREADS 0
+env_default DUMP_JOBS 1
 
 ########################################
 # Postgres credentials
@@ -72,6 +76,9 @@ env_default POSTGRES_USER docker
 
 env_default POSTGRES_PORT 5432
 env_default POSTGRES_HOST db
+env_default POSTGRES_REPLICAS ""
+env_default REPLICA_MAX_LAG 60
+env_default REPLICA_CONNECT_TIMEOUT 5
 ########################################
 # Postgres credentials (SECRET)
 ########################################
@@ -116,12 +123,52 @@ env_default PG_CONN_PARAMETERS "-h ${POSTGRES_HOST} -p ${POSTGRES_PORT} -U ${POS
 ########################################
 env_default RUN_ONCE FALSE
 env_default DB_DUMP_ENCRYPTION FALSE
+env_default ENCRYPTION_CIPHER aes-256-gcm
+env_default ENCRYPTION_THREADS 0
 env_default DB_TABLES FALSE
+env_default TABLE_DUMP_JOBS 1
+env_default CHANGE_DETECTION false
+env_default CATALOG_REBUILD false
+env_default BACKUP_DEDUPLICATION false
+env_default DEDUP_CHUNK_KB 1024
+env_default BACKUP_MODE logical
+env_default WAL_ARCHIVING true
+env_default WAL_SLOT_NAME pg_backup
+env_default WAL_SPOOL_DIR ""
+env_default WAL_ARCHIVE_INTERVAL 10
+env_default TABLE_SLICE_MB 0
+env_default TABLE_SLICE_JOBS 2
+env_default BACKUP_CONCURRENCY 1
+env_default THROTTLE_NICE 0
+env_default THROTTLE_IO_CLASS ""
+env_default THROTTLE_IO_LEVEL 7
+env_default THROTTLE_DUMP_MBPS 0
+env_default THROTTLE_UPLOAD_MBPS 0
+env_default THROTTLE_ADAPTIVE false
+env_default THROTTLE_INTERVAL 10
+env_default THROTTLE_MAX_ACTIVE 20
+env_default THROTTLE_MAX_LAG 30
 env_default CLEANUP_DRY_RUN false
 env_default CHECKSUM_VALIDATION false
+env_default CHECKSUM_CHUNK_MB 16
 env_default S3_RETAIN_LOCAL_DUMPS false
+env_default S3_STREAMING_UPLOAD false
+env_default S3_STREAMING_RESTORE false
+env_default SEEKABLE_ARCHIVES false
+env_default SEEKABLE_BLOCK_MB 16
+env_default S3_PART_SIZE_MB 64
+env_default S3_TRANSFER_CONCURRENCY 4
+env_default S3_PART_RETRIES 5
+env_default S3_ABORT_INCOMPLETE_HOURS 24
+env_default UPLOAD_QUEUE false
+env_default UPLOAD_QUEUE_DIR ""
+env_default UPLOAD_QUEUE_CONCURRENCY 2
+env_default UPLOAD_QUEUE_MAX_MB 10240
+env_default UPLOAD_QUEUE_INTERVAL 30
 env_default CONSOLE_LOGGING true
 env_default JSON_LOGGING false
+env_default METRICS_ENABLED false
+env_default METRICS_DIR /metrics
 
 ########################################
 # Time calculations
@@ -136,10 +183,30 @@ env_default CONSOLIDATE_AFTER_MINUTES "$((CONSOLIDATE_AFTER * 24 * 60))"
 ########################################
 env_default TARGET_ARCHIVE_DATETIME ""
 env_default TARGET_ARCHIVE_DATE_ONLY ""
+env_default RESTORE_CLUSTER false
+env_default RESTORE_CONCURRENCY 2
+env_default RESTORE_JOBS auto
+env_default RESTORE_SESSION_SETTINGS "maintenance_work_mem=256MB synchronous_commit=off"
+env_default RESTORE_PGDATA ""
+env_default RESTORE_CACHE false
+env_default RESTORE_CACHE_DIR /data/restore-cache
+env_default RESTORE_CACHE_MAX_MB 10240
+env_default RESTORE_SHADOW false
+env_default RESTORE_VALIDATION_QUERY ""
+env_default RESTORE_SWAP_LOCK_TIMEOUT 10
+env_default RESTORE_KEEP_OLD_HOURS 24
 env_default MONITORING_ENDPOINT_COMMAND_START ""
 env_default MONITORING_ENDPOINT_COMMAND ""
 env_default ENTRYPOINT_START backup
 
+########################################
+# Scheduler
+########################################
+env_default BACKUP_SCHEDULES ""
+env_default SCHEDULER_JITTER_SECONDS 0
+env_default SCHEDULER_REFRESH_MINUTES 60
+env_default BACKUP_LOCK_FILE /tmp/pg-backup.lock
+
 
 ########################################
 # Cron setting
@@ -194,16 +261,29 @@ configure_env_variables() {
   local quoted_vars=(
     PATH EXTRA_CONF_DIR STORAGE_BACKEND ACCESS_KEY_ID SECRET_ACCESS_KEY
     DEFAULT_REGION BUCKET HOST_BASE HOST_BUCKET SSL_SECURE
-    DUMP_ARGS RESTORE_ARGS POSTGRES_USER POSTGRES_HOST POSTGRES_PASS
-    DUMPPREFIX ARCHIVE_FILENAME DB_DUMP_ENCRYPTION DB_DUMP_ENCRYPTION_PASS_PHRASE
+    DUMP_ARGS RESTORE_ARGS COMPRESSION COMPRESSION_LEVEL POSTGRES_USER POSTGRES_HOST POSTGRES_PASS
+    DUMPPREFIX ARCHIVE_FILENAME DB_DUMP_ENCRYPTION DB_DUMP_ENCRYPTION_PASS_PHRASE ENCRYPTION_CIPHER
     PG_CONN_PARAMETERS DB_TABLES  CLEANUP_DRY_RUN
-    CHECKSUM_VALIDATION CONSOLE_LOGGING MONITORING_ENDPOINT_COMMAND_START MONITORING_ENDPOINT_COMMAND ENTRYPOINT_START JSON_LOGGING
+    CHECKSUM_VALIDATION S3_RETAIN_LOCAL_DUMPS S3_STREAMING_UPLOAD S3_STREAMING_RESTORE CHANGE_DETECTION CATALOG_REBUILD CONSOLE_LOGGING MONITORING_ENDPOINT_COMMAND_START MONITORING_ENDPOINT_COMMAND ENTRYPOINT_START JSON_LOGGING
+    METRICS_ENABLED METRICS_DIR BACKUP_SCHEDULES BACKUP_LOCK_FILE
+    RESTORE_CLUSTER RESTORE_JOBS RESTORE_SESSION_SETTINGS BACKUP_DEDUPLICATION
+    BACKUP_MODE WAL_ARCHIVING WAL_SLOT_NAME WAL_SPOOL_DIR RESTORE_PGDATA RESTORE_CACHE RESTORE_CACHE_DIR
+    RESTORE_SHADOW RESTORE_VALIDATION_QUERY
+    THROTTLE_IO_CLASS THROTTLE_DUMP_MBPS THROTTLE_UPLOAD_MBPS THROTTLE_ADAPTIVE
+    POSTGRES_REPLICAS SEEKABLE_ARCHIVES UPLOAD_QUEUE UPLOAD_QUEUE_DIR
   )
 
   # Vars that should be unquoted (numeric values)
   local unquoted_vars=(
     POSTGRES_PORT REMOVE_BEFORE CONSOLIDATE_AFTER MIN_SAVED_FILE RUN_ONCE
-    TIME_MINUTES CONSOLIDATE_AFTER_MINUTES
+    TIME_MINUTES CONSOLIDATE_AFTER_MINUTES BACKUP_CONCURRENCY COMPRESSION_THREADS DUMP_JOBS TABLE_DUMP_JOBS ENCRYPTION_THREADS CHECKSUM_CHUNK_MB
+    S3_PART_SIZE_MB S3_TRANSFER_CONCURRENCY S3_PART_RETRIES S3_ABORT_INCOMPLETE_HOURS
+    SCHEDULER_JITTER_SECONDS SCHEDULER_REFRESH_MINUTES RESTORE_CONCURRENCY DEDUP_CHUNK_KB
+    WAL_ARCHIVE_INTERVAL TABLE_SLICE_MB TABLE_SLICE_JOBS
+    THROTTLE_NICE THROTTLE_IO_LEVEL THROTTLE_INTERVAL THROTTLE_MAX_ACTIVE THROTTLE_MAX_LAG
+    REPLICA_MAX_LAG REPLICA_CONNECT_TIMEOUT SEEKABLE_BLOCK_MB RESTORE_CACHE_MAX_MB
+    RESTORE_SWAP_LOCK_TIMEOUT RESTORE_KEEP_OLD_HOURS
+    UPLOAD_QUEUE_CONCURRENCY UPLOAD_QUEUE_MAX_MB UPLOAD_QUEUE_INTERVAL
   )
 
   {
@@ -260,6 +340,36 @@ setup_cron_env() {
   fi
 }
 
+############################################
+# WAL archiver (BACKUP_MODE=physical)
+# Runs next to cron or the scheduler and streams WAL continuously.
+############################################
+start_wal_archiver() {
+  [[ "${BACKUP_MODE,,}" == "physical" && "${WAL_ARCHIVING}" =~ ^([Tt][Rr][Uu][Ee])$ ]] || return 0
+
+  echo -e "\e[32m [Entrypoint] Start the WAL archiver in the background. \033[0m"
+  if [[ ${RUN_AS_ROOT} =~ [Tt][Rr][Uu][Ee] ]]; then
+    /backup-scripts/wal_archiver.sh &
+  else
+    gosu "${user}" /backup-scripts/wal_archiver.sh &
+  fi
+}
+
+############################################
+# Upload queue (UPLOAD_QUEUE with S3)
+# Runs next to cron or the scheduler and uploads queued dumps.
+############################################
+start_upload_queue() {
+  [[ "${STORAGE_BACKEND}" =~ ^([Ss]3)$ && "${UPLOAD_QUEUE}" =~ ^([Tt][Rr][Uu][Ee])$ ]] || return 0
+
+  echo -e "\e[32m [Entrypoint] Start the upload queue in the background. \033[0m"
+  if [[ ${RUN_AS_ROOT} =~ [Tt][Rr][Uu][Ee] ]]; then
+    /backup-scripts/upload_queue.sh &
+  else
+    gosu "${user}" /backup-scripts/upload_queue.sh &
+  fi
+}
+
 run_backup() {
   non_root_permission "${user}" "${group}"
 
@@ -274,12 +384,29 @@ run_backup() {
     echo -e "\e[32m [Entrypoint] If CONSOLE_LOGGING=True, logs appear in Docker output else the logs are written to file. \033[0m"
     chmod gu+rw /var/run
     chmod gu+s /usr/sbin/cron
+    start_wal_archiver
+    start_upload_queue
     eval "${cron_tab_command}"
     eval "${cron_command}"
   fi
 }
 
 
+run_scheduler() {
+  non_root_permission "${user}" "${group}"
+
+  echo -e "\e[32m --------------------------------------------------------- \033[0m"
+  echo -e "\e[32m [Entrypoint] Run the resident backup scheduler.           \033[0m"
+  echo -e "\e[32m [Entrypoint] If CONSOLE_LOGGING=True, logs appear in Docker output else the logs are written to file. \033[0m"
+  start_wal_archiver
+  start_upload_queue
+  if [[ ${RUN_AS_ROOT} =~ [Tt][Rr][Uu][Ee] ]]; then
+    exec /backup-scripts/scheduler.sh
+  else
+    exec gosu "${user}" /backup-scripts/scheduler.sh
+  fi
+}
+
 run_restore() {
   echo -e "\e[32m ------------------------------- \033[0m"
   echo -e "\e[32m [Entrypoint] Run restore logic. \033[0m"
@@ -304,6 +431,9 @@ case "${ENTRYPOINT_START,,}" in
   backup)
     run_backup
     ;;
+  scheduler)
+    run_scheduler
+    ;;
   restore)
     run_restore
     ;;
@@ -313,7 +443,7 @@ case "${ENTRYPOINT_START,,}" in
   *)
     echo -e "\e[32m ------------------------------------------------------------ \033[0m"
     echo -e "\e[32m [Entrypoint] Invalid ENTRYPOINT_START='${ENTRYPOINT_START}'. \033[0m"
-    echo -e "\e[32m [Entrypoint] Valid values: backup | restore | shell., defaulting to backup \033[0m"
+    echo -e "\e[32m [Entrypoint] Valid values: backup | scheduler | restore | shell., defaulting to backup \033[0m"
     ENTRYPOINT_START=backup
     ;;
 esac
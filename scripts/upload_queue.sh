@@ -0,0 +1,72 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+shopt -s inherit_errexit
+
+############################################
+# STDOUT redirection
+############################################
+if [[ "${CONSOLE_LOGGING:-false}" =~ ^([Tt][Rr][Uu][Ee])$ ]]; then
+  exec >> /proc/1/fd/1 2>&1
+fi
+
+############################################
+# Paths
+############################################
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+LIB_DIR="${SCRIPT_DIR}/lib"
+
+############################################
+# Load libraries
+############################################
+
+configure_sources() {
+  # Always source the environment file first
+  [[ -f /backup-scripts/pgenv.sh ]] && source /backup-scripts/pgenv.sh
+
+  # List of library modules to source
+  local libs=(
+    logging
+    monitoring
+    metrics
+    db
+    compression
+    catalog
+    s3
+    upload_queue
+    utils
+  )
+
+  for lib in "${libs[@]}"; do
+    local file="${LIB_DIR}/${lib}.sh"
+    if [[ -f "$file" ]]; then
+      source "$file"
+    else
+      echo "Warning: missing library $file" >&2
+    fi
+  done
+}
+configure_sources
+
+if [ -z "${MYBASEDIR:-}" ]; then
+  export MYBASEDIR="/${BUCKET:-backups}"
+fi
+
+############################################
+# Traps
+############################################
+trap 'on_error $LINENO' ERR
+trap 'on_terminate' SIGTERM SIGINT
+
+############################################
+# Init
+############################################
+init_logging
+
+log "Upload queue started at $(date +%d-%B-%Y-%H-%M)" true
+
+s3_init
+
+############################################
+# Upload queued artifacts until terminated
+############################################
+upload_queue_loop